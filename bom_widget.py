@@ -0,0 +1,115 @@
+"""
+This module houses the bill of materials panel which lists how many beads
+of each type the active design needs.
+"""
+from PyQt5.QtCore import *
+from PyQt5.QtGui import *
+from PyQt5.QtWidgets import *
+
+import csv
+import math
+
+from util import *
+
+
+
+class BillOfMaterials(QWidget):
+    """Shows the bead counts of a design with estimates of the weight and the
+    number of tubes to order. The counts are kept up to date by the design itself,
+    this widget only redraws when they change."""
+    def __init__(self, parent=None):
+        super(BillOfMaterials, self).__init__(parent)
+        self.setWindowTitle('Bill of Materials')
+        self.design = None
+
+        self.table = QTreeWidget()
+        self.table.setColumnCount(5)
+        self.table.setHeaderLabels(['Name', 'Catalog Number', 'Count', 'Grams', 'Tubes'])
+        self.table.setRootIsDecorated(False)
+
+        self.beads_per_gram = QDoubleSpinBox()
+        self.beads_per_gram.setRange(1, 10000)
+        self.beads_per_gram.setValue(200)
+        self.beads_per_gram.valueChanged.connect(self.refresh)
+
+        self.grams_per_tube = QDoubleSpinBox()
+        self.grams_per_tube.setRange(0.1, 1000)
+        self.grams_per_tube.setValue(7.5)
+        self.grams_per_tube.valueChanged.connect(self.refresh)
+
+        export_button = QPushButton('Export...')
+        export_button.clicked.connect(self.export)
+
+        form = QFormLayout()
+        form.addRow('Beads per gram:', self.beads_per_gram)
+        form.addRow('Grams per tube:', self.grams_per_tube)
+
+        vbox = QVBoxLayout()
+        vbox.addWidget(self.table)
+        vbox.addLayout(form)
+        vbox.addWidget(export_button)
+        self.setLayout(vbox)
+
+
+    def set_design(self, design):
+        """Switches to showing another design (or nothing if design is None)."""
+        if self.design:
+            self.design.counts_changed.disconnect(self.refresh)
+
+        self.design = design
+        if self.design:
+            self.design.counts_changed.connect(self.refresh)
+
+        self.refresh()
+
+
+    def rows(self):
+        """Returns [(name, catalog number, count, grams, tubes)] for the design."""
+        if not self.design:
+            return []
+
+        # Several palette entries can stand for the same bead type, merge them by catalog number.
+        totals = {}
+        for index, count in enumerate(self.design.bead_counts().tolist()):
+            if index and count:
+                bead_type = self.design.palette[index]
+                key = (bead_type.data(0, Qt.DisplayRole), bead_type.data(1, Qt.DisplayRole))
+                totals[key] = totals.get(key, 0) + count
+
+        rows = []
+        for (name, catalog_number), count in sorted(totals.items(), key=lambda item: item[0][1]):
+            grams = count / self.beads_per_gram.value()
+            rows.append((name, catalog_number, count, grams, math.ceil(grams / self.grams_per_tube.value())))
+
+        return rows
+
+
+    def refresh(self):
+        self.table.clear()
+        for name, catalog_number, count, grams, tubes in self.rows():
+            item = QTreeWidgetItem([name, catalog_number, str(count), '{:.1f}'.format(grams), str(tubes)])
+            for column in (2, 3, 4):
+                item.setTextAlignment(column, Qt.AlignRight)
+
+            self.table.addTopLevelItem(item)
+
+
+    def export(self):
+        """Saves the bill of materials as a CSV file."""
+        if not self.design:
+            return
+
+        name_s = '_'.join(self.design.name.lower().split(' '))
+        (path, flt) = QFileDialog.getSaveFileName(self, 'Export Bill of Materials',
+                                                  './{}_materials.csv'.format(name_s),
+                                                  'CSV File (*.csv)')
+
+        if flt == '':
+            # They clicked cancel.
+            return
+
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['Name', 'Catalog Number', 'Count', 'Grams', 'Tubes'])
+            for name, catalog_number, count, grams, tubes in self.rows():
+                writer.writerow([name, catalog_number, count, '{:.2f}'.format(grams), tubes])
@@ -0,0 +1,114 @@
+"""
+This module houses the local library the catalog is kept in between sessions,
+an SQLite database in the user's data directory. Collections are listed in the
+order they were added, which is their order in the catalog, and bead types
+are indexed by catalog number and name so they can be found without loading
+every collection.
+"""
+from PyQt5.QtCore import *
+
+import os
+import sqlite3
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS collections (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bead_types (
+    collection INTEGER NOT NULL REFERENCES collections (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    name TEXT,
+    catalog_number TEXT,
+    base_color TEXT,
+    highlight_color TEXT,
+    texture INTEGER,
+    PRIMARY KEY (collection, position)
+);
+CREATE INDEX IF NOT EXISTS bead_types_by_number ON bead_types (catalog_number);
+CREATE INDEX IF NOT EXISTS bead_types_by_name ON bead_types (name);
+'''
+
+_FIELDS = ('__name__', '__catalog_number__', '__base_color__', '__highlight_color__', '__texture__')
+_COLUMNS = {'__catalog_number__': 'catalog_number', '__name__': 'name'}
+
+
+
+def catalog_store_path():
+    """Where the catalog library lives, the directory is created if needed."""
+    directory = QStandardPaths.writableLocation(QStandardPaths.AppDataLocation)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, 'catalog.sqlite')
+
+
+
+class CatalogStore(object):
+    """The collections and bead types of the catalog. Bead types are passed around
+    as the same dictionaries collection files hold."""
+    def __init__(self, path):
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.execute('PRAGMA foreign_keys = ON')
+        self._connection.executescript(_SCHEMA)
+
+
+    def collections(self):
+        """Returns [(id, name)] of every collection in catalog order."""
+        return self._connection.execute('SELECT id, name FROM collections ORDER BY id').fetchall()
+
+
+    def bead_types(self, collection_id):
+        """Returns the bead type dictionaries of a collection in order."""
+        rows = self._connection.execute('SELECT name, catalog_number, base_color, highlight_color, texture '
+                                        'FROM bead_types WHERE collection = ? ORDER BY position',
+                                        (collection_id,))
+        return [dict(zip(_FIELDS, row)) for row in rows]
+
+
+    def find(self, key, value):
+        """Returns the id of the first collection holding a bead type whose key
+        (__catalog_number__ or __name__) is value, or None."""
+        row = self._connection.execute('SELECT collection FROM bead_types WHERE {} = ? '
+                                       'ORDER BY collection, position LIMIT 1'.format(_COLUMNS[key]),
+                                       (value,)).fetchone()
+        return row[0] if row else None
+
+
+    def add_collection(self, name, bead_types=()):
+        """Stores a new collection after the others, returns its id."""
+        with self._connection:
+            collection_id = self._connection.execute('INSERT INTO collections (name) VALUES (?)', (name,)).lastrowid
+            self._insert(collection_id, 0, bead_types)
+
+        return collection_id
+
+
+    def add_bead_type(self, collection_id, bead_type):
+        """Appends a bead type to a stored collection."""
+        with self._connection:
+            position = self._connection.execute('SELECT COUNT(*) FROM bead_types WHERE collection = ?',
+                                                (collection_id,)).fetchone()[0]
+            self._insert(collection_id, position, [bead_type])
+
+
+    def update_bead_type(self, collection_id, position, bead_type):
+        """Replaces the bead type at position in a stored collection."""
+        with self._connection:
+            self._connection.execute('UPDATE bead_types SET name = ?, catalog_number = ?, base_color = ?, '
+                                     'highlight_color = ?, texture = ? WHERE collection = ? AND position = ?',
+                                     tuple(bead_type[field] for field in _FIELDS) + (collection_id, position))
+
+
+    def remove_collection(self, collection_id):
+        with self._connection:
+            self._connection.execute('DELETE FROM collections WHERE id = ?', (collection_id,))
+
+
+    def close(self):
+        self._connection.close()
+
+
+    def _insert(self, collection_id, start, bead_types):
+        self._connection.executemany('INSERT INTO bead_types VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                     ((collection_id, position) + tuple(bead_type[field] for field in _FIELDS)
+                                      for position, bead_type in enumerate(bead_types, start)))
@@ -2,36 +2,142 @@ from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 
+from design_format import BLANK_CATALOG_NUMBER
 from util import *
-from wizards_and_dialogs import *
 
 import json
 
 
 
+def blank_bead_type():
+    """The bead type empty cells of a design are shown with."""
+    return BeadType('blank', BLANK_CATALOG_NUMBER, QBrush(QColor(230, 230, 228)), '#e6e6e4', '#e6e6e4', 10)
+
+
+
 class Catalog(QTreeWidget):
-    def __init__(self, parent=None):
+    """The tree of bead collections. With a CatalogStore every change is kept in
+    it, and the collections restored from it only create their bead types when
+    they're expanded or one of their types is looked up."""
+    def __init__(self, parent=None, store=None):
         super(Catalog, self).__init__(parent)
         self.setWindowTitle('Catalog')
 
         self.setColumnCount(2)
         self.setHeaderLabels(['Name', 'Catalog Number'])
 
+        # Lookup tables from catalog number and name to the bead types carrying them.
+        self._by_number = {}
+        self._by_name = {}
+        self._indexed_keys = {}
+        self.itemChanged.connect(self._reindex_type)
+
+        self.store = store
+        # Stored collections whose bead types aren't loaded yet, by store id.
+        self._unloaded = {}
+        # The (key, value) pairs the store was already asked about since the
+        # unloaded collections last changed, see _load_match.
+        self._looked_up = set()
+        self.itemExpanded.connect(self._load_collection)
+
     def add_collection(self, collection):
+        if self.store and collection.store_id is None:
+            collection.store_id = self.store.add_collection(collection.data(0, Qt.DisplayRole),
+                                                            [bead_type.to_dict() for bead_type in collection.bead_types])
+
         self.addTopLevelItem(collection)
 
+        if collection.loaded:
+            for bead_type in collection.bead_types:
+                self._index_type(bead_type)
+
+        else:
+            self._unloaded[collection.store_id] = collection
+            self._looked_up.clear()
+
+    def remove_collection(self, collection):
+        self.takeTopLevelItem(self.indexOfTopLevelItem(collection))
+        self._unloaded.pop(collection.store_id, None)
+        self._looked_up.clear()
+
+        if collection.loaded:
+            for bead_type in collection.bead_types:
+                self._unindex_type(bead_type)
+
+        if self.store and collection.store_id is not None:
+            self.store.remove_collection(collection.store_id)
+
     def current_item(self):
         return self.currentItem()
 
     def find_type(self, type_catalog_id):
-        try:
-            # Return the first match
-            return self.findItems(type_catalog_id, Qt.MatchRecursive, 1)[0]
-
-        except IndexError:
+        """Returns the bead type with the given catalog number or None."""
+        self._load_match('__catalog_number__', type_catalog_id)
+        return self._first_match(self._by_number.get(type_catalog_id))
+
+    def find_type_by_name(self, name):
+        """Returns the bead type with the given name or None."""
+        self._load_match('__name__', name)
+        return self._first_match(self._by_name.get(name))
+
+    def _load_match(self, key, value):
+        """Loads the collection the store finds the first match in, if it isn't yet.
+        The store is only asked once per value, after that the match (if any) is loaded."""
+        if self._unloaded and (key, value) not in self._looked_up:
+            self._looked_up.add((key, value))
+            collection_id = self.store.find(key, value)
+            if collection_id in self._unloaded:
+                self._unloaded[collection_id].load()
+
+    def _load_collection(self, item):
+        """Slot that creates the bead types of a collection when it's expanded."""
+        if item.type() == 1000:
+            item.load()
+
+    def _first_match(self, bead_types):
+        if not bead_types:
             # Found nothing
             return None
 
+        if len(bead_types) == 1:
+            return bead_types[0]
+
+        # Duplicates resolve to the first one in tree order, just like findItems did.
+        return min(bead_types, key=self._tree_position)
+
+    def _tree_position(self, bead_type):
+        collection = bead_type.parent()
+        return (self.indexOfTopLevelItem(collection), collection.indexOfChild(bead_type))
+
+    def _index_type(self, bead_type):
+        keys = (bead_type.data(1, Qt.DisplayRole), bead_type.data(0, Qt.DisplayRole))
+        self._by_number.setdefault(keys[0], []).append(bead_type)
+        self._by_name.setdefault(keys[1], []).append(bead_type)
+        self._indexed_keys[id(bead_type)] = keys
+
+    def _unindex_type(self, bead_type):
+        try:
+            number, name = self._indexed_keys.pop(id(bead_type))
+
+        except KeyError:
+            return
+
+        for table, key in ((self._by_number, number), (self._by_name, name)):
+            table[key].remove(bead_type)
+            if not table[key]:
+                del table[key]
+
+    def _reindex_type(self, item, column):
+        """Slot that keeps the lookup tables and the store up to date when a bead type is edited."""
+        if item.type() == 1001 and id(item) in self._indexed_keys:
+            old_keys = self._indexed_keys[id(item)]
+            self._unindex_type(item)
+            self._index_type(item)
+
+            collection = item.parent()
+            if self.store and collection.store_id is not None and self._indexed_keys[id(item)] != old_keys:
+                self.store.update_bead_type(collection.store_id, collection.indexOfChild(item), item.to_dict())
+
     def contextMenuEvent(self, evt):
         """Creates and shows a context menu."""
 
@@ -55,6 +161,9 @@ class Catalog(QTreeWidget):
         export_collection_action = popup.addAction('Export Collection')
         export_collection_action.triggered.connect(self.export_collection)
 
+        remove_collection_action = popup.addAction('Remove Collection')
+        remove_collection_action.triggered.connect(self.remove_collection_slot)
+
         popup.exec_(evt.globalPos())
 
 
@@ -72,17 +181,26 @@ class Catalog(QTreeWidget):
 
     def add_collection_slot(self):
         """Slot for calling a nw collection wizard."""
+        # The wizards are only loaded once they're needed.
+        from wizards_and_dialogs import CollectionWizard
         wizard = CollectionWizard(self)
         wizard.exec_()
 
 
     def add_bead_slot(self):
         """Slot for calling a new bead wizard."""
+        from wizards_and_dialogs import BeadWizard
+
         # Assume that the right clicked item is a collection.
         wizard = BeadWizard(self.currentItem())
         wizard.exec_()
 
 
+    def remove_collection_slot(self):
+        """Slot for removing the right clicked collection."""
+        self.remove_collection(self.currentItem())
+
+
     def export_collection(self):
         collection = self.currentItem()
         name_s = '_'.join(collection.data(0,  Qt.DisplayRole).lower().split(' '))
@@ -109,6 +227,14 @@ class Catalog(QTreeWidget):
             self.import_collection(path)
 
 
+    def restore_collections(self):
+        """Adds the collections kept in the store, only their names are read here."""
+        present = {self.topLevelItem(index).store_id for index in range(0, self.topLevelItemCount())}
+        for store_id, name in self.store.collections():
+            if store_id not in present:
+                self.add_collection(Collection(name, store_id=store_id))
+
+
     def import_collection(self, path):
         with open(path, 'r') as file:
             rdict = json.load(file)
@@ -116,37 +242,76 @@ class Catalog(QTreeWidget):
             bt_list = rdict['__bead_types__']
 
             new_collection = Collection(name)
-
-            for bt in bt_list:
-                name = bt['__name__']
-                catalog_number = bt['__catalog_number__']
-                base_color = bt['__base_color__']
-                highlight_color = bt['__highlight_color__']
-                texture = bt['__texture__']
-
-                brush = brush_factory(QColor(base_color), QColor(highlight_color), texture)
-
-                new_bead_type = BeadType(name, catalog_number, brush, base_color, highlight_color, texture)
-
-                new_collection.addChild(new_bead_type)
+            new_collection.add_bead_types(bt_list)
 
             self.add_collection(new_collection)
 
 
 
 class Collection(QTreeWidgetItem):
-    def __init__(self, name):
+    def __init__(self, name, store_id=None):
+        """A collection restored from the catalog store (store_id given) is empty
+        until load() is called."""
         super(Collection, self).__init__(1000)
         self.setData(0, Qt.DisplayRole, QVariant(name))
-        self.bead_types = []
+        self.store_id = store_id
+        self.loaded = store_id is None
+        self._bead_types = []
+
+        if not self.loaded:
+            self.setChildIndicatorPolicy(QTreeWidgetItem.ShowIndicator)
+
+
+    @property
+    def bead_types(self):
+        self.load()
+        return self._bead_types
+
+
+    def load(self):
+        """Creates the bead types of a collection restored from the store."""
+        if self.loaded:
+            return
+
+        self.loaded = True
+        catalog = self.treeWidget()
+        catalog._unloaded.pop(self.store_id, None)
+        self.setChildIndicatorPolicy(QTreeWidgetItem.DontShowIndicatorWhenChildless)
+        self._add_children(catalog.store.bead_types(self.store_id))
+
+
+    def add_bead_types(self, bt_list):
+        """Adds bead types from their dictionaries (as stored in collection files)."""
+        self.load()
+        self._add_children(bt_list)
+
+
+    def _add_children(self, bt_list):
+        children = [BeadType(bt['__name__'], bt['__catalog_number__'], None,
+                             bt['__base_color__'], bt['__highlight_color__'], bt['__texture__'])
+                    for bt in bt_list]
+        self._bead_types += children
+        super(Collection, self).addChildren(children)
+
+        if self.treeWidget():
+            for child in children:
+                self.treeWidget()._index_type(child)
 
 
     def addChild(self, child):
         """Only add child if it's a bead type instance..."""
         if child.type() == 1001:
-            self.bead_types.append(child)
+            self.load()
+            self._bead_types.append(child)
             super(Collection, self).addChild(child)
 
+            catalog = self.treeWidget()
+            if catalog:
+                catalog._index_type(child)
+
+                if catalog.store and self.store_id is not None:
+                    catalog.store.add_bead_type(self.store_id, child.to_dict())
+
 
     def to_dict(self):
         rdict = {}
@@ -167,7 +332,7 @@ class BeadType(QTreeWidgetItem):
         self.setData(1, Qt.DisplayRole, QVariant(catalog_number))
         self.base_color, self.highlight_color, self.catalog_number = base_color, highlight_color, catalog_number
         self.texture = texture
-        self.set_pixmap(brush)
+        self._brush = brush
 
 
     def addChild(self, child):
@@ -185,20 +350,33 @@ class BeadType(QTreeWidgetItem):
         return rdict
 
 
-    def set_pixmap(self, brush):
-        global bead_painter
-        # NOTE: This is hard coded here, but not elswhere
-        self.pixmap = QPixmap(28, 40)
-        self.pixmap.fill(QColor(0, 0, 0, 0))
+    @property
+    def pixmap(self):
+        """The bead's pixmap at 100% zoom, shared with every bead that looks the same."""
+        return self.pixmap_at(1.0)
 
-        # paint the icon...
-        bead_painter.begin(self.pixmap)
 
-        bead_painter.setPen(QColor(170, 170, 168))
-        bead_painter.setBrush(brush)
-        # TODO: shape this nicer.
-        bead_painter.drawRoundedRect(0, 0, 27, 39, 5, 5)
+    def pixmap_at(self, zoom, device_scale=1.0):
+        """The bead's pixmap rendered for the given zoom and device pixel ratio."""
+        return bead_pixmaps.pixmap(self.base_color, self.highlight_color, self.texture, zoom, device_scale)
+
+
+    @property
+    def brush(self):
+        """The brush is only made when something asks for it."""
+        if self._brush is None:
+            self._brush = brush_factory(QColor(self.base_color), QColor(self.highlight_color), self.texture)
+
+        return self._brush
+
+
+    def set_pixmap(self, brush):
+        self._brush = brush
+
 
-        bead_painter.end()
+    def data(self, column, role):
+        """The icon is only rendered once the row is shown."""
+        if column == 0 and role == Qt.DecorationRole:
+            return QIcon(self.pixmap)
 
-        self.setIcon(0, QIcon(self.pixmap))
+        return super(BeadType, self).data(column, role)
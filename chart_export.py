@@ -0,0 +1,284 @@
+"""
+This module exports designs as printable charts, a multi-page PDF or a set of
+PNG pages. The design is split into page sized tiles which are drawn straight
+from the cell array with the grid, row and column numbers on top, and a legend
+of the bead types comes first. Pages are rendered on worker threads and
+written out one at a time, so only a few pages are ever in memory whatever
+the size of the design.
+"""
+from PyQt5.QtCore import *
+from PyQt5.QtGui import *
+
+from collections import deque
+import concurrent.futures
+import os
+
+import numpy
+
+from design_model import Bead
+from util import *
+
+MM_PER_INCH = 25.4
+
+
+
+class ChartLayout(object):
+    """Works out how the design is split up into pages. All sizes are in pixels
+    at the given dpi unless noted otherwise."""
+    def __init__(self, design, page_size=QPageSize.A4, dpi=150, bead_size=4.0, margin=10.0):
+        """bead_size is the width of a bead on paper and margin the page margin, both in mm."""
+        self.design, self.dpi = design, dpi
+        self.page_size = QPageSize(page_size)
+        self.page = self.page_size.sizePixels(dpi)
+        self.margin = int(margin / MM_PER_INCH * dpi)
+        self.scale = bead_size / MM_PER_INCH * dpi / Bead.pitch[WIDTH]
+
+        self.font = QFont('Sans', 8)
+        self.title_font = QFont('Sans', 11, QFont.Bold)
+        metrics = QFontMetricsF(self.font, _PaintDevice(dpi))
+        self.line_height = metrics.height()
+        self.number_width = metrics.width('00000')
+        self.title_height = QFontMetricsF(self.title_font, _PaintDevice(dpi)).height() * 1.6
+
+        # Where the beads start on a chart page.
+        self.origin = QPointF(self.margin + self.number_width, self.margin + self.title_height + self.line_height)
+
+        width, height = design.dimensions
+        bead_width, bead_height = Bead.pitch[WIDTH] * self.scale, Bead.pitch[HEIGHT] * self.scale
+        cols = max(1, int((self.page.width() - self.origin.x() - self.margin) // bead_width))
+        rows = max(1, int((self.page.height() - self.origin.y() - self.margin -
+                           (Bead.margain + Bead.dimension[HEIGHT] // 2) * self.scale) // bead_height))
+
+        # Break pages on whole tracks and bands of rows where they fit.
+        if cols > design.track_width:
+            cols -= cols % design.track_width
+
+        if rows > 5:
+            rows -= rows % 5
+
+        self.cols, self.rows = min(cols, width), min(rows, height)
+        self.tiles = [(col, row) for row in range(0, height, self.rows) for col in range(0, width, self.cols)]
+
+        # The legend lists the bead types the design uses.
+        counts = design.bead_counts()
+        self.legend = [(QColor(design.palette[index].base_color).rgb(),
+                        design.palette[index].data(1, Qt.DisplayRole),
+                        design.palette[index].data(0, Qt.DisplayRole),
+                        int(counts[index]))
+                       for index in range(1, len(design.palette)) if counts[index]]
+        self.legend_row = self.line_height * 1.8
+        per_page = max(1, int((self.page.height() - 2 * self.margin - self.title_height) // self.legend_row))
+        self.legend_pages = [self.legend[start:start + per_page] for start in range(0, len(self.legend), per_page)]
+
+    def __len__(self):
+        return len(self.legend_pages) + len(self.tiles)
+
+    def new_page(self):
+        image = QImage(self.page, QImage.Format_RGB32)
+        image.fill(Qt.white)
+        dots_per_meter = int(round(self.dpi / MM_PER_INCH * 1000))
+        image.setDotsPerMeterX(dots_per_meter)
+        image.setDotsPerMeterY(dots_per_meter)
+        return image
+
+    def title(self, painter, number, text):
+        painter.setFont(self.title_font)
+        painter.setPen(Qt.black)
+        painter.drawText(QRectF(self.margin, self.margin, self.page.width() - 2 * self.margin, self.title_height),
+                         Qt.AlignLeft | Qt.AlignTop,
+                         '{} - page {} of {}: {}'.format(self.design.name, number, len(self), text))
+
+
+
+class _PaintDevice(QPaintDevice):
+    """Lets font metrics be taken at the dpi of the chart before any page exists."""
+    def __init__(self, dpi):
+        super(_PaintDevice, self).__init__()
+        self.dpi = dpi
+
+    def metric(self, metric):
+        if metric in (QPaintDevice.PdmDpiX, QPaintDevice.PdmDpiY,
+                      QPaintDevice.PdmPhysicalDpiX, QPaintDevice.PdmPhysicalDpiY):
+            return self.dpi
+
+        return super(_PaintDevice, self).metric(metric)
+
+    def paintEngine(self):
+        return None
+
+
+
+def render_legend_page(layout, number, entries):
+    """Renders one page of the legend, returns the QImage."""
+    image = layout.new_page()
+    painter = QPainter(image)
+    painter.setRenderHint(QPainter.Antialiasing)
+    layout.title(painter, number, 'legend')
+
+    painter.setFont(layout.font)
+    swatch = layout.line_height * 1.4
+    columns = (swatch * 1.5, swatch * 1.5 + layout.number_width * 2, layout.page.width() - 2 * layout.margin - layout.number_width * 2)
+    y = layout.margin + layout.title_height
+    for rgb, catalog_number, name, count in entries:
+        painter.setPen(QPen(Qt.black, 1))
+        painter.setBrush(QColor(rgb))
+        painter.drawRoundedRect(QRectF(layout.margin, y, swatch * 0.7, swatch), 2, 2)
+
+        for x, text, align in ((columns[0], catalog_number, Qt.AlignLeft),
+                               (columns[1], name, Qt.AlignLeft),
+                               (columns[2], '{} beads'.format(count), Qt.AlignRight)):
+            painter.drawText(QRectF(layout.margin + x, y, layout.number_width * 2 if x == columns[2] else columns[2] - x,
+                                    swatch), align | Qt.AlignVCenter, str(text))
+
+        y += layout.legend_row
+
+    painter.end()
+    return image
+
+
+def render_chart_page(layout, number, tile, cells, colors):
+    """Renders the beads of one tile starting at tile (col, row), cells is the
+    block of the cell array it covers. Returns the QImage."""
+    design, scale = layout.design, layout.scale
+    col_from, row_from = tile
+    rows, cols = cells.shape
+    col_to, row_to = col_from + cols, row_from + rows
+
+    image = layout.new_page()
+    painter = QPainter(image)
+    layout.title(painter, number, 'columns {}-{}, rows {}-{}'.format(col_from + 1, col_to, row_from + 1, row_to))
+
+    # The beads and the grid are drawn in scene coordinates.
+    painter.save()
+    painter.translate(layout.origin)
+    painter.scale(scale, scale)
+    painter.translate(-col_from * Bead.pitch[WIDTH], -row_from * Bead.pitch[HEIGHT])
+    area = QRectF(col_from * Bead.pitch[WIDTH], row_from * Bead.pitch[HEIGHT],
+                  cols * Bead.pitch[WIDTH] + Bead.margain,
+                  rows * Bead.pitch[HEIGHT] + Bead.margain + Bead.dimension[HEIGHT] // 2)
+    painter.setClipRect(area)
+    painter.setPen(Qt.NoPen)
+
+    xs = numpy.arange(col_from, col_to) * Bead.pitch[WIDTH] + Bead.margain
+    offsets = numpy.where(numpy.arange(col_from, col_to) // design.track_width % 2, Bead.dimension[HEIGHT] // 2, 0)
+    ys = numpy.arange(row_from, row_to)[:, None] * Bead.pitch[HEIGHT] + Bead.margain + offsets[None, :]
+
+    # One batch of rects per colour.
+    for index in numpy.unique(cells).tolist():
+        rows_at, cols_at = numpy.nonzero(cells == index)
+        painter.setBrush(QColor(colors[index]))
+        painter.drawRects([QRectF(x, y, Bead.dimension[WIDTH], Bead.dimension[HEIGHT])
+                           for x, y in zip(xs[cols_at].tolist(), ys[rows_at, cols_at].tolist())])
+
+    design.grid.draw(painter, *design.grid.visible_range(area))
+    painter.restore()
+
+    # Numbers go in the margins, every one of them if there's room, otherwise every fifth.
+    painter.setFont(layout.font)
+    painter.setPen(Qt.black)
+    bead_width, bead_height = Bead.pitch[WIDTH] * scale, Bead.pitch[HEIGHT] * scale
+    col_step = 1 if bead_width >= layout.number_width * 0.7 else 5
+    row_step = 1 if bead_height >= layout.line_height else 5
+
+    for col in range(col_from, col_to):
+        if col == col_from or (col + 1) % col_step == 0:
+            x = layout.origin.x() + ((col - col_from) * Bead.pitch[WIDTH] + Bead.margain) * scale
+            painter.drawText(QRectF(x - bead_width, layout.origin.y() - layout.line_height, 3 * bead_width, layout.line_height),
+                             Qt.AlignHCenter | Qt.AlignBottom, str(col + 1))
+
+    for row in range(row_from, row_to):
+        if row == row_from or (row + 1) % row_step == 0:
+            y = layout.origin.y() + ((row - row_from) * Bead.pitch[HEIGHT] + Bead.margain) * scale
+            painter.drawText(QRectF(layout.margin, y, layout.number_width * 0.9, Bead.dimension[HEIGHT] * scale),
+                             Qt.AlignRight | Qt.AlignVCenter, str(row + 1))
+
+    painter.end()
+    return image
+
+
+def _pages(layout, colors):
+    """Yields (function, args) for every page in order, the cells of each tile
+    are copied out here on the calling thread."""
+    number = 1
+    for entries in layout.legend_pages:
+        yield render_legend_page, (layout, number, entries)
+        number += 1
+
+    for col, row in layout.tiles:
+        cells = numpy.array(layout.design.cells[row:row + layout.rows, col:col + layout.cols])
+        yield render_chart_page, (layout, number, (col, row), cells, colors)
+        number += 1
+
+
+def png_page_path(path, number):
+    """chart.png becomes chart_001.png, chart_002.png and so on."""
+    base, extension = os.path.splitext(path)
+    return '{}_{:03d}{}'.format(base, number, extension or '.png')
+
+
+def _save_png(path, function, args):
+    image = function(*args)
+    if not image.save(path, 'PNG'):
+        raise IOError('Could not write {}'.format(path))
+
+
+def export_chart(design, path, page_size=QPageSize.A4, dpi=150, bead_size=4.0, progress=None, workers=None):
+    """Writes the chart of design to path, a PDF unless path ends in .png in which
+    case every page becomes its own PNG file. progress(done, total) is called
+    after every page, returning False from it stops the export."""
+    layout = ChartLayout(design, page_size, dpi, bead_size)
+    colors = [QColor(bead_type.base_color).rgb() for bead_type in design.palette]
+    pdf = not path.lower().endswith('.png')
+    workers = workers or os.cpu_count() or 1
+
+    if pdf:
+        writer = QPdfWriter(path)
+        writer.setResolution(dpi)
+        writer.setPageSize(layout.page_size)
+        writer.setPageMargins(QMarginsF(0, 0, 0, 0))
+        writer.setTitle(design.name)
+        painter = QPainter(writer)
+
+    # Only a couple of pages per worker are ever queued or waiting to be written.
+    pending = deque()
+    pages = _pages(layout, colors)
+    done, total = 0, len(layout)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            while True:
+                while len(pending) < 2 * workers:
+                    try:
+                        function, args = next(pages)
+
+                    except StopIteration:
+                        break
+
+                    if pdf:
+                        pending.append(executor.submit(function, *args))
+
+                    else:
+                        pending.append(executor.submit(_save_png, png_page_path(path, args[1]), function, args))
+
+                if not pending:
+                    break
+
+                result = pending.popleft().result()
+                if pdf:
+                    if done:
+                        writer.newPage()
+
+                    painter.drawImage(QRectF(0, 0, layout.page.width(), layout.page.height()), result)
+
+                done += 1
+                if progress and progress(done, total) is False:
+                    break
+
+        finally:
+            for future in pending:
+                future.cancel()
+
+            if pdf:
+                painter.end()
+
+    return done
@@ -0,0 +1,114 @@
+"""
+This module converts the cell array of a design to and from the compact
+run-length encoded rows used by version 2 of the .peyd format.
+Version 1 files store a list of {'__bead_type__', '__x__', '__y__'} objects,
+version 2 files store a palette header and one [count, index, count, index, ...]
+list per row, index 0 of the palette is always the blank bead.
+"""
+import numpy
+
+FORMAT_VERSION = 2
+
+# Blank cells are saved with the catalog number of the blank bead type, it is
+# always palette index 0 and never looked up in the catalog.
+BLANK_CATALOG_NUMBER = 'n/a'
+
+
+
+def file_version(rdict):
+    """Returns the format version of a loaded design dictionary."""
+    return rdict.get('__version__', 1)
+
+
+def encode_rows(cells):
+    """Run-length encodes every row of the 2D cells array."""
+    height, width = cells.shape
+    if not cells.size:
+        return [[] for row in range(0, height)]
+
+    flat = cells.ravel()
+
+    # A run starts wherever the value changes or a new row begins.
+    starts = numpy.flatnonzero(numpy.diff(flat)) + 1
+    starts = numpy.union1d(starts, numpy.arange(0, flat.size, width))
+    counts = numpy.diff(numpy.append(starts, flat.size))
+    values = flat[starts]
+
+    # Interleave the counts and values then split them up by row.
+    runs = numpy.empty(starts.size * 2, dtype=numpy.int64)
+    runs[0::2] = counts
+    runs[1::2] = values
+    row_ends = numpy.searchsorted(starts, numpy.arange(width, flat.size + 1, width)) * 2
+
+    runs = runs.tolist()
+    rows, begin = [], 0
+    for end in row_ends.tolist():
+        rows.append(runs[begin:end])
+        begin = end
+
+    return rows
+
+
+def decode_rows(rows, width, dtype=numpy.uint16):
+    """Expands run-length encoded rows back into a 2D array."""
+    runs = numpy.fromiter((item for row in rows for item in row), dtype=numpy.int64)
+    counts, values = runs[0::2], runs[1::2]
+
+    if counts.size and counts.min() < 0:
+        raise ValueError('Negative run length in design rows.')
+
+    lengths = numpy.fromiter((len(row) for row in rows), dtype=numpy.int64, count=len(rows))
+    if (lengths % 2).any():
+        raise ValueError('Design rows have a run length without a value.')
+
+    # Every row on its own has to add up to the width, not just all of them together.
+    row_sums = numpy.bincount(numpy.repeat(numpy.arange(0, len(rows)), lengths // 2), weights=counts, minlength=len(rows))
+    if (row_sums != width).any():
+        raise ValueError('Design rows do not match the design dimensions.')
+
+    return numpy.repeat(values.astype(dtype), counts).reshape(len(rows), width)
+
+
+def beads_to_cells(beads, width, height, dtype=numpy.uint16):
+    """Converts a version 1 bead list into (palette, cells) in the version 2 form,
+    the palette only holds catalog numbers."""
+    numbers, palette = {BLANK_CATALOG_NUMBER: 0}, [{'__catalog_number__': BLANK_CATALOG_NUMBER}]
+    cols = numpy.empty(len(beads), dtype=numpy.intp)
+    rows = numpy.empty(len(beads), dtype=numpy.intp)
+    values = numpy.empty(len(beads), dtype=dtype)
+
+    for position, bead in enumerate(beads):
+        catalog_number = bead['__bead_type__']
+        if catalog_number not in numbers:
+            numbers[catalog_number] = len(palette)
+            palette.append({'__catalog_number__': catalog_number})
+
+        cols[position], rows[position], values[position] = bead['__x__'], bead['__y__'], numbers[catalog_number]
+
+    cells = numpy.zeros((height, width), dtype=dtype)
+    cells[rows, cols] = values
+    return palette, cells
+
+
+def compact_palette(cells, palette_size):
+    """Returns (used, cells) where used lists the palette indices present in the
+    design in order, always starting with the blank bead, and cells is renumbered
+    to index into used."""
+    used = numpy.union1d(numpy.unique(cells), [0])
+    lut = numpy.zeros(palette_size, dtype=cells.dtype)
+    lut[used] = numpy.arange(0, used.size)
+    return used.tolist(), lut[cells]
+
+
+def build_dict(info, palette, cells, compact=True):
+    """Builds a version 2 design dictionary from the design's info, the saved form
+    of its palette entries and its cells. Unless compact is False only the
+    palette entries in use are written."""
+    if compact:
+        used, cells = compact_palette(cells, len(palette))
+        palette = [palette[index] for index in used]
+
+    return {'__version__': FORMAT_VERSION,
+            '__info__': info,
+            '__palette__': palette,
+            '__rows__': encode_rows(cells)}
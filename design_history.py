@@ -0,0 +1,123 @@
+"""
+This module houses the undo/redo history of a design.
+Every entry only stores the cells that changed, as packed arrays of flat cell
+indices and old and new palette indices, and the whole history is kept under a
+byte budget by forgetting the oldest entries.
+"""
+from collections import deque
+
+import numpy
+
+DEFAULT_HISTORY_BUDGET = 64 * 1024 * 1024
+
+
+
+class CellEdit(object):
+    """One undoable change: the flat indices of the cells with their old and new values."""
+    def __init__(self, indices, old, new):
+        self.indices, self.old, self.new = indices, old, new
+
+    @property
+    def nbytes(self):
+        return self.indices.nbytes + self.old.nbytes + self.new.nbytes
+
+    def __len__(self):
+        return self.indices.size
+
+
+
+class DesignHistory(object):
+    """Undo and redo stacks of CellEdits. Changes recorded between begin_group and
+    end_group (a stroke for example) are merged into a single entry."""
+    def __init__(self, width, budget=DEFAULT_HISTORY_BUDGET):
+        self.width, self.budget = width, budget
+        self._undo, self._redo = deque(), []
+        self._bytes = 0
+        self._group = None
+
+
+    def can_undo(self):
+        return bool(self._undo)
+
+
+    def can_redo(self):
+        return bool(self._redo)
+
+
+    def clear(self, width=None):
+        """Forgets everything, for example when the dimensions of the design change."""
+        if width is not None:
+            self.width = width
+
+        self._undo.clear()
+        self._redo = []
+        self._bytes = 0
+        self._group = None
+
+
+    def record(self, rows, cols, old, new):
+        """Records a batch of changed cells."""
+        indices = rows * self.width + cols
+        indices = indices.astype(numpy.uint32 if self.width * (int(rows.max()) + 1) <= 2 ** 32 else numpy.uint64)
+
+        if self._group is not None:
+            self._group.append((indices, old, new))
+            return
+
+        self._push(CellEdit(indices, old, new))
+
+
+    def begin_group(self):
+        self._group = []
+
+
+    def end_group(self):
+        """Merges the changes recorded since begin_group into one entry."""
+        group, self._group = self._group, None
+        if not group:
+            return
+
+        indices = numpy.concatenate([part[0] for part in group])
+        old = numpy.concatenate([part[1] for part in group])
+        new = numpy.concatenate([part[2] for part in group])
+
+        # A cell changed more than once keeps its first old and its last new value.
+        unique, first = numpy.unique(indices, return_index=True)
+        last = indices.size - 1 - numpy.unique(indices[::-1], return_index=True)[1]
+        old, new = old[first], new[last]
+
+        changed = old != new
+        if changed.any():
+            self._push(CellEdit(unique[changed], old[changed], new[changed]))
+
+
+    def _push(self, edit):
+        self._undo.append(edit)
+        self._bytes += edit.nbytes - sum(entry.nbytes for entry in self._redo)
+        self._redo = []
+
+        # Forget the oldest entries, but always keep the latest one.
+        while self._bytes > self.budget and len(self._undo) > 1:
+            self._bytes -= self._undo.popleft().nbytes
+
+
+    def undo(self):
+        """Returns (rows, cols, values) to write to undo the last entry, or None."""
+        if not self._undo:
+            return None
+
+        edit = self._undo.pop()
+        self._redo.append(edit)
+        rows, cols = numpy.divmod(edit.indices.astype(numpy.int64), self.width)
+        return rows, cols, edit.old
+
+
+    def redo(self):
+        """Returns (rows, cols, values) to write to redo the last undone entry, or None."""
+        if not self._redo:
+            return None
+
+        edit = self._redo.pop()
+        self._undo.append(edit)
+        rows, cols = numpy.divmod(edit.indices.astype(numpy.int64), self.width)
+        return rows, cols, edit.new
@@ -0,0 +1,228 @@
+"""
+This module reads and writes design files in all the supported formats.
+"""
+from PyQt5.QtCore import *
+
+from design_model import *
+from profiling import instrumented
+
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import tempfile
+
+# Read once at import, setting the umask to read it isn't safe once the writer thread runs.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+
+def read_design(path):
+    """Reads and decodes a .peyd file (any version) without touching Qt or the
+    catalog, so it can run in a worker process. Returns the design dictionary in
+    the version 2 form with '__cells__' holding the decoded cell array instead of rows."""
+    with open(path, 'r') as file:
+        rdict = json.load(file)
+
+    info = rdict['__info__']
+    width, height = info['__tracks__'] * info['__track_width__'], info['__height__']
+
+    if file_version(rdict) == 1:
+        palette, cells = beads_to_cells(rdict.pop('__beads__'), width, height)
+
+    elif file_version(rdict) == FORMAT_VERSION:
+        palette, cells = rdict['__palette__'], decode_rows(rdict.pop('__rows__'), width)
+
+    else:
+        raise ValueError('Unsupported design format version: {}'.format(file_version(rdict)))
+
+    rdict.update({'__version__': FORMAT_VERSION, '__palette__': palette, '__cells__': cells})
+    return rdict
+
+
+@instrumented('build_design')
+def build_design(main_window, rdict):
+    """Builds the DesignScene of a dictionary returned by read_design, on the GUI thread."""
+    info = rdict['__info__']
+    design = DesignScene(main_window,
+                         name=info['__name__'],
+                         track_width=info['__track_width__'],
+                         tracks=info['__tracks__'],
+                         height=info['__height__'])
+    design.load_cells(rdict['__palette__'], rdict['__cells__'])
+    return design
+
+
+@instrumented('load_design')
+def load_design(main_window, path):
+    """Reads a .peyd (any version) or .peyt file and returns the DesignScene."""
+    if path.endswith(tiled_design_extension):
+        # Only the header is read here, the tiles get paged in as they are viewed.
+        tiles = TiledCells(path, budget=main_window.tile_memory_budget)
+        info = tiles.header['__info__']
+        return DesignScene(main_window,
+                           name=info['__name__'],
+                           track_width=info['__track_width__'],
+                           tracks=info['__tracks__'],
+                           height=info['__height__'],
+                           cells=tiles)
+
+    return build_design(main_window, read_design(path))
+
+
+@instrumented('write_design')
+def write_design(design, path, version=FORMAT_VERSION):
+    """Writes a design, .peyt paths are always written as tiled files."""
+    if path.endswith(tiled_design_extension):
+        design.save_tiles(path)
+        return
+
+    with open(path, 'w') as file:
+        json.dump(design.to_dict(version), file, separators=(',', ':'))
+
+
+def write_atomic(path, text):
+    """Writes text to a temporary file next to path and renames it over path, so
+    a crash half way through never leaves a truncated file behind. The file keeps
+    the permissions of the one it replaces, new files get the usual ones."""
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+
+    except FileNotFoundError:
+        mode = 0o666 & ~_UMASK
+
+    handle, temp_path = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=directory)
+    try:
+        # mkstemp always creates the file owner-only.
+        os.chmod(temp_path, mode)
+        with os.fdopen(handle, 'w') as file:
+            file.write(text)
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.replace(temp_path, path)
+
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+
+class BackgroundWriter(QObject):
+    """Saves designs on a worker thread. The design is snapshotted on the calling
+    thread (a copy of the cell array), serialising and writing happen on the worker.
+    One worker is used so writes to the same file always land in order."""
+    finished = pyqtSignal(str, str)
+
+    def __init__(self, parent=None):
+        super(BackgroundWriter, self).__init__(parent)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+
+    def save(self, design, path):
+        """Starts saving design to path, finished(path, error) is emitted when it's done."""
+        if path.endswith(tiled_design_extension):
+            # Tiled designs are written in place tile by tile, there is nothing to snapshot.
+            try:
+                design.save_tiles(path)
+                self.finished.emit(path, '')
+
+            except (IOError, OSError) as error:
+                self.finished.emit(path, str(error))
+
+            return None
+
+        return self.submit(self._write, path, *design.snapshot())
+
+
+    def submit(self, function, *args):
+        """Runs function(*args) on the worker thread after everything submitted before."""
+        return self._executor.submit(function, *args)
+
+
+    @instrumented('BackgroundWriter.save')
+    def _write(self, path, info, palette, cells):
+        try:
+            write_atomic(path, json.dumps(build_dict(info, palette, cells), separators=(',', ':')))
+            self.finished.emit(path, '')
+
+        except Exception as error:
+            self.finished.emit(path, str(error))
+
+
+    def wait(self):
+        """Blocks until every queued write is done."""
+        self._executor.submit(lambda: None).result()
+
+
+
+class DesignLoader(QObject):
+    """Opens designs in parallel. Files are read and decoded in a pool of worker
+    processes, each DesignScene is built on the GUI thread as soon as its file is
+    ready, so a slow or broken file doesn't hold up the others."""
+    loaded = pyqtSignal(str, object)
+    failed = pyqtSignal(str, str)
+    # Emitted from the pool's thread, delivered queued to the GUI thread.
+    _decoded = pyqtSignal(str, object, str)
+
+    def __init__(self, main_window, parent=None):
+        super(DesignLoader, self).__init__(parent)
+        self.main_window = main_window
+        self._pool = None
+        self._decoded.connect(self._build)
+
+
+    def load(self, paths):
+        """Starts opening every path, loaded(path, design) or failed(path, error)
+        is emitted once for each of them."""
+        for path in paths:
+            if path.endswith(tiled_design_extension):
+                # Only the header gets read, there is nothing worth handing off.
+                self._decoded.emit(path, None, '')
+                continue
+
+            future = self._executor().submit(read_design, path)
+            future.add_done_callback(lambda future, path=path: self._done(path, future))
+
+
+    def _executor(self):
+        if self._pool is None:
+            # Spawned (rather than forked) workers don't inherit the GUI's state.
+            self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=os.cpu_count(),
+                                                                mp_context=multiprocessing.get_context('spawn'))
+
+        return self._pool
+
+
+    def _done(self, path, future):
+        try:
+            self._decoded.emit(path, future.result(), '')
+
+        except concurrent.futures.process.BrokenProcessPool as error:
+            # A worker died, the next load starts a new pool.
+            self._pool = None
+            self._decoded.emit(path, None, str(error) or 'The loading process stopped unexpectedly.')
+
+        except Exception as error:
+            self._decoded.emit(path, None, str(error) or type(error).__name__)
+
+
+    def _build(self, path, rdict, error):
+        if not error:
+            try:
+                design = load_design(self.main_window, path) if rdict is None else build_design(self.main_window, rdict)
+                self.loaded.emit(path, design)
+                return
+
+            except (IOError, OSError, ValueError, KeyError, OverflowError) as build_error:
+                error = str(build_error)
+
+        self.failed.emit(path, error)
+
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
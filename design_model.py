@@ -7,16 +7,33 @@ from PyQt5.QtCore import *
 from PyQt5.QtWidgets import *
 from PyQt5.QtGui import *
 
+from collections import OrderedDict
+
+import math
+
+import numpy
 
 from design_visual_guide import *
+from design_format import *
+from design_history import *
+from design_selection import *
+from design_tiles import *
+from profiling import instrumented
 from util import *
 
 
 
 class DesignScene(QGraphicsScene):
     """This class holds the data for the peyote design, it integrates
-    with Qt's GraphicsView framework."""
-    def __init__(self, main_window, bgrid=None, parent=None, name='(Untitled)', track_width=5, tracks=10, height=40):
+    with Qt's GraphicsView framework.
+    The beads are stored as a 2D array of palette indices (self.cells[row, col]),
+    the bead types themselves live in self.palette. Index 0 is always the blank bead.
+    For very large designs cells can be a TiledCells instead of a numpy array."""
+    counts_changed = pyqtSignal()
+    dimensions_changed = pyqtSignal()
+
+    def __init__(self, main_window, bgrid=None, parent=None, name='(Untitled)', track_width=5, tracks=10, height=40,
+                 cells=None):
         """Sets up the neccessary parameters for generating the model."""
         super(DesignScene, self).__init__(parent)
 
@@ -26,82 +43,985 @@ class DesignScene(QGraphicsScene):
         self.grid = Grid(self.track_width, self.dimensions)
         self.addItem(self.grid)
 
-        self._beads = []
         self.main_window = main_window
+        self.missing_types = []
+        self.palette = [main_window.default_bead]
+        self._palette_lookup = {id(main_window.default_bead): 0}
+        self._unresolved = {}
+        self._counts = None
+        # Rows changed since the last autosave.
+        self.dirty_rows = set()
+        self.selection = Selection(*self.dimensions)
+
+        self.history = DesignHistory(self.dimensions[WIDTH], budget=main_window.history_budget)
+        # Spare rows below the design so it can grow without copying, see _grow_rows.
+        self._row_buffer = None
+
+        if cells is None:
+            self._generate()
+
+        else:
+            self.cells = cells
+            if isinstance(cells, TiledCells):
+                self._load_tile_palette(cells.header['__palette__'])
+                if '__counts__' in cells.header:
+                    self._counts = numpy.array(cells.header['__counts__'], dtype=numpy.int64)
+
+        self.field = BeadField(self)
+        self.addItem(self.field)
+        # The grid and the field are the only items and they cover the whole design,
+        # the views find the bead under the mouse with cell_at rather than an index.
+        self.setItemIndexMethod(QGraphicsScene.NoIndex)
+
+        # Changes are collected into one region and repainted once per event loop pass.
+        self._dirty_region = None
+        self._counts_dirty = False
+        self._update_timer = QTimer()
+        self._update_timer.setSingleShot(True)
+        self._update_timer.timeout.connect(self._flush_update)
 
-        self._generate()
         if bgrid:
             self._load(bgrid)
 
 
     def _generate(self):
         """Generates the blank design to the specified dimensions."""
-        for row in range(0, self.dimensions[HEIGHT]):
-            row_list = []
-            for col in range(0, self.dimensions[WIDTH]):
-                new_bead = Bead(self.track_width, self.main_window.default_bead, location=(col, row))
-                row_list.append(new_bead)
-                self.addItem(new_bead)
-
-            self._beads.append(row_list)
+        self.cells = numpy.zeros((self.dimensions[HEIGHT], self.dimensions[WIDTH]), dtype=numpy.uint16)
+        self._counts = numpy.array([self.cells.size], dtype=numpy.int64)
 
 
+    @instrumented('DesignScene.load')
     def _load(self, bgrid):
-        """Loads beads from a list writing them over the blank design."""
+        """Loads beads from a version 1 list writing them over the blank design."""
+        resolved = {}
         for bead in bgrid:
             col, row = bead['__x__'], bead['__y__']
-            # TODO: add a new part to the save file that stores the ids of the required beads
-            # and prompts the user at load time if any are not found
-            bead_type = self.main_window.catalog.find_type(bead['__bead_type__'])
-            self._beads[row][col].set_bead_type(bead_type)
+            catalog_number = bead['__bead_type__']
+            if catalog_number not in resolved:
+                resolved[catalog_number] = self._resolve_type(catalog_number)
+
+            self.cells[row, col] = resolved[catalog_number]
+
+        self.missing_types = [number for number, index in resolved.items()
+                              if index == 0 and number != BLANK_CATALOG_NUMBER]
+        self._recount()
+        self.field.discard_lod()
+        self.field.update()
+
+
+    def _load_rows(self, bpalette, brows):
+        """Loads a version 2 palette and list of run-length encoded rows."""
+        self.load_cells(bpalette, decode_rows(brows, self.dimensions[WIDTH], dtype=self.cells.dtype))
+
+
+    @instrumented('DesignScene.load')
+    def load_cells(self, bpalette, cells):
+        """Loads a version 2 palette and the cells indexing into it, already decoded."""
+        if cells.size and int(cells.max()) >= len(bpalette):
+            raise ValueError('Design cells index past the end of the palette.')
+
+        lut = numpy.zeros(len(bpalette), dtype=self.cells.dtype)
+        for index, entry in enumerate(bpalette[1:], 1):
+            lut[index] = self._resolve_type(entry['__catalog_number__'])
+
+        self.cells = lut[cells]
+        self.missing_types = [entry['__catalog_number__'] for index, entry in enumerate(bpalette)
+                              if index and not lut[index] and entry['__catalog_number__'] != BLANK_CATALOG_NUMBER]
+        self._recount()
+        self.field.discard_lod()
+        self.field.update()
+
+
+    def _load_tile_palette(self, bpalette):
+        """Tiled files are edited in place so the palette keeps the file's order,
+        types that can't be found show up as blank beads but keep their entry."""
+        for index, entry in enumerate(bpalette[1:], 1):
+            if entry['__catalog_number__'] == BLANK_CATALOG_NUMBER:
+                bead_type = self.main_window.default_bead
+
+            else:
+                bead_type = self.main_window.catalog.find_type(entry['__catalog_number__'])
+
+            if bead_type:
+                self._palette_lookup.setdefault(id(bead_type), index)
+                self.palette.append(bead_type)
+
+            else:
+                self.palette.append(self.main_window.default_bead)
+                self._unresolved[index] = entry
+                self.missing_types.append(entry['__catalog_number__'])
+
+
+    def load_dict(self, rdict):
+        """Loads the beads of a design dictionary of any supported version."""
+        if file_version(rdict) == 1:
+            self._load(rdict['__beads__'])
+
+        elif file_version(rdict) == FORMAT_VERSION:
+            self._load_rows(rdict['__palette__'], rdict['__rows__'])
+
+        else:
+            raise ValueError('Unsupported design format version: {}'.format(file_version(rdict)))
+
+
+    def _resolve_type(self, catalog_number):
+        """Palette index of the catalog's bead type with the given number, 0 if it's
+        not found or it's the number of the blank bead."""
+        if catalog_number == BLANK_CATALOG_NUMBER:
+            return 0
+
+        return self.palette_index(self.main_window.catalog.find_type(catalog_number))
+
+
+    def palette_index(self, bead_type):
+        """Returns the palette index of a bead type, adding it to the palette if it's new.
+        Unknown types (None) map to the blank bead."""
+        if not bead_type:
+            return 0
+
+        try:
+            return self._palette_lookup[id(bead_type)]
+
+        except KeyError:
+            if len(self.palette) > numpy.iinfo(self.cells.dtype).max:
+                raise OverflowError('Too many bead types in one design.')
+
+            self._palette_lookup[id(bead_type)] = len(self.palette)
+            self.palette.append(bead_type)
+            if self._counts is not None:
+                self._counts = numpy.append(self._counts, 0)
+
+            return len(self.palette) - 1
+
+
+    def bead_counts(self):
+        """Returns the number of beads of each palette index. The counts are taken
+        once and then kept up to date by every change to the cells."""
+        if self._counts is None:
+            self._counts = numpy.zeros(len(self.palette), dtype=numpy.int64)
+            # Count a band of rows at a time so tiled designs are never loaded as a whole.
+            for row in range(0, self.dimensions[HEIGHT], 256):
+                block = self.cells[row:row + 256, 0:self.dimensions[WIDTH]]
+                self._counts += numpy.bincount(block.ravel(), minlength=len(self.palette))
+
+        return self._counts
+
+
+    def _recount(self):
+        """Drops the counts after the cells were replaced wholesale."""
+        self._counts = None
+        self._counts_dirty = True
+        self._update_timer.start(0)
+
+
+    def bead_type_at(self, location):
+        """Returns the bead type at the (col, row) location."""
+        return self.palette[self.cells[location[ROW], location[COL]]]
+
+
+    def set_bead(self, location, bead_type):
+        """Sets the type of a single bead."""
+        self.set_cells([location[ROW]], [location[COL]], self.palette_index(bead_type))
+
+
+    @instrumented('DesignScene.set_cells')
+    def set_cells(self, rows, cols, values, symmetry=None):
+        """Writes palette indices to many cells as one batch. values is either a single
+        index or one per cell. With a Symmetry the mirror images of the cells are
+        written in the same batch. Returns the (rows, cols, old, new) arrays of the
+        cells that actually changed."""
+        rows, cols = numpy.asarray(rows, dtype=numpy.int64), numpy.asarray(cols, dtype=numpy.int64)
+        values = numpy.broadcast_to(numpy.asarray(values, dtype=self.cells.dtype), rows.shape)
+        if symmetry is not None:
+            rows, cols, values = symmetry.expand(self, rows, cols, values)
+
+        # The same cell may come up more than once (e.g. in a stroke), the last write wins.
+        flat = rows * self.dimensions[WIDTH] + cols
+        flat, last = numpy.unique(flat[::-1], return_index=True)
+        rows, cols = numpy.divmod(flat, self.dimensions[WIDTH])
+        new = values[::-1][last]
+
+        old = self.cells[rows, cols]
+        changed = old != new
+        rows, cols, old, new = rows[changed], cols[changed], old[changed], new[changed]
+
+        if rows.size:
+            self.cells[rows, cols] = new
+            self._cells_changed(rows, cols, old, new)
+
+        return rows, cols, old, new
+
+
+    @instrumented('DesignScene.flood_fill')
+    def flood_fill(self, location, bead_type, symmetry=None):
+        """Fills the area of same coloured beads around location. Beads in
+        neighbouring tracks touch the two beads they are shifted between.
+        With a Symmetry the mirror images of the area are filled as well."""
+        target, index = self.cells[location[ROW], location[COL]], self.palette_index(bead_type)
+        if target == index:
+            return
+
+        height, width = self.dimensions[HEIGHT], self.dimensions[WIDTH]
+        track_width = self.track_width
+        frontier_rows, frontier_cols = numpy.array([location[ROW]]), numpy.array([location[COL]])
+        self.cells[frontier_rows, frontier_cols] = index
+        filled_rows, filled_cols = [frontier_rows], [frontier_cols]
+
+        while frontier_rows.size:
+            # The shifted tracks overlap the row above, the others the row below.
+            shift = numpy.where(frontier_cols // track_width % 2, 1, -1)
+            next_rows, next_cols = [], []
+            for d_col in (-1, 1):
+                cols = frontier_cols + d_col
+                crossing = cols // track_width != frontier_cols // track_width
+                next_rows += [frontier_rows, frontier_rows[crossing] + shift[crossing]]
+                next_cols += [cols, cols[crossing]]
+
+            next_rows += [frontier_rows - 1, frontier_rows + 1]
+            next_cols += [frontier_cols, frontier_cols]
+
+            rows, cols = numpy.concatenate(next_rows), numpy.concatenate(next_cols)
+            inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+            flat = numpy.unique(rows[inside] * width + cols[inside])
+            rows, cols = numpy.divmod(flat, width)
+
+            matching = self.cells[rows, cols] == target
+            frontier_rows, frontier_cols = rows[matching], cols[matching]
+            # Writing as we go marks the beads as visited.
+            self.cells[frontier_rows, frontier_cols] = index
+            filled_rows.append(frontier_rows)
+            filled_cols.append(frontier_cols)
+
+        rows, cols = numpy.concatenate(filled_rows), numpy.concatenate(filled_cols)
+        if symmetry is not None:
+            # The mirrored area is written along with the fill, as one batch.
+            self.cells[rows, cols] = target
+            self.set_cells(rows, cols, index, symmetry)
+            return
+
+        self._cells_changed(rows, cols,
+                            numpy.full(rows.shape, target, dtype=self.cells.dtype),
+                            numpy.full(rows.shape, index, dtype=self.cells.dtype))
+
+
+    def _cells_changed(self, rows, cols, old, new, record=True):
+        """Called after every batch of changes to the cells."""
+        if record:
+            self.history.record(rows, cols, old, new)
+
+        if self._counts is not None:
+            numpy.subtract.at(self._counts, old, 1)
+            numpy.add.at(self._counts, new, 1)
+
+        self._counts_dirty = True
+        self.dirty_rows.update(numpy.unique(rows).tolist())
+        self.field.update_lod(rows, cols, new)
+        self._invalidate(rows, cols)
+
+
+    def undo(self):
+        """Undoes the last edit as a single batch."""
+        self._replay(self.history.undo())
+
+
+    def redo(self):
+        """Redoes the last undone edit as a single batch."""
+        self._replay(self.history.redo())
+
+
+    def _replay(self, change):
+        if change is None:
+            return
+
+        rows, cols, values = change
+        old = self.cells[rows, cols]
+        self.cells[rows, cols] = values
+        self._cells_changed(rows, cols, old, values, record=False)
+
+
+    def _invalidate(self, rows, cols):
+        """Adds the area of the given cells to the region that gets repainted."""
+        left, top = int(cols.min()) * Bead.pitch[WIDTH], int(rows.min()) * Bead.pitch[HEIGHT]
+        right, bottom = (int(cols.max()) + 1) * Bead.pitch[WIDTH], (int(rows.max()) + 1) * Bead.pitch[HEIGHT]
+        # Leave room for the margain and the shifted tracks.
+        rect = QRectF(left, top, right - left + Bead.margain, bottom - top + Bead.margain + Bead.dimension[HEIGHT] // 2)
+
+        self._dirty_region = self._dirty_region.united(rect) if self._dirty_region else rect
+        if not self._update_timer.isActive():
+            self._update_timer.start(0)
+
+
+    def _flush_update(self):
+        if self._dirty_region:
+            self.field.update(self._dirty_region)
+            self._dirty_region = None
+
+        if self._counts_dirty:
+            self._counts_dirty = False
+            self.counts_changed.emit()
+
+
+    def resize(self, tracks=None, height=None):
+        """Adds or removes tracks on the right and rows at the bottom, the beads
+        that are left keep their place."""
+        self.crop(0, 0, self.tracks if tracks is None else tracks,
+                  self.dimensions[HEIGHT] if height is None else height)
+
+
+    @instrumented('DesignScene.crop')
+    def crop(self, first_track, first_row, tracks, height):
+        """Keeps the given tracks and rows of the design, anything past the old edges
+        comes in blank. Only the cells themselves are touched, the scene, its items
+        and the index (there is none) stay. Undo history doesn't survive this."""
+        if isinstance(self.cells, TiledCells):
+            raise ValueError('Tiled designs can not be resized.')
+
+        if tracks < 1 or height < 1 or first_track < 0 or first_row < 0:
+            raise ValueError('A design needs at least one track and one row.')
+
+        if first_track % 2:
+            # Otherwise the shifted tracks would become the straight ones.
+            raise ValueError('Designs can only be cropped from an even track.')
+
+        old_width, old_height = self.dimensions
+        width = tracks * self.track_width
+        col_from = first_track * self.track_width
+        # The block of old cells that stays.
+        kept_rows = max(0, min(height, old_height - first_row))
+        kept_cols = max(0, min(width, old_width - col_from))
+
+        self.field.prepareGeometryChange()
+
+        if (col_from, first_row, width) == (0, 0, old_width):
+            self.cells = self._grow_rows(height)
+
+        else:
+            cells = numpy.zeros((height, width), dtype=self.cells.dtype)
+            cells[:kept_rows, :kept_cols] = self.cells[first_row:first_row + kept_rows, col_from:col_from + kept_cols]
+            self.cells, self._row_buffer = cells, None
+
+        if self._counts is not None:
+            if kept_rows == old_height and kept_cols == old_width:
+                # Nothing was cut off, the new beads are all blank.
+                self._counts[0] += height * width - old_height * old_width
+
+            else:
+                self._counts = numpy.bincount(self.cells[:kept_rows, :kept_cols].ravel(), minlength=len(self.palette))
+                self._counts[0] += height * width - kept_rows * kept_cols
+
+        self.tracks, self.dimensions = tracks, (width, height)
+        self.selection = Selection(width, height)
+        self.grid.set_dimensions(self.track_width, self.dimensions)
+        self.history.clear(width)
+        self.dirty_rows.difference_update([row for row in self.dirty_rows if row >= height])
+        self.field.discard_lod()
+        self.field.update()
+        # The scene rect only ever grows by itself.
+        self.setSceneRect(self.itemsBoundingRect())
+
+        self._counts_dirty = True
+        self._update_timer.start(0)
+        self.dimensions_changed.emit()
+
+
+    def _grow_rows(self, height):
+        """Returns the cells with height rows, the same width. Rows are taken from
+        spare ones left below the design where possible, otherwise the cells are
+        copied into a new buffer with room to grow by half again."""
+        old_height = self.dimensions[HEIGHT]
+        if self._row_buffer is None or self.cells.base is not self._row_buffer:
+            self._row_buffer = self.cells if self.cells.base is None else None
+
+        if self._row_buffer is None or len(self._row_buffer) < height:
+            buffer = numpy.empty((max(height, old_height + old_height // 2), self.dimensions[WIDTH]), dtype=self.cells.dtype)
+            buffer[:old_height] = self.cells[:old_height]
+            self._row_buffer = buffer
+
+        # Spare rows may still hold beads from before the design shrank.
+        self._row_buffer[old_height:height] = 0
+        return self._row_buffer[:height]
+
+
+    def select(self, rows=None, cols=None, add=False):
+        """Selects the cells at rows, cols, everything if they are None."""
+        previous = self.selection.bounds()
+        if rows is None:
+            self.selection.select_all()
+
+        else:
+            self.selection.select_cells(rows, cols, add)
+
+        self._selection_changed(previous)
+
+
+    def select_rect(self, col_from, row_from, col_to, row_to, add=False):
+        """Selects a rectangle of cells, the upper bounds are exclusive."""
+        previous = self.selection.bounds()
+        self.selection.select_rect(col_from, row_from, col_to, row_to, add)
+        self._selection_changed(previous)
+
+
+    def select_none(self):
+        previous = self.selection.bounds()
+        self.selection.clear()
+        self._selection_changed(previous)
+
+
+    def _selection_changed(self, previous):
+        """Repaints the area of the old and the new selection."""
+        corners = [bounds for bounds in (previous, self.selection.bounds()) if bounds]
+        if corners:
+            cols = numpy.array([bound for bounds in corners for bound in (bounds[0], bounds[2] - 1)])
+            rows = numpy.array([bound for bounds in corners for bound in (bounds[1], bounds[3] - 1)])
+            self._invalidate(rows, cols)
+
+
+    def copy_selection(self):
+        """Returns a Clip of the selected beads, or None if nothing is selected."""
+        rows, cols = self.selection.cells()
+        if not rows.size:
+            return None
+
+        return Clip.from_cells(self.palette, self.track_width, rows, cols, self.cells[rows, cols])
+
+
+    def delete_selection(self):
+        """Clears the selected beads."""
+        rows, cols = self.selection.cells()
+        self.set_cells(rows, cols, 0)
+
+
+    @instrumented('DesignScene.stamp')
+    def stamp(self, clip, origins):
+        """Pastes clip at every (col, row) in origins as one batch, see Clip.placed.
+        Where copies overlap the later one wins, beads past the edges are dropped."""
+        rows, cols = clip.placed(self.track_width, origins)
+        lut = numpy.array([self.palette_index(bead_type) for bead_type in clip.bead_types], dtype=self.cells.dtype)
+        values = numpy.tile(lut[clip.values], len(rows) // max(1, len(clip)))
+
+        inside = (rows >= 0) & (rows < self.dimensions[HEIGHT]) & (cols >= 0) & (cols < self.dimensions[WIDTH])
+        return self.set_cells(rows[inside], cols[inside], values[inside])
+
+
+    def mirror_selection(self, horizontal=True):
+        """Mirrors the selected beads in place, left to right or top to bottom around
+        the middle of the selection. Beads keep their row (or column), so the mirror
+        image stays on the cells of the selection and the selection is mirrored with
+        it. Beads moving between shifted and straight tracks end up half a bead off."""
+        rows, cols = self.selection.cells()
+        if not rows.size:
+            return
+
+        col_from, row_from, col_to, row_to = self.selection.bounds()
+        if horizontal:
+            new_rows, new_cols = rows, col_from + col_to - 1 - cols
+
+        else:
+            new_rows, new_cols = row_from + row_to - 1 - rows, cols
+
+        # Cleared and written in one batch, where the two overlap the mirror image wins.
+        values = self.cells[rows, cols]
+        self.set_cells(numpy.concatenate((rows, new_rows)), numpy.concatenate((cols, new_cols)),
+                       numpy.concatenate((numpy.zeros_like(values), values)))
+        self.select(new_rows, new_cols)
+
+
+    def cell_at(self, pos):
+        """Maps a scene position back to the (col, row) of the bead under it,
+        returns None if the position falls between beads or outside the design."""
+        x = pos.x() - Bead.margain
+        col = int(x // Bead.pitch[WIDTH])
+        if not 0 <= col < self.dimensions[WIDTH] or x - col * Bead.pitch[WIDTH] >= Bead.dimension[WIDTH]:
+            return None
+
+        y = pos.y() - Bead.margain - Bead.offset(col, self.track_width)
+        row = int(y // Bead.pitch[HEIGHT])
+        if not 0 <= row < self.dimensions[HEIGHT] or y - row * Bead.pitch[HEIGHT] >= Bead.dimension[HEIGHT]:
+            return None
+
+        return (col, row)
+
+
+    def info(self):
+        """The __info__ part of the saved design."""
+        return {'__name__': self.name,
+                '__track_width__': self.track_width,
+                '__tracks__': self.tracks,
+                '__height__': self.dimensions[HEIGHT]}
+
+
+    def palette_entries(self):
+        """The saved form of every palette entry, in palette order. Types that
+        could not be found when loading keep the entry they were loaded from."""
+        palette = []
+        for index, bead_type in enumerate(self.palette):
+            if index in self._unresolved:
+                palette.append(self._unresolved[index])
+
+            else:
+                palette.append({'__catalog_number__': bead_type.data(1, Qt.DisplayRole),
+                                '__name__': bead_type.data(0, Qt.DisplayRole)})
+
+        return palette
+
+
+    def tile_header(self):
+        """The header of a tiled design file, the palette is written in full
+        since the cells in the file index straight into it."""
+        return {'__info__': self.info(), '__palette__': self.palette_entries(), '__counts__': self.bead_counts().tolist()}
+
+
+    def snapshot(self):
+        """Returns (info, palette entries, copy of the cells), everything needed to
+        save the design without touching the scene again, e.g. on another thread."""
+        return self.info(), self.palette_entries(), numpy.array(self.cells, copy=True)
+
+
+    @instrumented('DesignScene.save_tiles')
+    def save_tiles(self, path):
+        """Saves the design as a tiled file, in place if it was opened from path."""
+        if isinstance(self.cells, TiledCells) and self.cells.path == path:
+            self.cells.flush(self.tile_header())
+
+        else:
+            write_tiles(path, self.tile_header(), self.cells)
 
 
     def __iter__(self):
         """2D iter function"""
         for row in range(0, self.dimensions[HEIGHT]):
             for col in range(0, self.dimensions[WIDTH]):
-                yield self._beads[row][col]
+                yield Bead(self, location=(col, row))
 
 
-    def to_dict(self):
+    def to_dict(self, version=FORMAT_VERSION):
         """Function builds a dictionary so the object can be serialized with json."""
         rdict = {}
-        rdict['__info__'] = {'__name__': self.name,
-                             '__track_width__': self.track_width,
-                             '__tracks__': self.tracks,
-                             '__height__': self.dimensions[HEIGHT]}
+        rdict['__info__'] = self.info()
 
-        rdict['__beads__'] = []
+        if version == 1:
+            rdict['__beads__'] = []
 
-        for bead in self:
-            bdict = bead.to_dict()
-            if bdict['__bead_type__'] != 'blank':
-                rdict['__beads__'].append(bdict)
+            cells = numpy.asarray(self.cells)
+            catalog_numbers = [bead_type.data(1, Qt.DisplayRole) for bead_type in self.palette]
+            rows, cols = numpy.nonzero(cells)
+            for row, col in zip(rows.tolist(), cols.tolist()):
+                rdict['__beads__'].append({'__bead_type__': catalog_numbers[cells[row, col]],
+                                           '__x__': col, '__y__': row})
+
+        else:
+            rdict = build_dict(self.info(), self.palette_entries(), numpy.asarray(self.cells))
 
         return rdict
 
 
 
-class Bead(QGraphicsItem):
-    """A class for representing the individual beads of the peyote design, it integrates
-    with Qt's GraphicsView framework."""
+class BeadField(QGraphicsItem):
+    """A single item that paints all the beads of a design straight from the
+    scene's cell array. Only the exposed part of the design gets painted.
+    Zoomed out below lod_zoom the beads are drawn from low resolution images
+    with a block of two pixels per bead, the second pixel (or the first on the
+    shifted tracks) makes room for the half bead shift. The images are made for
+    chunks of the design as they're exposed and kept up to lod_budget bytes, once
+    a bead is smaller than a screen pixel only every stride-th bead is sampled."""
+    lod_zoom = 0.25
+    lod_chunk = 256
+    lod_budget = 64 * 1024 * 1024
+    _selection_color = QColor(40, 120, 255, 90)
+
+    def __init__(self, design, parent=None):
+        super(BeadField, self).__init__(parent)
+        # Presses reach the field straight from the view, see PatternArea.
+        self.setAcceptedMouseButtons(Qt.NoButton)
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption, True)
+
+        self.design = design
+
+        # Beads painted by dragging are applied in batches, once per frame.
+        self._stroke, self._stroke_index, self._stroke_pos = None, 0, None
+        self._stroke_timer = QTimer()
+        self._stroke_timer.setInterval(16)
+        self._stroke_timer.timeout.connect(self._flush_stroke)
+
+        # The low resolution chunks by (stride, chunk row, chunk col): [premultiplied
+        # ARGB pixels, QImage of them or None], least recently drawn first.
+        self._lod, self._lod_bytes, self._lod_colors = OrderedDict(), 0, None
+
+        # A selection being dragged out: (first location, selection before it) for
+        # a rectangle, the lasso is the list of scene points the mouse went through.
+        self._selecting, self._lasso = None, None
+
+
+    def boundingRect(self):
+        """QGraphicsItem's required boundingRect function, covers the whole design."""
+        width, height = self.design.dimensions
+        return QRectF(0, 0,
+                      width * Bead.pitch[WIDTH] + Bead.margain,
+                      height * Bead.pitch[HEIGHT] + Bead.margain + Bead.dimension[HEIGHT] // 2)
+
+
+    def bead_rect(self, location):
+        """The area covered by the bead at (col, row) in item coordinates."""
+        x, y = Bead.position(location, self.design.track_width)
+        return QRectF(x, y, Bead.dimension[WIDTH], Bead.dimension[HEIGHT])
+
+
+    def visible_range(self, rect):
+        """Returns the (col_from, col_to, row_from, row_to) range of beads that
+        intersect rect, the upper bounds are exclusive."""
+        width, height = self.design.dimensions
+        col_from = max(0, int((rect.left() - Bead.margain) // Bead.pitch[WIDTH]))
+        col_to = min(width, int((rect.right() - Bead.margain) // Bead.pitch[WIDTH]) + 1)
+        # The shifted tracks reach half a bead lower, so look one row further up.
+        row_from = max(0, int((rect.top() - Bead.margain - Bead.dimension[HEIGHT] // 2) // Bead.pitch[HEIGHT]))
+        row_to = min(height, int((rect.bottom() - Bead.margain) // Bead.pitch[HEIGHT]) + 1)
+        return col_from, col_to, row_from, row_to
+
+
+    @instrumented('BeadField.paint')
+    def paint(self, painter, option, widget):
+        """Draws the beads that intersect the exposed rectangle."""
+        col_from, col_to, row_from, row_to = self.visible_range(option.exposedRect)
+        if col_from >= col_to or row_from >= row_to:
+            return
+
+        # Pick pixmaps rendered at the resolution they end up on screen.
+        zoom = painter.worldTransform().m11()
+        if zoom < self.lod_zoom:
+            self._paint_lod(painter, col_from, col_to, row_from, row_to, zoom)
+            self._paint_selection(painter, col_from, col_to, row_from, row_to, zoom)
+            return
+
+        device_scale = widget.devicePixelRatioF() if widget else 1.0
+        palette = self.design.palette
+        cells = self.design.cells[row_from:row_to, col_from:col_to]
+        pixmaps = {index: palette[index].pixmap_at(zoom, device_scale) for index in numpy.unique(cells).tolist()}
+
+        track_width = self.design.track_width
+        xs = [Bead.position((col, 0), track_width) for col in range(col_from, col_to)]
+
+        for row, row_cells in enumerate(cells.tolist(), row_from):
+            yc = row * Bead.pitch[HEIGHT]
+            for (xc, offset), index in zip(xs, row_cells):
+                painter.drawPixmap(xc, yc + offset, pixmaps[index])
+
+        self._paint_selection(painter, col_from, col_to, row_from, row_to, zoom)
+        if self._lasso:
+            painter.setPen(QPen(QColor(40, 120, 255), 0))
+            painter.drawPolyline(QPolygonF([QPointF(x, y) for x, y in self._lasso]))
+
+
+    def _paint_selection(self, painter, col_from, col_to, row_from, row_to, zoom):
+        """Tints the selected beads, zoomed out it's drawn as an image like the beads."""
+        if not self.design.selection:
+            return
+
+        rows, cols = numpy.nonzero(self.design.selection.mask(col_from, row_from, col_to, row_to))
+        if not rows.size:
+            return
+
+        if zoom < self.lod_zoom:
+            shifted_cols = self._shifted(numpy.arange(col_from, col_to))
+            pixels = numpy.zeros((2 * (row_to - row_from) + 1, col_to - col_from), dtype=numpy.uint32)
+            top = 2 * rows + shifted_cols[cols]
+            pixels[top, cols] = pixels[top + 1, cols] = self._selection_color.rgba()
+            image = QImage(pixels.data, pixels.shape[1], pixels.shape[0], pixels.shape[1] * 4, QImage.Format_ARGB32)
+            painter.drawImage(QRectF(col_from * Bead.pitch[WIDTH] + Bead.margain, row_from * Bead.pitch[HEIGHT] + Bead.margain,
+                                     pixels.shape[1] * Bead.pitch[WIDTH], pixels.shape[0] * Bead.pitch[HEIGHT] / 2),
+                              image)
+            return
+
+        track_width = self.design.track_width
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(self._selection_color)
+        painter.drawRects([self.bead_rect((col, row)) for row, col in zip((rows + row_from).tolist(),
+                                                                            (cols + col_from).tolist())])
+
+
+    def _colors(self):
+        """The ARGB value of every palette index, extended as the palette grows."""
+        palette = self.design.palette
+        if self._lod_colors is None or self._lod_colors.size != len(palette):
+            self._lod_colors = numpy.array([QColor(bead_type.base_color).rgba() for bead_type in palette],
+                                           dtype=numpy.uint32)
+
+        return self._lod_colors
+
+
+    def _shifted(self, cols):
+        return cols // self.design.track_width % 2
+
+
+    def _lod_stride(self, zoom):
+        """Every stride-th bead is drawn, a power of two so zooming about reuses chunks."""
+        beads_per_pixel = 1 / (zoom * Bead.pitch[WIDTH])
+        return 2 ** int(math.log2(beads_per_pixel)) if beads_per_pixel >= 2 else 1
+
+
+    def _build_lod_chunk(self, key):
+        """Makes the pixels of one chunk from the sampled cells it covers."""
+        stride, chunk_row, chunk_col = key
+        width, height = self.design.dimensions
+        rows = numpy.arange(chunk_row * self.lod_chunk, min((chunk_row + 1) * self.lod_chunk, -(-height // stride))) * stride
+        cols = numpy.arange(chunk_col * self.lod_chunk, min((chunk_col + 1) * self.lod_chunk, -(-width // stride))) * stride
+
+        if stride == 1:
+            # Tiled cells are read fastest as one block.
+            cells = self.design.cells[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+
+        else:
+            cells = self.design.cells[rows[:, None], cols[None, :]]
+
+        values = self._colors()[cells]
+        shifted = self._shifted(cols).astype(bool)
+
+        # Transparent where the shifted tracks leave a gap, at the top and the bottom.
+        pixels = numpy.zeros((2 * len(rows) + 1, len(cols)), dtype=numpy.uint32)
+        pixels[0:-1:2, ~shifted] = values[:, ~shifted]
+        pixels[1:-1:2, ~shifted] = values[:, ~shifted]
+        pixels[1::2, shifted] = values[:, shifted]
+        pixels[2::2, shifted] = values[:, shifted]
+        return pixels
+
+
+    def _lod_chunk(self, key):
+        """Returns the [pixels, image] of a chunk, making it if it isn't kept."""
+        try:
+            self._lod.move_to_end(key)
+            return self._lod[key]
+
+        except KeyError:
+            chunk = [self._build_lod_chunk(key), None]
+            self._lod[key] = chunk
+            self._lod_bytes += chunk[0].nbytes
+
+            # The chunks of the range being drawn are never the oldest ones.
+            while self._lod_bytes > self.lod_budget and len(self._lod) > 1:
+                self._lod_bytes -= self._lod.popitem(last=False)[1][0].nbytes
+
+            return chunk
+
+
+    def update_lod(self, rows, cols, values):
+        """Writes changed cells into the low resolution chunks that are kept."""
+        if not self._lod:
+            return
+
+        colors = self._colors()[values]
+        for stride in {key[0] for key in self._lod}:
+            sampled = (rows % stride == 0) & (cols % stride == 0)
+            sampled_rows, sampled_cols = rows[sampled] // stride, cols[sampled] // stride
+            chunk_rows, chunk_cols = sampled_rows // self.lod_chunk, sampled_cols // self.lod_chunk
+
+            for chunk_row, chunk_col in set(zip(chunk_rows.tolist(), chunk_cols.tolist())):
+                chunk = self._lod.get((stride, chunk_row, chunk_col))
+                if chunk is None:
+                    continue
+
+                at = (chunk_rows == chunk_row) & (chunk_cols == chunk_col)
+                local_cols = sampled_cols[at] - chunk_col * self.lod_chunk
+                top = 2 * (sampled_rows[at] - chunk_row * self.lod_chunk) + self._shifted(cols[sampled][at])
+                chunk[0][top, local_cols] = chunk[0][top + 1, local_cols] = colors[sampled][at]
+                # A new QImage gets a new cache key, so OpenGL viewports upload it again.
+                chunk[1] = None
+
+
+    def discard_lod(self):
+        """Forgets the low resolution chunks, they're made again when they're needed."""
+        self._lod.clear()
+        self._lod_bytes = 0
+
+
+    def _paint_lod(self, painter, col_from, col_to, row_from, row_to, zoom):
+        stride = self._lod_stride(zoom)
+        width, height = self.design.dimensions
+        # The exposed range in sampled beads.
+        row_from, row_to = row_from // stride, min(-(-row_to // stride), -(-height // stride))
+        col_from, col_to = col_from // stride, min(-(-col_to // stride), -(-width // stride))
+
+        # Once several beads share a screen pixel they're blended rather than picked.
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, zoom * Bead.pitch[WIDTH] * stride < 1)
+        size = self.lod_chunk
+        for chunk_row in range(row_from // size, -(-row_to // size)):
+            for chunk_col in range(col_from // size, -(-col_to // size)):
+                chunk = self._lod_chunk((stride, chunk_row, chunk_col))
+                if chunk[1] is None:
+                    pixels = chunk[0]
+                    chunk[1] = QImage(pixels.data, pixels.shape[1], pixels.shape[0], pixels.shape[1] * 4,
+                                      QImage.Format_ARGB32_Premultiplied)
+
+                first_row, last_row = max(row_from, chunk_row * size), min(row_to, (chunk_row + 1) * size)
+                first_col, last_col = max(col_from, chunk_col * size), min(col_to, (chunk_col + 1) * size)
+                rows = 2 * (last_row - first_row) + 1
+                source = QRectF(first_col - chunk_col * size, 2 * (first_row - chunk_row * size), last_col - first_col, rows)
+                target = QRectF(first_col * stride * Bead.pitch[WIDTH] + Bead.margain,
+                                first_row * stride * Bead.pitch[HEIGHT] + Bead.margain,
+                                (last_col - first_col) * stride * Bead.pitch[WIDTH],
+                                rows * stride * Bead.pitch[HEIGHT] / 2)
+                painter.drawImage(target, chunk[1], source)
+
+
+    @instrumented('BeadField.press')
+    def press(self, pos):
+        """Handles a press at the scene position pos, returns False if nothing was
+        done with it. The bead and clear tools start a stroke that follows the
+        mouse, the fill tool fills the area under the cursor. The selection tools
+        drag out a rectangle or a lasso, holding shift adds to the selection, and
+        the stamp tool pastes the copied beads."""
+        main_window = self.design.main_window
+        if main_window.select_tool_action.isChecked() or main_window.lasso_tool_action.isChecked():
+            add = bool(QGuiApplication.keyboardModifiers() & Qt.ShiftModifier)
+            previous = self.design.selection.bits.copy() if add else None
+            self._selecting = (self._nearest_cell(pos), previous)
+            if main_window.lasso_tool_action.isChecked():
+                self._lasso = [(pos.x(), pos.y())]
+
+            else:
+                self._select_to(self._selecting[0])
+
+            return True
+
+        location = self.design.cell_at(pos)
+        if location is None:
+            return False
+
+        if main_window.stamp_tool_action.isChecked():
+            if main_window.clip is not None:
+                self.design.stamp(main_window.clip, [location])
+
+            return True
+
+        if main_window.fill_tool_action.isChecked():
+            self.design.flood_fill(location, main_window.working_bead, main_window.symmetry)
+            return True
+
+        if main_window.bead_tool_action.isChecked():
+            self._stroke_index = self.design.palette_index(main_window.working_bead)
+
+        elif main_window.remove_tool_action.isChecked():
+            self._stroke_index = 0
+
+        else:
+            return False
+
+        self._stroke = [location]
+        self._stroke_pos = pos
+        # The whole stroke is undone in one go.
+        self.design.history.begin_group()
+        self._flush_stroke()
+        self._stroke_timer.start()
+        return True
+
+
+    def stroking(self):
+        return self._stroke is not None or self._selecting is not None
+
+
+    def drag(self, pos):
+        """Collects the beads the stroke passes over, they are applied once per frame.
+        When selecting the rectangle or the lasso follows the mouse."""
+        if self._lasso is not None:
+            previous = QPointF(*self._lasso[-1])
+            self._lasso.append((pos.x(), pos.y()))
+            self.update(QRectF(previous, pos).normalized().adjusted(-2, -2, 2, 2))
+            return
+
+        if self._selecting is not None:
+            self._select_to(self._nearest_cell(pos))
+            return
+
+        if self._stroke is None:
+            return
+
+        # Sample the path so fast movements don't skip beads.
+        delta = pos - self._stroke_pos
+        steps = max(1, int(max(abs(delta.x()), abs(delta.y())) // (Bead.dimension[WIDTH] // 2)))
+        for step in range(1, steps + 1):
+            location = self.design.cell_at(self._stroke_pos + delta * (step / steps))
+            if location is not None:
+                self._stroke.append(location)
+
+        self._stroke_pos = pos
+
+
+    def release(self):
+        if self._lasso is not None:
+            self._select_lasso()
+
+        self._selecting, self._lasso = None, None
+
+        if self._stroke is not None:
+            self._stroke_timer.stop()
+            self._flush_stroke()
+            self._stroke = None
+            self.design.history.end_group()
+
+
+    def _nearest_cell(self, pos):
+        """The (col, row) of the bead nearest to pos, inside the design."""
+        width, height = self.design.dimensions
+        col = min(max(0, int((pos.x() - Bead.margain) // Bead.pitch[WIDTH])), width - 1)
+        y = pos.y() - Bead.margain - Bead.offset(col, self.design.track_width)
+        return col, min(max(0, int(y // Bead.pitch[HEIGHT])), height - 1)
+
+
+    def _select_to(self, location):
+        """Selects the rectangle from where the selection started to location."""
+        (first_col, first_row), previous = self._selecting
+        design = self.design
+        # Adding to a selection starts over from the one there was before the drag.
+        drawn = design.selection.bounds()
+        if previous is not None:
+            design.selection.bits[:] = previous
+
+        design.select_rect(min(first_col, location[COL]), min(first_row, location[ROW]),
+                           max(first_col, location[COL]) + 1, max(first_row, location[ROW]) + 1,
+                           add=previous is not None)
+        design._selection_changed(drawn)
+
+
+    def _select_lasso(self):
+        """Selects the beads with their centre inside the lasso."""
+        lasso, (ignored, previous) = self._lasso, self._selecting
+        self.update(QPolygonF([QPointF(x, y) for x, y in lasso]).boundingRect().adjusted(-2, -2, 2, 2))
+
+        xs, ys = [x for x, y in lasso], [y for x, y in lasso]
+        col_from, col_to, row_from, row_to = self.visible_range(QRectF(QPointF(min(xs), min(ys)), QPointF(max(xs), max(ys))))
+        rows, cols = numpy.mgrid[row_from:row_to, col_from:col_to]
+        centres_x = cols * Bead.pitch[WIDTH] + Bead.margain + Bead.dimension[WIDTH] / 2
+        centres_y = (rows * Bead.pitch[HEIGHT] + Bead.margain + Bead.dimension[HEIGHT] / 2 +
+                     self._shifted(cols) * (Bead.dimension[HEIGHT] // 2))
+        inside = polygon_cells(lasso, centres_x, centres_y)
+        self.design.select(rows[inside], cols[inside], add=previous is not None)
+
+
+    @instrumented('BeadField.stroke')
+    def _flush_stroke(self):
+        if self._stroke:
+            cols, rows = zip(*self._stroke)
+            self.design.set_cells(rows, cols, self._stroke_index, self.design.main_window.symmetry)
+            self._stroke = []
+
+
+class Bead(object):
+    """A lightweight handle on one bead of the design. The data itself lives in
+    the DesignScene's cell array, this class just gives it a friendly interface."""
     dimension = (28, 40)
     margain = 4
-    _rounding = 5
-    _default_brush = QBrush(QColor(230, 230, 228))
-
-    def __init__(self, track_width, bead_type, parent=None, location=(0, 0), color=None):
-        """Standard python __init__ function, should not need too much explaining."""
-        super(Bead, self).__init__(parent)
-        self.setAcceptedMouseButtons(Qt.LeftButton)
-        self.setAcceptHoverEvents(True)
+    pitch = (dimension[WIDTH] + margain, dimension[HEIGHT] + margain)
 
+    def __init__(self, design, location=(0, 0)):
+        self.design = design
         self._location = location
-        self._color = color
-        self.bead_type = bead_type
-        self.track_width = track_width
 
-        self._calc_pos()
+
+    @property
+    def bead_type(self):
+        return self.design.bead_type_at(self._location)
+
+    @bead_type.setter
+    def bead_type(self, new_bead_type):
+        self.design.set_bead(self._location, new_bead_type)
 
 
     def set_bead_type(self, new_bead_type):
@@ -110,56 +1030,88 @@ class Bead(QGraphicsItem):
             self.bead_type = new_bead_type
 
         else:
-            self.bead_type = self.scene().main_window.default_bead
+            self.bead_type = self.design.main_window.default_bead
 
 
-    def _calc_pos(self):
-        """Sets up the bead's pxel coordinates relative to the scene."""
-        if (self._location[X] // self.track_width % 2):
-            adjustment = self.dimension[HEIGHT] // 2
+    @staticmethod
+    def offset(col, track_width):
+        """Every second track is shifted down by half a bead."""
+        if (col // track_width % 2):
+            return Bead.dimension[HEIGHT] // 2
 
         else:
-            adjustment = 0
+            return 0
 
-        self.setPos((self._location[X] * (self.dimension[WIDTH] + self.margain)) + self.margain,
-                    (self._location[Y] * (self.dimension[HEIGHT] + self.margain)) + self.margain + adjustment)
 
+    @staticmethod
+    def position(location, track_width):
+        """The pixel coordinates of the bead at location relative to the scene."""
+        return (location[X] * Bead.pitch[WIDTH] + Bead.margain,
+                location[Y] * Bead.pitch[HEIGHT] + Bead.margain + Bead.offset(location[X], track_width))
 
-    def boundingRect(self):
-        """QGraphicsItem's required boundingRect function used for all sorts of sorcery."""
-        return QRectF(0, 0, self.dimension[WIDTH], self.dimension[HEIGHT])
+
+    def _calc_pos(self):
+        """Returns the bead's pixel coordinates relative to the scene."""
+        return Bead.position(self._location, self.design.track_width)
 
 
-    def paint(self, painter, option, widget):
-        """A really artsy function... It draws. See QGraphicsItem's documentation for more"""
-        painter.drawPixmap(0, 0, self.bead_type.pixmap)
+    def to_dict(self):
+        """For json serialization."""
+        rdict = {'__bead_type__': self.bead_type.data(1, Qt.DisplayRole),
+                 '__x__': self._location[COL], '__y__': self._location[ROW]}
+        return rdict
 
 
-    def mousePressEvent(self, evt):
-        """Handles mouse events."""
-        if self.scene().main_window.bead_tool_action.isChecked():
-            self.bead_type = self.scene().main_window.working_bead
 
-        elif self.scene().main_window.remove_tool_action.isChecked():
-            self.bead_type = self.scene().main_window.default_bead
+class Symmetry(object):
+    """Expands edits into their mirror images. The centre of every bead is mirrored
+    or rotated around the middle of the design and snapped to the nearest bead.
+    The shifted tracks sit less than half a row lower, so mirroring keeps beads in
+    their row even where a straight track lands on a shifted one."""
+    def __init__(self, horizontal=False, vertical=False, folds=1):
+        self.horizontal, self.vertical, self.folds = horizontal, vertical, folds
 
-        # Must run update to redraw...
-        self.update()
+        mirrors = [numpy.eye(2)]
+        if horizontal:
+            mirrors.append(numpy.diag([-1.0, 1.0]))
 
+        if vertical:
+            mirrors.append(numpy.diag([1.0, -1.0]))
 
-    def hoverEnterEvent(self, evt):
-        row = self._location[ROW] + 1
-        col = self._location[COL] + 1
-        b_type = self.bead_type.data(1, Qt.DisplayRole)
-        self.scene().main_window.statusBar().showMessage('row: {0} column: {1} type: {2}'.format(row, col, b_type))
+        if horizontal and vertical:
+            mirrors.append(numpy.diag([-1.0, -1.0]))
 
+        angles = 2 * numpy.pi * numpy.arange(folds) / folds
+        rotations = [numpy.array([[numpy.cos(angle), -numpy.sin(angle)], [numpy.sin(angle), numpy.cos(angle)]])
+                     for angle in angles]
+        # Everything but the identity, which is the edit itself.
+        self.transforms = [rotation.dot(mirror) for rotation in rotations for mirror in mirrors][1:]
 
-    def hoverLeaveEvent(self, evt):
-        self.scene().main_window.statusBar().clearMessage()
 
+    def expand(self, design, rows, cols, values):
+        """Returns rows, cols and values with the mirror images of every cell
+        inside the design added in front, so the cells edited win where images overlap."""
+        width, height = design.dimensions
+        track_width = design.track_width
+        # Twice the middle of the design, see BeadField.boundingRect.
+        centre = numpy.array([[width * Bead.pitch[WIDTH] + Bead.margain],
+                              [height * Bead.pitch[HEIGHT] + Bead.margain + Bead.dimension[HEIGHT] // 2]]) / 2
 
-    def to_dict(self):
-        """For json serialization."""
-        rdict = {'__bead_type__': self.bead_type.data(1, Qt.DisplayRole),
-                 '__x__': self._location[COL], '__y__': self._location[ROW]}
-        return rdict
+        points = numpy.stack([cols * Bead.pitch[WIDTH] + Bead.margain + Bead.dimension[WIDTH] / 2,
+                              rows * Bead.pitch[HEIGHT] + Bead.margain + Bead.dimension[HEIGHT] / 2 +
+                              cols // track_width % 2 * (Bead.dimension[HEIGHT] // 2)]) - centre
+
+        all_rows, all_cols = [], []
+        for transform in self.transforms:
+            x, y = transform.dot(points) + centre
+            image_cols = numpy.rint((x - Bead.margain - Bead.dimension[WIDTH] / 2) / Bead.pitch[WIDTH]).astype(numpy.int64)
+            image_rows = numpy.rint((y - Bead.margain - Bead.dimension[HEIGHT] / 2 -
+                                     image_cols // track_width % 2 * (Bead.dimension[HEIGHT] // 2)) /
+                                    Bead.pitch[HEIGHT]).astype(numpy.int64)
+            all_rows.append(image_rows)
+            all_cols.append(image_cols)
+
+        all_rows, all_cols = numpy.concatenate(all_rows + [rows]), numpy.concatenate(all_cols + [cols])
+        all_values = numpy.concatenate([values] * len(self.transforms) + [values])
+        inside = (all_rows >= 0) & (all_rows < height) & (all_cols >= 0) & (all_cols < width)
+        return all_rows[inside], all_cols[inside], all_values[inside]
@@ -0,0 +1,182 @@
+"""
+This module houses the selection of a design and the clips copied out of it.
+The selection is a bitmask over the cells packed eight beads to a byte.
+
+Every second track is shifted down by half a bead, so beads are placed by half
+rows: the bead at (col, row) sits 2 * row + shifted(col) half rows down. Moving
+a motif by an odd number of tracks swaps shifted and straight tracks, keeping
+the half rows (rather than the rows) keeps the shape of the motif.
+"""
+import numpy
+
+# Set bits of every byte value.
+_POPCOUNT = numpy.array([bin(value).count('1') for value in range(256)], dtype=numpy.int64)
+
+
+
+def shifted(cols, track_width):
+    """1 for the columns of the shifted tracks, 0 for the others."""
+    return cols // track_width % 2
+
+
+
+class Selection(object):
+    """The selected cells of a design, one bit per bead."""
+    def __init__(self, width, height):
+        self.width, self.height = width, height
+        self.bits = numpy.zeros((height, (width + 7) // 8), dtype=numpy.uint8)
+
+
+    def __bool__(self):
+        return bool(self.bits.any())
+
+
+    def __len__(self):
+        return int(_POPCOUNT[self.bits].sum())
+
+
+    def _unpack(self, row_from, row_to):
+        return numpy.unpackbits(self.bits[row_from:row_to], axis=1, count=self.width).astype(bool)
+
+
+    def _pack(self, row_from, mask):
+        self.bits[row_from:row_from + len(mask)] = numpy.packbits(mask, axis=1)
+
+
+    def clear(self):
+        self.bits[:] = 0
+
+
+    def select_all(self):
+        self._pack(0, numpy.ones((self.height, self.width), dtype=bool))
+
+
+    def select_rect(self, col_from, row_from, col_to, row_to, add=False):
+        """Selects the cells from (col_from, row_from) up to but not including (col_to, row_to)."""
+        if not add:
+            self.clear()
+
+        col_from, col_to = max(0, col_from), min(self.width, col_to)
+        row_from, row_to = max(0, row_from), min(self.height, row_to)
+        if col_from >= col_to or row_from >= row_to:
+            return
+
+        block = self._unpack(row_from, row_to)
+        block[:, col_from:col_to] = True
+        self._pack(row_from, block)
+
+
+    def select_cells(self, rows, cols, add=False):
+        """Selects the cells at the given rows and cols."""
+        if not add:
+            self.clear()
+
+        rows, cols = numpy.asarray(rows, dtype=numpy.int64), numpy.asarray(cols, dtype=numpy.int64)
+        if not rows.size:
+            return
+
+        row_from = int(rows.min())
+        block = self._unpack(row_from, int(rows.max()) + 1)
+        block[rows - row_from, cols] = True
+        self._pack(row_from, block)
+
+
+    def bounds(self):
+        """Returns (col_from, row_from, col_to, row_to) around the selected cells,
+        the upper bounds are exclusive, or None if nothing is selected."""
+        rows = numpy.flatnonzero(self.bits.any(axis=1))
+        if not rows.size:
+            return None
+
+        row_from, row_to = int(rows[0]), int(rows[-1]) + 1
+        cols = numpy.flatnonzero(numpy.unpackbits(numpy.bitwise_or.reduce(self.bits[row_from:row_to], axis=0),
+                                                  count=self.width))
+        return int(cols[0]), row_from, int(cols[-1]) + 1, row_to
+
+
+    def mask(self, col_from, row_from, col_to, row_to):
+        """The selected cells in the given range as a boolean block."""
+        return self._unpack(row_from, row_to)[:, col_from:col_to]
+
+
+    def cells(self):
+        """Returns the (rows, cols) of the selected cells."""
+        bounds = self.bounds()
+        if bounds is None:
+            return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+
+        col_from, row_from, col_to, row_to = bounds
+        rows, cols = numpy.nonzero(self.mask(*bounds))
+        return rows + row_from, cols + col_from
+
+
+
+class Clip(object):
+    """Beads copied out of a design. The positions are kept relative to the
+    first track of the copy as if it was a straight one: cols from 0 and half
+    rows from the top row of the copy. values index into bead_types."""
+    def __init__(self, bead_types, track_width, tracks, cols, half_rows, values):
+        self.bead_types, self.track_width, self.tracks = bead_types, track_width, tracks
+        self.cols, self.half_rows, self.values = cols, half_rows, values
+
+
+    @classmethod
+    def from_cells(cls, palette, track_width, rows, cols, values):
+        """Copies the beads at rows, cols with the palette indices values."""
+        col_from = int(cols.min()) // track_width * track_width
+        first_shifted = int(shifted(col_from, track_width))
+        tracks = (int(cols.max()) - col_from) // track_width + 1
+
+        used, values = numpy.unique(values, return_inverse=True)
+        half_rows = 2 * (rows - int(rows.min())) + shifted(cols, track_width) - first_shifted
+        return cls([palette[index] for index in used.tolist()], track_width, tracks,
+                   cols - col_from, half_rows, values.astype(numpy.int64))
+
+
+    def __len__(self):
+        return self.values.size
+
+
+    def flipped(self, horizontal=True):
+        """The clip mirrored left to right (horizontal) or top to bottom. Beads
+        only line up again a half row up or down when the number of tracks is
+        even, so the mirror image is moved down half a bead then."""
+        if horizontal:
+            cols = self.tracks * self.track_width - 1 - self.cols
+            half_rows = self.half_rows + (self.tracks + 1) % 2
+
+        else:
+            cols = self.cols
+            # Mirror around an even half row so every bead stays on its own kind of track.
+            axis = int(self.half_rows.min() + self.half_rows.max())
+            half_rows = axis + axis % 2 - self.half_rows
+
+        return Clip(self.bead_types, self.track_width, self.tracks, cols, half_rows, self.values)
+
+
+    def placed(self, track_width, origins):
+        """Returns the (rows, cols) of the beads of a copy at every (col, row) in
+        origins, one copy after the other. A copy starts at the first column of
+        the track the origin is in and its top row goes to the origin's row."""
+        origins = numpy.asarray(origins, dtype=numpy.int64).reshape(-1, 2)
+        origin_cols = origins[:, 0] // track_width * track_width
+
+        cols = origin_cols[:, None] + self.cols[None, :]
+        half_rows = 2 * origins[:, 1, None] + shifted(origin_cols, track_width)[:, None] + self.half_rows[None, :]
+        rows = (half_rows - shifted(cols, track_width)) // 2
+        return rows.ravel(), cols.ravel()
+
+
+def polygon_cells(points, centres_x, centres_y):
+    """Returns a boolean array of which centres lie inside the polygon through
+    points [(x, y)], by the even-odd rule."""
+    inside = numpy.zeros(centres_x.shape, dtype=bool)
+    for (x1, y1), (x2, y2) in zip(points, points[1:] + points[:1]):
+        if y1 == y2:
+            continue
+
+        crosses = (centres_y >= min(y1, y2)) & (centres_y < max(y1, y2))
+        at_x = x1 + (centres_y - y1) * (x2 - x1) / (y2 - y1)
+        inside ^= crosses & (centres_x < at_x)
+
+    return inside
@@ -0,0 +1,301 @@
+"""
+This module implements the binary tiled design container (.peyt) for very
+large designs.
+The file starts with a small fixed header followed by a JSON header holding the
+__info__ and __palette__ of the design (same layout as version 2 .peyd files).
+After some reserved space the cells follow as fixed-size square tiles of
+little-endian uint16 palette indices, tile rows first. The tiles are accessed
+through mmap and only the ones that are actually touched get decoded.
+The file only ever changes when the design is saved, edited tiles that don't
+fit in memory until then are kept in a temporary file next to it.
+"""
+from collections import OrderedDict
+
+import json
+import mmap
+import os
+import struct
+import tempfile
+
+import numpy
+
+TILE_MAGIC = b'PEYT'
+TILE_FORMAT_VERSION = 3
+DEFAULT_TILE_SIZE = 64
+DEFAULT_TILE_BUDGET = 64 * 1024 * 1024
+
+# magic, format version, tile size, offset of the first tile, length of the json header
+_HEADER = struct.Struct('<4sHHQQ')
+
+
+
+def _data_offset(header_length):
+    """Leaves room for the json header to grow before the first tile."""
+    reserve = _HEADER.size + max(2 * header_length, 64 * 1024)
+    return -(-reserve // mmap.ALLOCATIONGRANULARITY) * mmap.ALLOCATIONGRANULARITY
+
+
+def _encode_header(header):
+    return json.dumps(header, separators=(',', ':')).encode('utf-8')
+
+
+def write_tiles(path, header, cells, tile=DEFAULT_TILE_SIZE):
+    """Writes a tiled design file. cells can be anything that can be sliced like a
+    2D numpy array (including TiledCells), it is streamed one band of tiles at a time.
+    If cells is None the design is left blank."""
+    info = header['__info__']
+    height, width = info['__height__'], info['__tracks__'] * info['__track_width__']
+    across, down = -(-width // tile), -(-height // tile)
+    tile_bytes = tile * tile * 2
+
+    encoded = _encode_header(header)
+    data_offset = _data_offset(len(encoded))
+
+    with open(path, 'wb') as file:
+        file.write(_HEADER.pack(TILE_MAGIC, TILE_FORMAT_VERSION, tile, data_offset, len(encoded)))
+        file.write(encoded)
+
+        if cells is not None:
+            padded = numpy.zeros((tile, across * tile), dtype='<u2')
+            for ty in range(0, down):
+                band = cells[ty * tile:(ty + 1) * tile, 0:width]
+                padded[:] = 0
+                padded[0:band.shape[0], 0:width] = band
+
+                file.seek(data_offset + ty * across * tile_bytes)
+                for tx in range(0, across):
+                    file.write(padded[:, tx * tile:(tx + 1) * tile].tobytes())
+
+        # Blank tiles are never written, the file is just extended (sparsely where supported).
+        file.truncate(data_offset + across * down * tile_bytes)
+
+
+
+class TiledCells(object):
+    """Behaves like the 2D numpy array of palette indices the DesignScene uses, but
+    the data stays in a memory-mapped tiled file. Tiles are decoded on first access
+    and kept in an LRU cache bounded by budget (bytes). Edited tiles that get evicted
+    are spilled to a temporary file, they only go into the design file (together with
+    the header) when it is flushed."""
+    dtype = numpy.dtype('<u2')
+    ndim = 2
+
+    def __init__(self, path, budget=DEFAULT_TILE_BUDGET):
+        self.path, self.budget = path, budget
+        self._file = open(path, 'r+b')
+
+        magic, version, self.tile, self._data_offset, length = _HEADER.unpack(self._file.read(_HEADER.size))
+        if magic != TILE_MAGIC or version != TILE_FORMAT_VERSION:
+            self._file.close()
+            raise ValueError('{} is not a tiled design file.'.format(path))
+
+        self.header = json.loads(self._file.read(length).decode('utf-8'))
+        info = self.header['__info__']
+        self.shape = (info['__height__'], info['__tracks__'] * info['__track_width__'])
+        self.size = self.shape[0] * self.shape[1]
+
+        self._across = -(-self.shape[1] // self.tile)
+        self._tile_bytes = self.tile * self.tile * self.dtype.itemsize
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+
+        self._pages = OrderedDict()
+        self._dirty = set()
+        # Offsets of the evicted edited tiles in the spill file, created when first needed.
+        self._spill = None
+        self._spilled = {}
+
+
+    def _page(self, key):
+        """Returns the decoded tile at (tile_row, tile_col)."""
+        try:
+            self._pages.move_to_end(key)
+            return self._pages[key]
+
+        except KeyError:
+            if key in self._spilled:
+                page = self._read_spilled(key)
+
+            else:
+                offset = self._data_offset + (key[0] * self._across + key[1]) * self._tile_bytes
+                page = numpy.frombuffer(self._mmap, dtype=self.dtype, count=self.tile * self.tile,
+                                        offset=offset).reshape(self.tile, self.tile).copy()
+
+            # Make room first so the tile being handed out is never the one evicted.
+            while self._pages and (len(self._pages) + 1) * self._tile_bytes > self.budget:
+                self._evict()
+
+            self._pages[key] = page
+            return page
+
+
+    def _evict(self):
+        key, page = self._pages.popitem(last=False)
+        if key in self._dirty:
+            self._spill_page(key, page)
+
+
+    def _spill_page(self, key, page):
+        """Keeps an edited tile in the spill file, a tile spilled before reuses its slot."""
+        if self._spill is None:
+            # Next to the design rather than in /tmp, which may well live in memory.
+            self._spill = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(self.path)))
+
+        offset = self._spilled.setdefault(key, len(self._spilled) * self._tile_bytes)
+        self._spill.seek(offset)
+        self._spill.write(page.tobytes())
+        self._dirty.discard(key)
+
+
+    def _read_spilled(self, key):
+        self._spill.seek(self._spilled[key])
+        data = self._spill.read(self._tile_bytes)
+        return numpy.frombuffer(data, dtype=self.dtype).reshape(self.tile, self.tile).copy()
+
+
+    def _write_back(self, key, page):
+        offset = self._data_offset + (key[0] * self._across + key[1]) * self._tile_bytes
+        self._mmap[offset:offset + self._tile_bytes] = page.tobytes()
+
+
+    def _block(self, rows, cols):
+        """Yields (key, tile rows, tile cols, block rows, block cols) for every tile a block touches."""
+        (r0, r1), (c0, c1), tile = rows, cols, self.tile
+        for ty in range(r0 // tile, -(-r1 // tile)):
+            tr0, tr1 = max(r0, ty * tile), min(r1, (ty + 1) * tile)
+            for tx in range(c0 // tile, -(-c1 // tile)):
+                tc0, tc1 = max(c0, tx * tile), min(c1, (tx + 1) * tile)
+                yield ((ty, tx),
+                       slice(tr0 - ty * tile, tr1 - ty * tile), slice(tc0 - tx * tile, tc1 - tx * tile),
+                       slice(tr0 - r0, tr1 - r0), slice(tc0 - c0, tc1 - c0))
+
+
+    def _ranges(self, key):
+        """Normalizes a (rows, cols) index of ints and unit-step slices into ranges."""
+        ranges = []
+        for index, length in zip(key, self.shape):
+            if isinstance(index, slice):
+                start, stop, step = index.indices(length)
+                if step != 1:
+                    raise IndexError('TiledCells only supports contiguous slices.')
+
+                ranges.append((start, max(start, stop)))
+
+            else:
+                index = int(index)
+                if index < 0:
+                    index += length
+
+                if not 0 <= index < length:
+                    raise IndexError('Cell index out of range.')
+
+                ranges.append((index, index + 1))
+
+        return ranges
+
+
+    def _groups(self, rows, cols):
+        """Groups fancy (rows, cols) index arrays by tile, yields (key, positions)."""
+        keys = (rows // self.tile) * self._across + cols // self.tile
+        order = numpy.argsort(keys, kind='stable')
+        unique, starts = numpy.unique(keys[order], return_index=True)
+        for key, positions in zip(unique.tolist(), numpy.split(order, starts[1:])):
+            yield divmod(key, self._across), positions
+
+
+    def __getitem__(self, key):
+        rows, cols = key
+        if isinstance(rows, (slice, int, numpy.integer)) and isinstance(cols, (slice, int, numpy.integer)):
+            ranges = self._ranges(key)
+            out = numpy.empty((ranges[0][1] - ranges[0][0], ranges[1][1] - ranges[1][0]), dtype=self.dtype)
+            for page_key, tr, tc, br, bc in self._block(*ranges):
+                out[br, bc] = self._page(page_key)[tr, tc]
+
+            if not isinstance(rows, slice) and not isinstance(cols, slice):
+                return out[0, 0]
+
+            return out[0] if not isinstance(rows, slice) else (out[:, 0] if not isinstance(cols, slice) else out)
+
+        rows, cols = numpy.broadcast_arrays(numpy.asarray(rows, dtype=numpy.int64), numpy.asarray(cols, dtype=numpy.int64))
+        out = numpy.empty(rows.shape, dtype=self.dtype)
+        flat_rows, flat_cols, flat_out = rows.ravel(), cols.ravel(), out.reshape(-1)
+        for page_key, positions in self._groups(flat_rows, flat_cols):
+            flat_out[positions] = self._page(page_key)[flat_rows[positions] % self.tile, flat_cols[positions] % self.tile]
+
+        return out
+
+
+    def __setitem__(self, key, value):
+        rows, cols = key
+        if isinstance(rows, (slice, int, numpy.integer)) and isinstance(cols, (slice, int, numpy.integer)):
+            ranges = self._ranges(key)
+            value = numpy.broadcast_to(numpy.asarray(value, dtype=self.dtype),
+                                       (ranges[0][1] - ranges[0][0], ranges[1][1] - ranges[1][0]))
+            for page_key, tr, tc, br, bc in self._block(*ranges):
+                self._page(page_key)[tr, tc] = value[br, bc]
+                self._dirty.add(page_key)
+
+            return
+
+        rows, cols = numpy.broadcast_arrays(numpy.asarray(rows, dtype=numpy.int64), numpy.asarray(cols, dtype=numpy.int64))
+        flat_rows, flat_cols = rows.ravel(), cols.ravel()
+        value = numpy.broadcast_to(numpy.asarray(value, dtype=self.dtype), rows.shape).ravel()
+        for page_key, positions in self._groups(flat_rows, flat_cols):
+            self._page(page_key)[flat_rows[positions] % self.tile, flat_cols[positions] % self.tile] = value[positions]
+            self._dirty.add(page_key)
+
+
+    def __array__(self, dtype=None, copy=None):
+        """Materializes the whole design, only meant for exporting to other formats."""
+        out = self[0:self.shape[0], 0:self.shape[1]]
+        return out.astype(dtype) if dtype is not None else out
+
+
+    def __len__(self):
+        return self.shape[0]
+
+
+    def set_header(self, header):
+        """Replaces the json header, moving the tiles further back if it no longer fits."""
+        encoded = _encode_header(header)
+        data_offset = self._data_offset
+
+        if _HEADER.size + len(encoded) > data_offset:
+            data_offset = _data_offset(len(encoded))
+            data_length = len(self._mmap) - self._data_offset
+            self._mmap.resize(data_offset + data_length)
+            self._mmap.move(data_offset, self._data_offset, data_length)
+
+        self._mmap[0:_HEADER.size] = _HEADER.pack(TILE_MAGIC, TILE_FORMAT_VERSION, self.tile, data_offset, len(encoded))
+        self._mmap[_HEADER.size:_HEADER.size + len(encoded)] = encoded
+        self._data_offset, self.header = data_offset, header
+
+
+    def flush(self, header=None):
+        """Writes the edited tiles, spilled or in memory, and optionally a new header
+        to the file. The header goes first since a bigger one moves the tiles."""
+        if header is not None:
+            self.set_header(header)
+
+        for key in self._spilled:
+            if key not in self._dirty:
+                self._write_back(key, self._read_spilled(key))
+
+        for key in self._dirty:
+            self._write_back(key, self._pages[key])
+
+        self._dirty.clear()
+        self._spilled.clear()
+        if self._spill is not None:
+            self._spill.truncate(0)
+
+        self._mmap.flush()
+
+
+    def close(self):
+        """Closes the file, edits that weren't flushed are dropped."""
+        if not self._mmap.closed:
+            self._mmap.close()
+            self._file.close()
+
+            if self._spill is not None:
+                self._spill.close()
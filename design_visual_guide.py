@@ -8,19 +8,31 @@ from PyQt5.QtCore import *
 from PyQt5.QtWidgets import *
 from PyQt5.QtGui import *
 
+from profiling import instrumented
+
 from util import *
 
 
 
 class Grid(QGraphicsItem):
     """QGraphicsItem that draws a simple grid on top of the design to make it
-    visually easier to navigate."""
+    visually easier to navigate. Zoomed out only every so many lines are drawn,
+    so they stay at least min_spacing screen pixels apart."""
+    _pen = QPen(QBrush(QColor(140, 139, 134)), 2.5)
+    min_spacing = 4
+
     def __init__(self, track_width, dimensions, parent=None):
         """Pretty straigt forward __init__ function. Nothing fancy."""
         super(Grid, self).__init__(parent)
-        self.track_width, self.dimension = track_width, dimensions
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption, True)
         self.pixel_dimensions = (28, 40)
         self.margain = 4
+        self.set_dimensions(track_width, dimensions)
+
+    def set_dimensions(self, track_width, dimensions):
+        """Changes the geometry of the grid."""
+        self.prepareGeometryChange()
+        self.track_width, self.dimension = track_width, dimensions
 
     def boundingRect(self):
         """QGraphicsItem's required bounding rect function, used for culling offscreen geometry
@@ -29,18 +41,65 @@ class Grid(QGraphicsItem):
                       (self.pixel_dimensions[WIDTH] + self.margain) * self.dimension[WIDTH] + 60,
                       (self.pixel_dimensions[HEIGHT] + self.margain) * self.dimension[HEIGHT] + 60)
 
+    @instrumented('Grid.paint')
     def paint(self, painter, option, widget):
-        """Overloading the paint function of QGraphicsItem all the drawing is done here."""
+        """Overloading the paint function of QGraphicsItem all the drawing is done here.
+        Only the lines crossing the exposed rectangle are drawn."""
+        first_vertical, last_vertical, first_band, last_band = self.visible_range(option.exposedRect)
+        if first_vertical > last_vertical:
+            return
+
+        zoom = painter.worldTransform().m11()
+        track_stride = self._stride(self.track_width * (self.margain + self.pixel_dimensions[WIDTH]) * zoom)
+        band_stride = self._stride(5 * (self.margain + self.pixel_dimensions[HEIGHT]) * zoom)
+        self.draw(painter, first_vertical, last_vertical, first_band, last_band, track_stride, band_stride)
+
+    def _stride(self, spacing):
+        """Every how many lines to draw for lines spacing screen pixels apart, a
+        power of two so the lines left don't jump about while zooming."""
+        stride = 1
+        while 0 < spacing * stride < self.min_spacing:
+            stride *= 2
+
+        return stride
+
+    def visible_range(self, rect):
+        """Returns the (first, last) vertical lines and (first, last) horizontal bands
+        that can touch rect, both inclusive."""
+        track_pixel_width = self.track_width * (self.margain + self.pixel_dimensions[WIDTH])
+        band_height = 5 * (self.pixel_dimensions[HEIGHT] + self.margain)
+        # Lines are thick, the shifted tracks draw half a bead lower and the outer lines stick out 30px.
+        slack = self._pen.widthF() + 30
+
+        first_vertical = max(0, int((rect.left() - self.margain // 2 - slack) // track_pixel_width))
+        last_vertical = min(self.dimension[WIDTH] // self.track_width,
+                            int((rect.right() - self.margain // 2 + slack) // track_pixel_width) + 1)
+        first_band = max(0, int((rect.top() - self.margain // 2 - slack) // band_height))
+        last_band = min(self.dimension[HEIGHT] // 5, int((rect.bottom() - self.margain // 2 + slack) // band_height))
+        return first_vertical, last_vertical, first_band, last_band
+
+    def _lines(self, first, last, stride, edge):
+        """Every stride-th line from first to last, and the edge of the design."""
+        lines = list(range(first + -first % stride, last + 1, stride))
+        if stride > 1 and first <= edge <= last and edge % stride:
+            lines.append(edge)
+
+        return lines
+
+    def draw(self, painter, first_vertical, last_vertical, first_band, last_band, track_stride=1, band_stride=1):
+        """Draws the lines in the given range (see visible_range) with painter, only
+        every track_stride-th vertical and band_stride-th horizontal line. Nothing
+        is changed on the grid, so charts can be drawn from other threads."""
         # Set up painter with the right colors width etc.
-        painter.setPen(QPen(QBrush(QColor(140, 139, 134)), 2.5))
+        painter.setPen(self._pen)
 
         # Calculate some basic common values
         track_pixel_width =  self.track_width * (self.margain + self.pixel_dimensions[WIDTH])
         bottom = (self.pixel_dimensions[HEIGHT] + self.margain) * self.dimension[HEIGHT] + self.pixel_dimensions[HEIGHT] // 2
-        right = (self.pixel_dimensions[WIDTH] + self.margain) * self.dimension[WIDTH]
+        last_track = self.dimension[WIDTH] // self.track_width - 1
 
         # Draw vertical lines
-        for vertical in range(0, self.dimension[WIDTH] // self.track_width + 1):
+        for vertical in self._lines(first_vertical, last_vertical, track_stride, last_track + 1):
             # Calculate the base x coordinate
             xc = vertical * (track_pixel_width) + self.margain // 2
 
@@ -49,11 +108,21 @@ class Grid(QGraphicsItem):
 
 
         # Draw horizontal lines
-        for horizontal in range(0, self.dimension[1] // 5 + 1):
+        for horizontal in self._lines(first_band, last_band, band_stride, self.dimension[HEIGHT] // 5):
             # Calculate the base y coordinate
             yc = 5 * horizontal * (self.pixel_dimensions[HEIGHT] + self.margain) + self.margain // 2
 
-            for track in range(0, self.dimension[WIDTH] // self.track_width):
+            if track_stride > 1:
+                # The tracks are too narrow to make out the half bead steps, one line
+                # half way between them goes across.
+                painter.drawLine(first_vertical * track_pixel_width + self.margain // 2 - (30 if first_vertical == 0 else 0),
+                                 yc + self.pixel_dimensions[HEIGHT] // 4,
+                                 min(last_vertical, last_track + 1) * track_pixel_width + self.margain // 2 +
+                                 (30 if last_vertical > last_track else 0),
+                                 yc + self.pixel_dimensions[HEIGHT] // 4)
+                continue
+
+            for track in range(first_vertical, min(last_vertical, last_track + 1)):
                 # Shift down for every second track
                 if track % 2 == 1:
                     adjustement = self.pixel_dimensions[HEIGHT] // 2
@@ -69,7 +138,7 @@ class Grid(QGraphicsItem):
                     h_adjustement = 0
 
                 # Extend 30 px after the end
-                if track == (self.dimension[WIDTH] // self.track_width - 1):
+                if track == last_track:
                     w_adjustement = 30
 
                 else:
@@ -5,19 +5,29 @@ Date: 10.11.2014
 """
 from PyQt5.QtCore import *
 from PyQt5.QtWidgets import *
-from PyQt5.QtOpenGL import *
 from PyQt5.QtGui import *
 
 from design_model import *
+from profiling import instrumented
+
+
+
+def viewport_widget():
+    """The OpenGL viewport of the views, QtOpenGL only gets loaded with the first one."""
+    from PyQt5.QtOpenGL import QGLWidget
+    return QGLWidget()
 
 
 
 class PatternArea(QGraphicsView):
-    _minzoom = 0.3
+    # Zooming out further is allowed if that's what it takes to fit the whole design.
+    _minzoom = 0.05
     _maxzoom = 2.0
+    # Every wheel step zooms by this factor.
+    _zoom_step = 1.15
     def __init__(self, design=None, parent=None):
         super(PatternArea, self).__init__(parent)
-        self.setViewport(QGLWidget())
+        self.setViewport(viewport_widget())
         self.setRenderHint(QPainter.Antialiasing, False)
         self.setBackgroundBrush(QBrush(QColor(190, 189, 184)))
         self._zoom = 1
@@ -32,14 +42,114 @@ class PatternArea(QGraphicsView):
         self.setScene(design)
         self.setInteractive(True)
 
+        # The bead under the mouse is looked up at most once per screen refresh. No item
+        # takes hover events, so the view has to ask for mouse moves itself.
+        self.viewport().setMouseTracking(True)
+        self._hover_pos, self._hovered = None, None
+        self._highlight = False
+        self._hover_timer = QTimer(self)
+        self._hover_timer.setSingleShot(True)
+        self._hover_timer.setInterval(int(1000 / max(1.0, QGuiApplication.primaryScreen().refreshRate())))
+        self._hover_timer.timeout.connect(self._update_hover)
+
+    @instrumented('PatternArea.frame', frame=True)
+    def paintEvent(self, evt):
+        super(PatternArea, self).paintEvent(evt)
+
+    def set_highlight(self, enabled):
+        """Turns highlighting the row and column of the hovered bead on or off."""
+        self._highlight = enabled
+        if self._hovered is not None:
+            self._update_highlight(self._hovered)
+
+    def _highlight_rects(self, location):
+        """The scene rects covering the row and the column of the bead at location."""
+        design = self.scene()
+        width, height = design.dimensions
+        x, y = Bead.position((location[COL], 0), design.track_width)
+        column = QRectF(x, Bead.margain, Bead.dimension[WIDTH],
+                        (height - 1) * Bead.pitch[HEIGHT] + Bead.dimension[HEIGHT] + Bead.dimension[HEIGHT] // 2)
+
+        # The row steps down half a bead on every shifted track.
+        row_y = location[ROW] * Bead.pitch[HEIGHT] + Bead.margain
+        track_pixel_width = design.track_width * Bead.pitch[WIDTH]
+        row = [QRectF(track * track_pixel_width + Bead.margain, row_y + Bead.offset(track * design.track_width, design.track_width),
+                      track_pixel_width - Bead.margain, Bead.dimension[HEIGHT])
+               for track in range(0, design.tracks)]
+        return [column] + row
+
+    def _update_highlight(self, location):
+        """Repaints only the strips of the row and the column at location."""
+        if location is None:
+            return
+
+        design = self.scene()
+        rect = QRectF(0, location[ROW] * Bead.pitch[HEIGHT],
+                      design.dimensions[WIDTH] * Bead.pitch[WIDTH] + Bead.margain,
+                      Bead.pitch[HEIGHT] + Bead.margain + Bead.dimension[HEIGHT] // 2)
+        for strip in (rect, self._highlight_rects(location)[0]):
+            self.viewport().update(self.mapFromScene(strip).boundingRect().adjusted(-1, -1, 1, 1))
+
+    def drawForeground(self, painter, rect):
+        if not self._highlight or self._hovered is None:
+            return
+
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(QColor(255, 255, 255, 70))
+        for highlight in self._highlight_rects(self._hovered):
+            if highlight.intersects(rect):
+                painter.drawRect(highlight)
+
+    @instrumented('PatternArea.hover')
+    def _update_hover(self):
+        """Shows the bead under the mouse in the status bar if it changed since last time."""
+        location = None
+        if self._hover_pos is not None:
+            location = self.scene().cell_at(self.mapToScene(self._hover_pos))
+
+        if location == self._hovered:
+            return
+
+        previous, self._hovered = self._hovered, location
+        status_bar = self.scene().main_window.statusBar()
+        if location is None:
+            status_bar.clearMessage()
+
+        else:
+            b_type = self.scene().bead_type_at(location).data(1, Qt.DisplayRole)
+            status_bar.showMessage('row: {0} column: {1} type: {2}'.format(location[ROW] + 1,
+                                                                           location[COL] + 1,
+                                                                           b_type))
+
+        if self._highlight:
+            self._update_highlight(previous)
+            self._update_highlight(location)
+
+    def viewportEvent(self, evt):
+        if evt.type() == QEvent.Leave:
+            self._hover_pos = None
+            self._hover_timer.stop()
+            self._update_hover()
+
+        return super(PatternArea, self).viewportEvent(evt)
+
+    def min_zoom(self):
+        """The smallest zoom, small enough for the whole design to fit in the view."""
+        bounds = self.scene().itemsBoundingRect()
+        if bounds.isEmpty():
+            return self._minzoom
+
+        fit = min(self.viewport().width() / bounds.width(), self.viewport().height() / bounds.height())
+        return min(self._minzoom, fit)
+
     def zoom(self, delta):
         if self._zoom == self._maxzoom and delta > 0:
             return
 
         self._zoom += delta
 
-        if self._zoom < self._minzoom:
-            self._zoom = self._minzoom
+        if self._zoom < self.min_zoom():
+            self._zoom = self.min_zoom()
 
         elif self._zoom > self._maxzoom:
             self._zoom = self._maxzoom
@@ -50,11 +160,12 @@ class PatternArea(QGraphicsView):
 
     def wheelEvent(self, evt):
         """Deals with the mousewheel, calls the zoom function accordingly."""
+        # The steps are relative so zooming stays even all the way down.
         if evt.angleDelta().y() > 0:
-            self.zoom(0.1)
+            self.zoom(self._zoom * (self._zoom_step - 1))
 
         else:
-            self.zoom(-0.1)
+            self.zoom(self._zoom * (1 / self._zoom_step - 1))
 
         evt.accept()
 
@@ -64,6 +175,10 @@ class PatternArea(QGraphicsView):
             self._previous_pos = evt.pos()
             evt.accept()
 
+        elif evt.button() == Qt.LeftButton and self.scene().field.press(self.mapToScene(evt.pos())):
+            # The bead under the mouse is worked out from the position, the scene isn't searched.
+            evt.accept()
+
         else:
             super(PatternArea, self).mousePressEvent(evt)
             evt.ignore()
@@ -73,6 +188,10 @@ class PatternArea(QGraphicsView):
             self._panning = False
             evt.accept()
 
+        elif evt.button() == Qt.LeftButton and self.scene().field.stroking():
+            self.scene().field.release()
+            evt.accept()
+
         else:
             super(PatternArea, self).mouseReleaseEvent(evt)
             evt.ignore()
@@ -83,5 +202,12 @@ class PatternArea(QGraphicsView):
             self.translate(delta.x(), delta.y())
             self._previous_pos = evt.pos()
 
+        elif self.scene().field.stroking():
+            self.scene().field.drag(self.mapToScene(evt.pos()))
+
         else:
             super(PatternArea, self).mouseMoveEvent(evt)
+
+        self._hover_pos = evt.pos()
+        if not self._hover_timer.isActive():
+            self._hover_timer.start()
@@ -0,0 +1,142 @@
+"""
+This module turns images into peyote patterns. The image is sampled at the
+beads' positions (shifted tracks included), every bead is matched to the
+nearest bead type in CIELAB space and optionally Floyd-Steinberg dithered.
+Everything works on whole numpy arrays at once.
+"""
+from PyQt5.QtGui import *
+
+import numpy
+
+from design_model import Bead
+from util import *
+
+
+
+def image_to_array(image):
+    """Returns the image as a float (height, width, 3) array of RGB values in 0..1."""
+    image = image.convertToFormat(QImage.Format_RGB32)
+    bits = image.constBits()
+    bits.setsize(image.byteCount())
+    # Format_RGB32 is 0xffRRGGBB per pixel, so the bytes are B, G, R, A on little endian machines.
+    bgra = numpy.frombuffer(bits, dtype=numpy.uint8).reshape(image.height(), image.bytesPerLine() // 4, 4)
+    return bgra[:, 0:image.width(), 2::-1].astype(numpy.float32) / 255
+
+
+def colors_to_array(colors):
+    """Converts a list of colour strings (#rrggbb) into an (n, 3) array of RGB values in 0..1."""
+    return numpy.array([QColor(color).getRgbF()[0:3] for color in colors], dtype=numpy.float32).reshape(-1, 3)
+
+
+def rgb_to_lab(rgb):
+    """Converts sRGB values in 0..1 to CIELAB (D65), works on arrays of any shape (..., 3)."""
+    linear = numpy.where(rgb > 0.04045, ((rgb + 0.055) / 1.055) ** 2.4, rgb / 12.92)
+    xyz = linear @ numpy.array([[0.4124, 0.2126, 0.0193],
+                                [0.3576, 0.7152, 0.1192],
+                                [0.1805, 0.0722, 0.9505]], dtype=numpy.float32)
+    xyz /= numpy.array([0.95047, 1.0, 1.08883], dtype=numpy.float32)
+
+    f = numpy.where(xyz > 216 / 24389, numpy.cbrt(xyz), (24389 / 27 * xyz + 16) / 116)
+    return numpy.stack([116 * f[..., 1] - 16,
+                        500 * (f[..., 0] - f[..., 1]),
+                        200 * (f[..., 1] - f[..., 2])], axis=-1)
+
+
+
+class NearestColorIndex(object):
+    """Finds the nearest palette colour of many colours at once. Squared distances
+    are expanded as |c|^2 - 2 c.p + |p|^2 so the bulk of the work is one matrix product."""
+    def __init__(self, lab_palette, chunk=65536):
+        self.lab_palette = numpy.asarray(lab_palette, dtype=numpy.float32)
+        self._norms = (self.lab_palette ** 2).sum(axis=1)
+        self.chunk = chunk
+
+    def query(self, lab):
+        """Returns the palette index nearest to each colour of the (..., 3) array."""
+        flat = lab.reshape(-1, 3)
+        result = numpy.empty(flat.shape[0], dtype=numpy.intp)
+        for start in range(0, flat.shape[0], self.chunk):
+            part = flat[start:start + self.chunk]
+            distances = self._norms - 2 * (part @ self.lab_palette.T)
+            result[start:start + self.chunk] = distances.argmin(axis=1)
+
+        return result.reshape(lab.shape[:-1])
+
+
+
+def design_height(image_size, columns):
+    """The number of rows that keeps the image's aspect ratio for a design of columns beads."""
+    width, height = image_size
+    return max(1, round(height / width * columns * Bead.pitch[WIDTH] / Bead.pitch[HEIGHT]))
+
+
+def sample_beads(rgb, columns, rows, track_width):
+    """Averages the image over the area of every bead. Returns a (rows, columns, 3) array."""
+    image_height, image_width = rgb.shape[0:2]
+
+    # The design area in bead pixels, mapped over the whole image.
+    design_width = columns * Bead.pitch[WIDTH]
+    design_height = rows * Bead.pitch[HEIGHT] + Bead.dimension[HEIGHT] // 2
+    scale_x, scale_y = image_width / design_width, image_height / design_height
+
+    cols = numpy.arange(0, columns)
+    offsets = numpy.where(cols // track_width % 2, Bead.dimension[HEIGHT] // 2, 0)
+    left = cols * Bead.pitch[WIDTH] * scale_x
+    right = left + Bead.dimension[WIDTH] * scale_x
+    top = (numpy.arange(0, rows)[:, None] * Bead.pitch[HEIGHT] + offsets[None, :]) * scale_y
+    bottom = top + Bead.dimension[HEIGHT] * scale_y
+
+    # Each bead covers at least one pixel.
+    x0 = numpy.clip(numpy.floor(left), 0, image_width - 1).astype(numpy.intp)
+    x1 = numpy.clip(numpy.ceil(right), x0 + 1, image_width).astype(numpy.intp)
+    y0 = numpy.clip(numpy.floor(top), 0, image_height - 1).astype(numpy.intp)
+    y1 = numpy.clip(numpy.ceil(bottom), y0 + 1, image_height).astype(numpy.intp)
+    x0, x1 = numpy.broadcast_to(x0, y0.shape), numpy.broadcast_to(x1, y0.shape)
+
+    # Box averages from a summed area table.
+    table = numpy.zeros((image_height + 1, image_width + 1, 3), dtype=numpy.float64)
+    table[1:, 1:] = rgb.cumsum(axis=0).cumsum(axis=1)
+    sums = table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+    return (sums / ((y1 - y0) * (x1 - x0))[..., None]).astype(numpy.float32)
+
+
+def match_colors(lab, lab_palette, dither=False):
+    """Maps every cell of the (rows, columns, 3) lab array to the index of the nearest
+    palette colour, optionally spreading the error Floyd-Steinberg style."""
+    index = NearestColorIndex(lab_palette)
+    if not dither:
+        return index.query(lab)
+
+    rows, columns = lab.shape[0:2]
+    result = numpy.empty((rows, columns), dtype=numpy.intp)
+    # Padded by one column on each side and one row below.
+    error = numpy.zeros((rows + 1, columns + 2, 3), dtype=numpy.float32)
+
+    # A cell only receives error from cells on earlier anti-diagonals (col + 2 * row), so
+    # every diagonal can be processed as one vector operation.
+    for step in range(0, columns + 2 * (rows - 1)):
+        r = numpy.arange(max(0, (step - columns + 2) // 2), min(rows - 1, step // 2) + 1)
+        c = step - 2 * r
+
+        value = lab[r, c] + error[r, c + 1]
+        nearest = index.query(value)
+        result[r, c] = nearest
+
+        spread = value - index.lab_palette[nearest]
+        error[r, c + 2] += spread * (7 / 16)
+        error[r + 1, c] += spread * (3 / 16)
+        error[r + 1, c + 1] += spread * (5 / 16)
+        error[r + 1, c + 2] += spread * (1 / 16)
+
+    return result
+
+
+def image_to_cells(image, bead_types, tracks, track_width, dither=False):
+    """Converts a QImage to a (rows, columns) array of indices into bead_types."""
+    rgb = image_to_array(image)
+    columns = tracks * track_width
+    rows = design_height((rgb.shape[1], rgb.shape[0]), columns)
+
+    lab = rgb_to_lab(sample_beads(rgb, columns, rows, track_width))
+    lab_palette = rgb_to_lab(colors_to_array([bead_type.base_color for bead_type in bead_types]))
+    return match_colors(lab, lab_palette, dither)
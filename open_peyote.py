@@ -5,16 +5,24 @@ Peyote beading technique.
 Author: Huba Z. Nagy (12huba@gmail.com)
 Date: 10.11.2014
 """
+from profiling import StartupTimer, profiler
+
+startup = StartupTimer()
+
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 
-import json
-
 from design_widget import *
+from design_io import *
+from bom_widget import *
+from progress_widget import *
+from recovery import *
 from catalog_widget import *
-from wizards_and_dialogs import *
+from catalog_store import *
 from util import *
 
+startup.mark('imports')
+
 
 
 class MainWindow(QMainWindow):
@@ -22,7 +30,26 @@ class MainWindow(QMainWindow):
     def __init__(self):
         """Init function for the main application."""
         super(MainWindow, self).__init__(None)
-        self.default_bead = BeadType('blank', 'n/a', QBrush(QColor(230, 230, 228)), '#000000', '#000000', 10)
+        self.default_bead = blank_bead_type()
+        self.tile_memory_budget = QSettings().value('tile_memory_budget', DEFAULT_TILE_BUDGET, type=int)
+        self.history_budget = QSettings().value('history_budget', DEFAULT_HISTORY_BUDGET, type=int)
+
+        # Saving and autosaving happen on a worker thread.
+        self.writer = BackgroundWriter(self)
+        self.writer.finished.connect(self.design_saved)
+        self.autosave_timer = QTimer(self)
+        self.autosave_timer.timeout.connect(self.autosave)
+        self.autosave_timer.start(QSettings().value('autosave_interval', 60, type=int) * 1000)
+
+        # Opened files are decoded in parallel off the GUI thread.
+        self.loader = DesignLoader(self, self)
+        self.loader.loaded.connect(self.design_loaded)
+        self.loader.failed.connect(self.design_load_failed)
+
+        # Beads copied with Copy or Cut, the stamp tool pastes them.
+        self.clip = None
+        # The Symmetry the bead, clear and fill tools paint with, if any.
+        self.symmetry = None
 
         # Calls the functions to prepare each area of the main window
         self.create_central_widget()
@@ -62,7 +89,107 @@ class MainWindow(QMainWindow):
         # save_as_action.setShortcuts(QKeySequence.SaveAs)
         save_as_action.triggered.connect(self.save_as)
 
+        import_image_action = file_menu.addAction('Import Image')
+        import_image_action.triggered.connect(self.import_image)
+
+        export_chart_action = file_menu.addAction('Export Chart')
+        export_chart_action.triggered.connect(self.export_chart)
+
+        export_word_chart_action = file_menu.addAction('Export Word Chart')
+        export_word_chart_action.triggered.connect(self.export_word_chart)
+
         # the edit menu...
+        edit_menu = self.menuBar().addMenu('Edit')
+
+        undo_action = edit_menu.addAction('Undo')
+        undo_action.setShortcuts(QKeySequence.Undo)
+        undo_action.triggered.connect(self.undo)
+
+        redo_action = edit_menu.addAction('Redo')
+        redo_action.setShortcuts(QKeySequence.Redo)
+        redo_action.triggered.connect(self.redo)
+
+        edit_menu.addSeparator()
+
+        select_all_action = edit_menu.addAction('Select All')
+        select_all_action.setShortcuts(QKeySequence.SelectAll)
+        select_all_action.triggered.connect(self.select_all)
+
+        select_none_action = edit_menu.addAction('Select None')
+        select_none_action.triggered.connect(self.select_none)
+
+        copy_action = edit_menu.addAction('Copy')
+        copy_action.setShortcuts(QKeySequence.Copy)
+        copy_action.triggered.connect(self.copy)
+
+        cut_action = edit_menu.addAction('Cut')
+        cut_action.setShortcuts(QKeySequence.Cut)
+        cut_action.triggered.connect(self.cut)
+
+        paste_action = edit_menu.addAction('Paste')
+        paste_action.setShortcuts(QKeySequence.Paste)
+        paste_action.triggered.connect(self.paste)
+
+        delete_action = edit_menu.addAction('Clear Selection')
+        delete_action.setShortcuts(QKeySequence.Delete)
+        delete_action.triggered.connect(self.delete_selection)
+
+        mirror_h_action = edit_menu.addAction('Mirror Selection Left to Right')
+        mirror_h_action.triggered.connect(lambda: self.mirror_selection(True))
+
+        mirror_v_action = edit_menu.addAction('Mirror Selection Top to Bottom')
+        mirror_v_action.triggered.connect(lambda: self.mirror_selection(False))
+
+        flip_h_action = edit_menu.addAction('Flip Copied Beads Left to Right')
+        flip_h_action.triggered.connect(lambda: self.flip_clip(True))
+
+        flip_v_action = edit_menu.addAction('Flip Copied Beads Top to Bottom')
+        flip_v_action.triggered.connect(lambda: self.flip_clip(False))
+
+        repeat_action = edit_menu.addAction('Repeat Selection')
+        repeat_action.triggered.connect(self.repeat_selection)
+
+        edit_menu.addSeparator()
+
+        resize_action = edit_menu.addAction('Resize Design')
+        resize_action.triggered.connect(self.resize_design)
+
+        crop_action = edit_menu.addAction('Crop Design')
+        crop_action.triggered.connect(lambda: self.resize_design(crop=True))
+
+        # the tools menu...
+        tools_menu = self.menuBar().addMenu('Tools')
+
+        symmetry_menu = tools_menu.addMenu('Symmetry')
+        symmetry_group = QActionGroup(self)
+        symmetry_group.setExclusive(True)
+        for name, symmetry in (('None', None),
+                               ('Mirror Left to Right', Symmetry(horizontal=True)),
+                               ('Mirror Top to Bottom', Symmetry(vertical=True)),
+                               ('Mirror Both Ways', Symmetry(horizontal=True, vertical=True)),
+                               ('Rotate 2-fold', Symmetry(folds=2)),
+                               ('Rotate 3-fold', Symmetry(folds=3)),
+                               ('Rotate 4-fold', Symmetry(folds=4)),
+                               ('Rotate 6-fold', Symmetry(folds=6))):
+            action = symmetry_menu.addAction(name)
+            action.setCheckable(True)
+            action.setChecked(symmetry is None)
+            action.triggered.connect(lambda checked, symmetry=symmetry: self.set_symmetry(symmetry))
+            symmetry_group.addAction(action)
+
+        self.highlight_action = tools_menu.addAction('Highlight Row and Column')
+        self.highlight_action.setCheckable(True)
+        self.highlight_action.setChecked(QSettings().value('hover_highlight', False, type=bool))
+        self.highlight_action.toggled.connect(self.toggle_highlight)
+
+        self.profile_action = tools_menu.addAction('Record Performance')
+        self.profile_action.setCheckable(True)
+        self.profile_action.setChecked(profiler.enabled)
+        self.profile_action.toggled.connect(self.toggle_profiling)
+
+        save_trace_action = tools_menu.addAction('Save Performance Trace')
+        save_trace_action.triggered.connect(self.save_trace)
+
         # TODO: all the menus and etc
 
 
@@ -81,16 +208,44 @@ class MainWindow(QMainWindow):
         self.remove_tool_action.setCheckable(True)
         tool_group.addAction(self.remove_tool_action)
 
+        self.fill_tool_action = edit_tool_bar.addAction('Fill Tool')
+        self.fill_tool_action.setCheckable(True)
+        tool_group.addAction(self.fill_tool_action)
+
+        self.select_tool_action = edit_tool_bar.addAction('Select Tool')
+        self.select_tool_action.setCheckable(True)
+        tool_group.addAction(self.select_tool_action)
+
+        self.lasso_tool_action = edit_tool_bar.addAction('Lasso Tool')
+        self.lasso_tool_action.setCheckable(True)
+        tool_group.addAction(self.lasso_tool_action)
+
+        self.stamp_tool_action = edit_tool_bar.addAction('Stamp Tool')
+        self.stamp_tool_action.setCheckable(True)
+        tool_group.addAction(self.stamp_tool_action)
+
 
     def create_status_bar(self):
         """Prepares the status bar"""
         self.setStatusBar(QStatusBar(self))
         self.statusBar().showMessage('Test', 2000)
 
+        self.load_progress = LoadProgress()
+        self.statusBar().addPermanentWidget(self.load_progress)
+
+        # Frame times and paint counts while performance is being recorded.
+        self.profile_label = QLabel()
+        self.statusBar().addPermanentWidget(self.profile_label)
+        self._profile_counts = {}
+        self.profile_timer = QTimer(self)
+        self.profile_timer.timeout.connect(self.show_profile)
+        self.toggle_profiling(profiler.enabled)
+
 
     def create_docked_widgets(self):
         """Adds the docked widget."""
-        self.catalog = Catalog()
+        # The collections are read from the store once the window is up.
+        self.catalog = Catalog(store=CatalogStore(catalog_store_path()))
         self.working_bead = self.default_bead
 
         catalog_dock = QDockWidget()
@@ -100,45 +255,202 @@ class MainWindow(QMainWindow):
         self.addDockWidget(Qt.LeftDockWidgetArea, catalog_dock)
         self.catalog.currentItemChanged.connect(self.select_type)
 
+        self.bill_of_materials = BillOfMaterials()
+
+        bom_dock = QDockWidget()
+        bom_dock.setWidget(self.bill_of_materials)
+        bom_dock.setWindowTitle('Bill of Materials')
+        self.addDockWidget(Qt.RightDockWidgetArea, bom_dock)
+        self.mdi_widget.subWindowActivated.connect(self.design_activated)
+
 
     def new_design(self):
         """Slot for creating a new design. This function summons Gandalf who will help
         the user with creating their design."""
         # TODO: hmmm this generates a weird message, might need to look at that...
         # Also there are some performance problems...
+        # The wizards are only loaded once they're needed.
+        from wizards_and_dialogs import NewWizard
         wizard = NewWizard(self)
         wizard.exec_()
 
 
+    def import_image(self):
+        """Slot for creating a new design from an image."""
+        from wizards_and_dialogs import ImportImageWizard
+        wizard = ImportImageWizard(self)
+        wizard.exec_()
+
+
+    def set_symmetry(self, symmetry):
+        """Slot that picks the Symmetry edits are mirrored with, None for none."""
+        self.symmetry = symmetry
+
+
+    def toggle_highlight(self, enabled):
+        """Slot that turns highlighting the hovered row and column on or off."""
+        QSettings().setValue('hover_highlight', enabled)
+        for sub_window in self.mdi_widget.subWindowList():
+            sub_window.widget().set_highlight(enabled)
+
+
+    def toggle_profiling(self, enabled):
+        """Slot that starts or stops recording performance."""
+        if enabled and not profiler.enabled:
+            profiler.reset()
+
+        profiler.enabled = enabled
+        self._profile_counts = {}
+        self.profile_label.setVisible(enabled)
+        if enabled:
+            self.profile_timer.start(1000)
+
+        else:
+            self.profile_timer.stop()
+
+
+    def show_profile(self):
+        """Slot that shows the rolling frame time and the paints of the last second."""
+        average, longest, stats = profiler.summary()
+        counts = {name: count for name, (count, total) in stats.items()}
+        paints = [counts.get(name, 0) - self._profile_counts.get(name, 0)
+                  for name in ('PatternArea.frame', 'BeadField.paint', 'Grid.paint')]
+        self._profile_counts = counts
+
+        text = 'frames {}/s, bead paints {}/s, grid paints {}/s'.format(*paints)
+        if average is not None:
+            text = 'frame {:.1f} ms (max {:.1f} ms), {}'.format(average, longest, text)
+
+        self.profile_label.setText(text)
+
+
+    def save_trace(self):
+        """Slot that saves the recorded calls as a Chrome trace."""
+        (path, flt) = QFileDialog.getSaveFileName(self, 'Save Performance Trace', './trace.json',
+                                                  'Chrome Trace (*.json)')
+        if flt == '':
+            return
+
+        profiler.save_trace(path)
+        self.statusBar().showMessage('Saved {} calls to {}'.format(len(profiler.events), path), 2000)
+
+
     def open_design(self):
         """Slot that opens (a) design(s) in a new tab."""
         (paths, flt) = QFileDialog.getOpenFileNames(parent=self, caption='Open Design',
-                                                  filter='Peyote Design (*{})'.format(design_extension))
+                                                  filter='Peyote Design (*{} *{})'.format(design_extension,
+                                                                                          tiled_design_extension))
 
         if flt == '':
             # it means they clicked cancel...
             return
 
         for path in paths:
-            self._open_design(path)
+            self.load_progress.add(path)
+
+        self.loader.load(paths)
+
+
+    def design_loaded(self, path, design):
+        """Slot that opens a design in a new tab once its file is decoded."""
+        self.load_progress.finish(path)
+        self.add_design(design, path)
+
+        if design.missing_types:
+            QMessageBox.warning(self, 'Missing Bead Types',
+                                'The following bead types used by {} are not in the catalog, '
+                                'they are shown as blank beads:\n{}'.format(design.name,
+                                                                           ', '.join(design.missing_types)))
 
 
-    def _open_design(self, path):
-        with open(path, 'r') as file:
-            rdict = json.load(file)
-            info = rdict['__info__']
-            grid = rdict['__beads__']
+    def design_load_failed(self, path, error):
+        """Slot called when a design could not be opened."""
+        self.load_progress.finish(path, error)
+        QMessageBox.warning(self, 'Open Failed', 'Could not open {}:\n{}'.format(path, error))
 
-            design = DesignScene(self,
-                                 bgrid=grid,
-                                 name=info['__name__'],
-                                 track_width=info['__track_width__'],
-                                 tracks=info['__tracks__'],
-                                 height=info['__height__'])
 
-            area = PatternArea(design=design)
-            area.filepath = path
-            self.mdi_widget.addSubWindow(area)
+    def add_design(self, design, filepath=None):
+        """Opens a design in a new tab and starts its recovery journal."""
+        area = PatternArea(design=design)
+        area.filepath = filepath
+        area.set_highlight(self.highlight_action.isChecked())
+        sub_window = self.mdi_widget.addSubWindow(area)
+        area.show()
+
+        # Tiled designs are too big to journal, their file (and spilled tiles) are
+        # kept open until the tab is closed.
+        if isinstance(design.cells, TiledCells):
+            sub_window.destroyed.connect(design.cells.close)
+
+        else:
+            design.journal = RecoveryJournal(design, self.writer, recovery_directory(), filepath)
+            sub_window.destroyed.connect(design.journal.discard)
+            # Journaled rows only make sense at the size of the last checkpoint.
+            design.dimensions_changed.connect(design.journal.checkpoint)
+
+        return area
+
+
+    def _save(self, design, path):
+        self.statusBar().showMessage('Saving {}...'.format(path))
+        self.writer.save(design, path)
+
+        if hasattr(design, 'journal'):
+            # The saved file is the new starting point.
+            design.journal.filepath = path
+            design.journal.checkpoint()
+
+
+    def design_saved(self, path, error):
+        """Slot called when a background save is finished."""
+        if error:
+            QMessageBox.warning(self, 'Save Failed', 'Could not save {}:\n{}'.format(path, error))
+
+        else:
+            self.statusBar().showMessage('Saved {}'.format(path), 2000)
+
+
+    def autosave(self):
+        """Slot that appends the rows changed since the last autosave to the journals."""
+        for sub_window in self.mdi_widget.subWindowList():
+            design = sub_window.widget().scene()
+            if hasattr(design, 'journal'):
+                design.journal.autosave()
+
+
+    def recover_designs(self):
+        """Offers to bring back the designs of a session that crashed."""
+        journals = orphaned_journals(recovery_directory())
+        if not journals:
+            return
+
+        answer = QMessageBox.question(self, 'Recover Designs',
+                                      'OpenPeyote did not close properly last time. '
+                                      'Recover {} unsaved design(s)?'.format(len(journals)))
+
+        for path, lock in journals:
+            if answer == QMessageBox.Yes:
+                try:
+                    design, filepath = replay_journal(self, path)
+                    self.add_design(design, filepath)
+
+                except (IOError, OSError, ValueError, KeyError) as error:
+                    QMessageBox.warning(self, 'Recover Designs', 'Could not recover {}:\n{}'.format(path, error))
+                    continue
+
+            remove_journal(path, lock)
+
+
+    def closeEvent(self, evt):
+        """Waits for the saves in progress and removes the journals of a clean exit."""
+        for sub_window in self.mdi_widget.subWindowList():
+            design = sub_window.widget().scene()
+            if hasattr(design, 'journal'):
+                design.journal.discard()
+
+        self.writer.wait()
+        self.loader.shutdown()
+        super(MainWindow, self).closeEvent(evt)
 
 
     def save_design(self):
@@ -151,7 +463,7 @@ class MainWindow(QMainWindow):
             name_s = '_'.join(design.name.lower().split(' '))
             (path, flt) = QFileDialog.getSaveFileName(self, 'Save Design',
                                                './{}{}'.format(name_s, design_extension),
-                                               'Peyote Design (*{})'.format(design_extension))
+                                               design_save_filter)
 
             if flt == '':
                 # it means they clicked cancel...
@@ -162,8 +474,7 @@ class MainWindow(QMainWindow):
         else:
             path = self.mdi_widget.activeSubWindow().widget().filepath
 
-        with open(path, 'w') as file:
-            json.dump(design.to_dict(), file)
+        self._save(design, path)
 
 
     def save_as(self):
@@ -172,7 +483,7 @@ class MainWindow(QMainWindow):
         name_s = name_s = '_'.join(design.name.lower().split(' '))
         (path, flt) = QFileDialog.getSaveFileName(self, 'Save Design',
                                                   './{}{}'.format(name_s, design_extension),
-                                                  'Peyote Design (*{})'.format(design_extension))
+                                                  design_save_filter)
 
         if flt == '':
             # it means they clicked cancel...
@@ -180,8 +491,142 @@ class MainWindow(QMainWindow):
 
         self.mdi_widget.activeSubWindow().widget().filepath = path
 
-        with open(path, 'w') as file:
-            json.dump(design.to_dict(), file)
+        self._save(design, path)
+
+
+    def select_all(self):
+        if self.active_design():
+            self.active_design().select()
+
+
+    def select_none(self):
+        if self.active_design():
+            self.active_design().select_none()
+
+
+    def copy(self):
+        """Slot that copies the selected beads of the active design."""
+        design = self.active_design()
+        clip = design.copy_selection() if design else None
+        if clip is not None:
+            self.clip = clip
+            self.statusBar().showMessage('Copied {} beads'.format(len(clip)), 2000)
+
+
+    def cut(self):
+        """Slot that copies the selected beads then clears them."""
+        self.copy()
+        self.delete_selection()
+
+
+    def paste(self):
+        """Slot that picks the stamp tool, every click pastes the copied beads."""
+        if self.clip is not None:
+            self.stamp_tool_action.setChecked(True)
+
+
+    def delete_selection(self):
+        if self.active_design():
+            self.active_design().delete_selection()
+
+
+    def mirror_selection(self, horizontal):
+        if self.active_design():
+            self.active_design().mirror_selection(horizontal)
+
+
+    def flip_clip(self, horizontal):
+        if self.clip is not None:
+            self.clip = self.clip.flipped(horizontal)
+
+
+    def repeat_selection(self):
+        """Slot for stamping the selected beads again and again across the design."""
+        design = self.active_design()
+        if design is None or not design.selection:
+            return
+
+        from wizards_and_dialogs import RepeatDialog
+        RepeatDialog(design, self).exec_()
+
+
+    def resize_design(self, crop=False):
+        """Slot for changing the dimensions of the design in the active tab."""
+        design = self.active_design()
+        if design is None:
+            return
+
+        from wizards_and_dialogs import ResizeDialog
+        ResizeDialog(design, crop, self).exec_()
+
+
+    def export_chart(self):
+        """Slot for exporting the design in the active tab as a printable chart."""
+        design = self.active_design()
+        if design is None:
+            return
+
+        name_s = '_'.join(design.name.lower().split(' '))
+        (path, flt) = QFileDialog.getSaveFileName(self, 'Export Chart', './{}.pdf'.format(name_s),
+                                                  'PDF Chart (*.pdf);;PNG Pages (*.png)')
+        if flt == '':
+            return
+
+        from chart_export import export_chart
+        dialog = QProgressDialog('Exporting chart...', 'Cancel', 0, 0, self)
+        dialog.setWindowModality(Qt.WindowModal)
+        dialog.setMinimumDuration(500)
+
+        def progress(done, total):
+            dialog.setMaximum(total)
+            dialog.setValue(done)
+            return not dialog.wasCanceled()
+
+        done = export_chart(design, path, progress=progress)
+        dialog.close()
+        self.statusBar().showMessage('Exported {} chart pages to {}'.format(done, path), 2000)
+
+
+    def export_word_chart(self):
+        """Slot for writing the row by row reading instructions of the design in the active tab."""
+        design = self.active_design()
+        if design is None:
+            return
+
+        name_s = '_'.join(design.name.lower().split(' '))
+        (path, flt) = QFileDialog.getSaveFileName(self, 'Export Word Chart', './{}.txt'.format(name_s),
+                                                  'Text (*.txt);;HTML (*.html)')
+        if flt == '':
+            return
+
+        from word_chart import export_word_chart
+        export_word_chart(design, path)
+        self.statusBar().showMessage('Exported the word chart to {}'.format(path), 2000)
+
+
+    def active_design(self):
+        """Returns the design in the active tab or None."""
+        if not self.mdi_widget.activeSubWindow():
+            return None
+
+        return self.mdi_widget.activeSubWindow().widget().scene()
+
+
+    def design_activated(self, sub_window):
+        """Slot called when the active tab changes."""
+        self.bill_of_materials.set_design(self.active_design())
+
+
+    def undo(self):
+        """Slot for undoing the last edit of the active design."""
+        if self.active_design():
+            self.active_design().undo()
+
+
+    def redo(self):
+        """Slot for redoing the last undone edit of the active design."""
+        if self.active_design():
+            self.active_design().redo()
 
 
     def select_type(self, new_selection, prev_selection):
@@ -194,9 +639,35 @@ class MainWindow(QMainWindow):
 if __name__ == '__main__':
     import sys
 
+    # Prints how long each part of starting up took, then quits.
+    timing = '--startup-timing' in sys.argv
+
     app = QApplication(sys.argv)
+    app.setOrganizationName('OpenPeyote')
+    app.setApplicationName('OpenPeyote')
+    startup.mark('QApplication')
+
     mw = MainWindow()
+    startup.mark('MainWindow')
+
     mw.create()
     mw.showMaximized()
+    startup.mark('show')
+
+    def populate():
+        startup.mark('first event loop turn')
+        mw.catalog.restore_collections()
+        startup.mark('catalog')
+
+        if timing:
+            startup.report()
+            app.quit()
+
+        else:
+            # The catalog is needed to resolve the bead types of recovered designs.
+            mw.recover_designs()
+
+    # Everything that can wait is done once the window is up.
+    QTimer.singleShot(0, populate)
 
     sys.exit(app.exec_())
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Command line tool for processing designs without a display, it renders
+previews, validates designs against bead collections, converts between
+file formats and counts beads. Files are spread over a pool of processes.
+"""
+import argparse
+import concurrent.futures
+import math
+import multiprocessing
+import os
+import sys
+import time
+
+# Must be set before Qt is loaded so no display is needed.
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtCore import *
+from PyQt5.QtGui import *
+from PyQt5.QtWidgets import *
+
+from catalog_widget import *
+from design_io import *
+from word_chart import export_word_chart
+from util import *
+
+_context = None
+
+
+
+class BatchContext(object):
+    """Stands in for the MainWindow when designs are processed without a GUI."""
+    def __init__(self, collections):
+        self.default_bead = blank_bead_type()
+        self.catalog = Catalog()
+        self.tile_memory_budget = DEFAULT_TILE_BUDGET
+        # Nothing gets undone here.
+        self.history_budget = 0
+
+        for path in collections:
+            self.catalog.import_collection(path)
+
+
+
+def _init_worker(collections):
+    """Sets up Qt and the catalog once per process."""
+    global _context
+    if not QApplication.instance():
+        _init_worker.app = QApplication(['peyote_batch'])
+
+    _context = BatchContext(collections)
+
+
+def _output_path(directory, path, extension):
+    return os.path.join(directory, os.path.splitext(os.path.basename(path))[0] + extension)
+
+
+def render_preview(design, path, scale):
+    """Renders the whole design into a PNG file."""
+    source = design.itemsBoundingRect()
+    image = QImage(math.ceil(source.width() * scale), math.ceil(source.height() * scale), QImage.Format_ARGB32)
+    image.fill(QColor(190, 189, 184))
+
+    painter = QPainter(image)
+    design.render(painter, QRectF(image.rect()), source)
+    painter.end()
+
+    if not image.save(path, 'PNG'):
+        raise IOError('Could not write {}'.format(path))
+
+
+def bead_counts(design):
+    """Returns [(catalog number, name, count)] for the bead types used in the design."""
+    return [(design.palette[index].data(1, Qt.DisplayRole), design.palette[index].data(0, Qt.DisplayRole), count)
+            for index, count in enumerate(design.bead_counts().tolist()) if index and count]
+
+
+def process(path, options):
+    """Does everything asked for with one design, returns (ok, report lines, seconds)."""
+    start = time.perf_counter()
+    report, ok = [], True
+
+    try:
+        design = load_design(_context, path)
+
+        if options.validate:
+            if design.missing_types:
+                ok = False
+                report.append('missing bead types: {}'.format(', '.join(sorted(set(design.missing_types)))))
+
+            else:
+                report.append('valid')
+
+        if options.count:
+            for catalog_number, name, count in bead_counts(design):
+                report.append('{}\t{}\t{}'.format(catalog_number, name, count))
+
+        if options.render:
+            render_preview(design, _output_path(options.render, path, '.png'), options.scale)
+
+        if options.word_chart:
+            export_word_chart(design, _output_path(options.word_chart, path, '.txt'))
+
+        if options.convert:
+            if options.convert == 'tiled':
+                write_design(design, _output_path(options.output, path, tiled_design_extension))
+
+            else:
+                write_design(design, _output_path(options.output, path, design_extension), int(options.convert))
+
+        if isinstance(design.cells, TiledCells):
+            design.cells.close()
+
+    except Exception as error:
+        ok = False
+        report.append('error: {}'.format(error))
+
+    return ok, report, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Process OpenPeyote designs without a display.')
+    parser.add_argument('designs', nargs='+', help='design files (*{} or *{})'.format(design_extension,
+                                                                                   tiled_design_extension))
+    parser.add_argument('-c', '--collection', dest='collections', action='append', default=[],
+                        help='bead collection (*{}) to resolve bead types against, can be repeated'.format(collection_extension))
+    parser.add_argument('--render', metavar='DIR', help='write a PNG preview of every design into DIR')
+    parser.add_argument('--scale', type=float, default=0.25, help='scale of the PNG previews (default: 0.25)')
+    parser.add_argument('--word-chart', metavar='DIR', help='write the row by row reading instructions into DIR')
+    parser.add_argument('--validate', action='store_true', help='check that every bead type is in the collections')
+    parser.add_argument('--convert', choices=['1', '2', 'tiled'], help='convert the designs to this format version')
+    parser.add_argument('--output', metavar='DIR', help='where converted designs are written')
+    parser.add_argument('--count', action='store_true', help='print the number of beads of each type')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--timings', action='store_true', help='print how long each design took')
+    options = parser.parse_args(argv)
+
+    if options.convert and not options.output:
+        parser.error('--convert needs --output')
+
+    for directory in (options.render, options.word_chart, options.output):
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    start = time.perf_counter()
+    jobs = max(1, min(options.jobs or 1, len(options.designs)))
+
+    if jobs == 1:
+        _init_worker(options.collections)
+        results = (process(path, options) for path in options.designs)
+        executor = None
+
+    else:
+        # Spawned (rather than forked) workers each set up their own Qt.
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs,
+                                                          mp_context=multiprocessing.get_context('spawn'),
+                                                          initializer=_init_worker,
+                                                          initargs=(options.collections,))
+        results = executor.map(process, options.designs, [options] * len(options.designs))
+
+    failed = 0
+    # Results come back in the order the files were given, whatever order they finish in.
+    for path, (ok, report, seconds) in zip(options.designs, results):
+        failed += not ok
+        for line in report:
+            print('{}: {}'.format(path, line))
+
+        if options.timings:
+            print('{}: {:.3f} s'.format(path, seconds), file=sys.stderr)
+
+    if executor:
+        executor.shutdown()
+
+    if options.timings:
+        print('total: {:.3f} s for {} designs with {} jobs'.format(time.perf_counter() - start, len(options.designs), jobs),
+              file=sys.stderr)
+
+    return 1 if failed else 0
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the slow parts of the editor: building scenes, loading and
+saving designs, catalog lookups and imports, grid painting and rendering the
+view. It runs without a display. Results can be saved as a JSON baseline and
+later runs compared against it, the exit status is 1 if anything got slower
+(or bigger) than the baseline by more than the threshold.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Must be set before Qt is loaded so no display is needed.
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtCore import *
+from PyQt5.QtGui import *
+from PyQt5.QtWidgets import *
+
+import numpy
+
+from catalog_widget import *
+from design_io import *
+from design_widget import *
+from peyote_batch import BatchContext
+from util import *
+
+# (tracks, track width, height) of the synthetic designs.
+DESIGN_SIZES = {'small': (10, 5, 40),
+                'medium': (40, 5, 400),
+                'large': (100, 10, 1000)}
+CATALOG_SIZES = {'small': 100,
+                 'medium': 1000,
+                 'large': 10000}
+VIEW_SIZE = (1280, 800)
+LOOKUPS = 10000
+
+
+
+def synthetic_collection(size, seed=0):
+    """A collection dictionary (as stored in .peyc files) with size bead types."""
+    rng = numpy.random.default_rng(seed)
+    colors = rng.integers(0, 0x1000000, size=(size, 2)).tolist()
+    return {'__name__': 'Synthetic {}'.format(size),
+            '__bead_types__': [{'__name__': 'Bead {}'.format(number),
+                                '__catalog_number__': 'S-{:05d}'.format(number),
+                                '__base_color__': '#{:06x}'.format(base),
+                                '__highlight_color__': '#{:06x}'.format(highlight),
+                                '__texture__': number % 11}
+                               for number, (base, highlight) in enumerate(colors)]}
+
+
+def synthetic_cells(tracks, track_width, height, types, seed=0):
+    """Cells made of runs of random lengths, closer to a real design than noise."""
+    rng = numpy.random.default_rng(seed)
+    size = tracks * track_width * height
+    # Enough runs to cover the design even if they all come out one bead long.
+    lengths = rng.integers(1, 12, size=size)
+    values = rng.integers(0, types + 1, size=lengths.size)
+    return numpy.repeat(values, lengths)[0:size].reshape(height, tracks * track_width).astype(numpy.uint16)
+
+
+
+class Benchmark(object):
+    """Runs the cases and keeps their results, the best of several repeats for
+    the time and the peak of traced Python (and NumPy) allocations for memory."""
+    def __init__(self, repeat, only=None):
+        self.repeat, self.only = repeat, only
+        self.results = {}
+
+
+    def run(self, name, function, setup=None):
+        """Times function(setup()) repeat times, setup isn't timed."""
+        if self.only and self.only not in name:
+            return
+
+        times = []
+        for run in range(0, self.repeat):
+            argument = setup() if setup else None
+            start = time.perf_counter()
+            function(argument)
+            times.append(time.perf_counter() - start)
+
+        # Memory is measured on a separate run since tracing slows everything down.
+        argument = setup() if setup else None
+        tracemalloc.start()
+        function(argument)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        self.results[name] = {'seconds': min(times), 'median_seconds': statistics.median(times), 'peak_bytes': peak}
+        print('{:<40} {:>10.2f} ms {:>10.2f} ms {:>10.1f} KiB'.format(name, min(times) * 1000,
+                                                                        statistics.median(times) * 1000, peak / 1024))
+        sys.stdout.flush()
+
+
+
+def bench_catalog(bench, context, directory, size_name):
+    count = CATALOG_SIZES[size_name]
+    path = os.path.join(directory, 'catalog_{}{}'.format(count, collection_extension))
+    with open(path, 'w') as file:
+        json.dump(synthetic_collection(count), file)
+
+    def import_collection(catalog):
+        catalog.import_collection(path)
+
+    bench.run('import_collection[{}]'.format(size_name), import_collection, Catalog)
+
+    catalog = Catalog()
+    catalog.import_collection(path)
+    numbers = ['S-{:05d}'.format(number) for number in numpy.random.default_rng(1).integers(0, count, LOOKUPS)]
+
+    def find_types(ignored):
+        for number in numbers:
+            catalog.find_type(number)
+
+    bench.run('find_type[{}] x{}'.format(size_name, LOOKUPS), find_types)
+
+
+def bench_design(bench, context, bead_types, directory, size_name):
+    tracks, track_width, height = DESIGN_SIZES[size_name]
+    palette = [{'__catalog_number__': None}] + [bead_type.to_dict() for bead_type in bead_types]
+    cells = synthetic_cells(tracks, track_width, height, len(bead_types))
+
+    def new_scene(ignored):
+        return DesignScene(context, tracks=tracks, track_width=track_width, height=height)
+
+    bench.run('DesignScene[{}]'.format(size_name), new_scene)
+
+    design = new_scene(None)
+    design.load_cells(palette, cells)
+    v1 = design.to_dict(1)
+
+    def load_v1(ignored):
+        DesignScene(context, bgrid=v1['__beads__'], tracks=tracks, track_width=track_width, height=height)
+
+    bench.run('_load v1[{}]'.format(size_name), load_v1)
+
+    def loaded():
+        grown = new_scene(None)
+        grown.load_cells(palette, cells)
+        return grown
+
+    bench.run('resize +100 rows[{}]'.format(size_name),
+              lambda grown: grown.resize(height=grown.dimensions[HEIGHT] + 100), loaded)
+
+    # A motif of up to 50x50 beads stamped 200 times over the design.
+    motif = min(50, tracks * track_width, height)
+    design_for_stamp = loaded()
+    design_for_stamp.select_rect(0, 0, motif, motif)
+    clip = design_for_stamp.copy_selection()
+    origins = [(col, row) for row in range(0, height, motif) for col in range(0, tracks * track_width, motif)][:200]
+    bench.run('stamp {0}x{0} x{1}[{2}]'.format(motif, len(origins), size_name),
+              lambda stamped: stamped.stamp(clip, origins), loaded)
+
+    for version in (1, FORMAT_VERSION):
+        path = os.path.join(directory, 'design_{}_v{}{}'.format(size_name, version, design_extension))
+        write_design(design, path, version)
+
+        def save(ignored, version=version):
+            json.dump(design.to_dict(version), io.StringIO(), separators=(',', ':'))
+
+        def load(ignored, path=path):
+            load_design(context, path)
+
+        bench.run('to_dict+json.dump v{}[{}]'.format(version, size_name), save)
+        bench.run('load_design v{}[{}]'.format(version, size_name), load)
+
+    bench_painting(bench, design, size_name)
+
+
+def bench_painting(bench, design, size_name):
+    image = QImage(VIEW_SIZE[WIDTH], VIEW_SIZE[HEIGHT], QImage.Format_ARGB32_Premultiplied)
+    bounds = design.grid.boundingRect()
+
+    def grid_paint(exposed, zoom=1.0):
+        option = QStyleOptionGraphicsItem()
+        option.exposedRect = exposed
+        painter = QPainter(image)
+        painter.scale(zoom, zoom)
+        design.grid.paint(painter, option, None)
+        painter.end()
+
+    view_rect = QRectF(0, 0, VIEW_SIZE[WIDTH], VIEW_SIZE[HEIGHT])
+    bench.run('Grid.paint view[{}]'.format(size_name), grid_paint, lambda: view_rect)
+    bench.run('Grid.paint full[{}]'.format(size_name), grid_paint, lambda: bounds)
+    # Zoomed out the lines are thinned so the whole design costs about a view.
+    bench.run('Grid.paint full x{}[{}]'.format(PatternArea._minzoom, size_name),
+              lambda args: grid_paint(*args), lambda: (bounds, PatternArea._minzoom))
+
+    area = PatternArea(design=design)
+    area.resize(*VIEW_SIZE)
+
+    def zoomed(zoom):
+        area.resetTransform()
+        area.scale(zoom, zoom)
+        return zoom
+
+    # grab() goes through the viewport's paint event like the screen does,
+    # QGraphicsView.render() would expose every item in full.
+    for zoom in (PatternArea._minzoom, 0.3, 1.0):
+        bench.run('PatternArea.grab x{}[{}]'.format(zoom, size_name), lambda zoom: area.grab(), lambda zoom=zoom: zoomed(zoom))
+
+
+def compare(results, baseline, threshold, min_seconds):
+    """Returns the lines describing every result worse than the baseline."""
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+
+        before = baseline[name]
+        if result['seconds'] > before['seconds'] * (1 + threshold) and \
+                result['seconds'] - before['seconds'] > min_seconds:
+            regressions.append('{}: {:.2f} ms, was {:.2f} ms'.format(name, result['seconds'] * 1000,
+                                                                    before['seconds'] * 1000))
+
+        if result['peak_bytes'] > before['peak_bytes'] * (1 + threshold) and \
+                result['peak_bytes'] - before['peak_bytes'] > 64 * 1024:
+            regressions.append('{}: peak {:.1f} KiB, was {:.1f} KiB'.format(name, result['peak_bytes'] / 1024,
+                                                                           before['peak_bytes'] / 1024))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark OpenPeyote without a display.')
+    parser.add_argument('--sizes', default='small,medium,large',
+                        help='design and catalog sizes to run, any of {} (default: all)'.format(','.join(DESIGN_SIZES)))
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs of every case, the best counts (default: 5)')
+    parser.add_argument('-k', '--filter', dest='only', help='only run the cases whose name contains this')
+    parser.add_argument('--save', metavar='FILE', help='write the results to FILE as a JSON baseline')
+    parser.add_argument('--compare', metavar='FILE', help='fail if a result is worse than the baseline in FILE')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='how much worse than the baseline counts as a regression (default: 0.25)')
+    parser.add_argument('--min-seconds', type=float, default=0.001,
+                        help='differences smaller than this are never regressions (default: 0.001)')
+    options = parser.parse_args(argv)
+
+    sizes = [size for size in options.sizes.split(',') if size]
+    for size in sizes:
+        if size not in DESIGN_SIZES:
+            parser.error('unknown size: {}'.format(size))
+
+    app = QApplication.instance() or QApplication(['peyote_bench'])
+    bench = Benchmark(max(1, options.repeat), options.only)
+
+    with tempfile.TemporaryDirectory() as directory:
+        context = BatchContext([])
+        path = os.path.join(directory, 'palette{}'.format(collection_extension))
+        with open(path, 'w') as file:
+            json.dump(synthetic_collection(64), file)
+
+        context.catalog.import_collection(path)
+        bead_types = context.catalog.topLevelItem(0).bead_types
+
+        print('{:<40} {:>13} {:>13} {:>14}'.format('case', 'best', 'median', 'peak'))
+        for size in sizes:
+            bench_catalog(bench, context, directory, size)
+
+        for size in sizes:
+            bench_design(bench, context, bead_types, directory, size)
+
+    if options.save:
+        with open(options.save, 'w') as file:
+            json.dump({'python': platform.python_version(),
+                       'machine': platform.machine(),
+                       'qt': QT_VERSION_STR,
+                       'results': bench.results}, file, indent=1, sort_keys=True)
+
+    if options.compare:
+        with open(options.compare, 'r') as file:
+            baseline = json.load(file)['results']
+
+        regressions = compare(bench.results, baseline, options.threshold, options.min_seconds)
+        for line in regressions:
+            print('regression: {}'.format(line), file=sys.stderr)
+
+        if regressions:
+            return 1
+
+    return 0
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
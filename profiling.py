@@ -0,0 +1,127 @@
+"""
+This module houses the opt-in instrumentation of the editor's hot paths.
+Functions decorated with instrumented() are counted and timed while the profiler
+is enabled (OPENPEYOTE_PROFILE=1 or Tools > Record Performance), and every call
+is kept as a trace event which can be saved in the Chrome trace format and
+opened in chrome://tracing or Perfetto.
+"""
+from collections import deque
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+
+
+class Profiler(object):
+    """Collects call counts, times, frame times and trace events. Doing nothing
+    costs one attribute check per call while it's disabled."""
+    max_events = 500000
+    max_frames = 120
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self.reset()
+
+
+    def reset(self):
+        with self._lock:
+            self.stats = {}
+            self.events = deque(maxlen=self.max_events)
+            self.frames = deque(maxlen=self.max_frames)
+
+
+    def record(self, name, start, end):
+        """Adds one finished call, start and end are perf_counter() values."""
+        with self._lock:
+            count, total = self.stats.get(name, (0, 0.0))
+            self.stats[name] = (count + 1, total + end - start)
+            self.events.append((name, start, end, threading.get_ident()))
+
+
+    def frame(self, name, start, end):
+        """Records a call and keeps its duration as a frame time."""
+        self.record(name, start, end)
+        self.frames.append(end - start)
+
+
+    def summary(self):
+        """(average frame ms, longest frame ms, {name: (count, total ms)}), None for the
+        frame times if no frame was painted yet."""
+        with self._lock:
+            frames = list(self.frames)
+            stats = {name: (count, total * 1000) for name, (count, total) in self.stats.items()}
+
+        if not frames:
+            return None, None, stats
+
+        return sum(frames) / len(frames) * 1000, max(frames) * 1000, stats
+
+
+    def save_trace(self, path):
+        """Writes the trace events in the Chrome trace event format."""
+        with self._lock:
+            events = list(self.events)
+
+        pid = os.getpid()
+        trace = [{'name': name, 'ph': 'X', 'pid': pid, 'tid': tid,
+                  'ts': (start - self._origin) * 1e6, 'dur': (end - start) * 1e6}
+                 for name, start, end, tid in events]
+
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, file)
+
+
+class StartupTimer(object):
+    """Splits the time taken to start up into named phases."""
+    def __init__(self):
+        self.phases = []
+        self._last = time.perf_counter()
+
+
+    def mark(self, phase):
+        """Ends the current phase, it's named after what was done in it."""
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+
+    def report(self, file=sys.stderr):
+        for phase, seconds in self.phases:
+            print('{:<24} {:>8.1f} ms'.format(phase, seconds * 1000), file=file)
+
+        print('{:<24} {:>8.1f} ms'.format('total', sum(seconds for phase, seconds in self.phases) * 1000), file=file)
+
+
+
+profiler = Profiler(enabled=os.environ.get('OPENPEYOTE_PROFILE', '') not in ('', '0'))
+
+
+
+def instrumented(name, frame=False):
+    """Decorator that counts and times calls while the profiler is enabled. With
+    frame set the calls are frame times too (the view's paint event)."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+
+            finally:
+                if frame:
+                    profiler.frame(name, start, time.perf_counter())
+
+                else:
+                    profiler.record(name, start, time.perf_counter())
+
+        return wrapper
+
+    return decorator
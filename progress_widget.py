@@ -0,0 +1,101 @@
+"""
+This module houses the small status bar panel that shows the files being opened.
+"""
+from PyQt5.QtCore import *
+from PyQt5.QtGui import *
+from PyQt5.QtWidgets import *
+
+import os
+
+
+
+class LoadProgress(QWidget):
+    """One row per file being opened, with a busy bar until the file is ready.
+    A file opened again while it's loading shares its row, which finishes with the
+    last load. Finished rows linger for a moment and the panel hides once they're
+    all gone."""
+    linger = 1500
+
+    def __init__(self, parent=None):
+        super(LoadProgress, self).__init__(parent)
+        self._rows = {}
+        # Loads of each path that haven't finished yet.
+        self._pending = {}
+
+        self._layout = QVBoxLayout()
+        self._layout.setContentsMargins(0, 0, 0, 0)
+        self._layout.setSpacing(1)
+        self.setLayout(self._layout)
+        self.hide()
+
+
+    def add(self, path):
+        """Adds a row for a file that is starting to load."""
+        self._pending[path] = self._pending.get(path, 0) + 1
+        if path in self._rows:
+            if self._pending[path] == 1:
+                # Opened again before its finished row went away, the row is reused.
+                row, label, bar, timer = self._rows[path]
+                timer.stop()
+                label.setText(os.path.basename(path))
+                label.setToolTip(path)
+                bar.setRange(0, 0)
+
+            return
+
+        label = QLabel(os.path.basename(path))
+        label.setToolTip(path)
+        bar = QProgressBar()
+        bar.setRange(0, 0)
+        bar.setMaximumHeight(12)
+        bar.setTextVisible(False)
+
+        row = QWidget()
+        row_layout = QHBoxLayout()
+        row_layout.setContentsMargins(0, 0, 0, 0)
+        row_layout.addWidget(label)
+        row_layout.addWidget(bar)
+        row.setLayout(row_layout)
+
+        # One timer per row, so finishing a file again only ever leaves one removal pending.
+        timer = QTimer(row)
+        timer.setSingleShot(True)
+        timer.setInterval(self.linger)
+        timer.timeout.connect(lambda: self._remove(path))
+
+        self._rows[path] = (row, label, bar, timer)
+        self._layout.addWidget(row)
+        self.show()
+
+
+    def finish(self, path, error=''):
+        """Marks a file as opened, or failed if there's an error."""
+        if path not in self._pending:
+            return
+
+        row, label, bar, timer = self._rows[path]
+        if error:
+            label.setText('{} (failed)'.format(os.path.basename(path)))
+            label.setToolTip(error)
+
+        self._pending[path] -= 1
+        if self._pending[path]:
+            return
+
+        del self._pending[path]
+        bar.setRange(0, 1)
+        bar.setValue(1)
+        timer.start()
+
+
+    def _remove(self, path):
+        entry = self._rows.pop(path, None)
+        if entry is None:
+            return
+
+        row = entry[0]
+        self._layout.removeWidget(row)
+        row.deleteLater()
+
+        if not self._rows:
+            self.hide()
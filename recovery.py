@@ -0,0 +1,158 @@
+"""
+This module keeps a crash recovery journal for every open design.
+A journal is an append-only file of JSON lines. The first line is a checkpoint
+holding the whole design (a version 2 dictionary with the full palette) and the
+path it was saved to, every line after that holds only the rows that changed
+since the line before, plus the palette entries added in the meantime.
+Journals are deleted when their design is closed normally, so the ones found at
+startup belong to a session that crashed.
+"""
+from PyQt5.QtCore import *
+
+import json
+import os
+import uuid
+
+import numpy
+
+from design_format import *
+from design_io import write_atomic
+from design_model import DesignScene
+from util import *
+
+
+
+def recovery_directory():
+    """The directory journals live in, it is created if needed."""
+    directory = os.path.join(QStandardPaths.writableLocation(QStandardPaths.AppDataLocation), 'recovery')
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def orphaned_journals(directory):
+    """Returns [(journal path, lock)] for the journals no running instance holds.
+    The locks stay taken until the journal is replayed or removed."""
+    journals = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.journal'):
+            path = os.path.join(directory, name)
+            lock = QLockFile(path + '.lock')
+            # Locks left behind by dead processes count as stale and get taken over.
+            if lock.tryLock(0):
+                journals.append((path, lock))
+
+    return journals
+
+
+def remove_journal(path, lock):
+    if os.path.exists(path):
+        os.remove(path)
+
+    lock.unlock()
+
+
+def replay_journal(main_window, path):
+    """Rebuilds the design stored in a journal, returns (design, saved path)."""
+    with open(path, 'r') as file:
+        checkpoint = json.loads(file.readline())
+        rdict = checkpoint['__design__']
+        info = rdict['__info__']
+
+        design = DesignScene(main_window,
+                             name=info['__name__'],
+                             track_width=info['__track_width__'],
+                             tracks=info['__tracks__'],
+                             height=info['__height__'])
+        design.load_dict(rdict)
+
+        # The journal's palette indices mapped to the new design's.
+        lut = [0] + [design._resolve_type(entry['__catalog_number__']) for entry in rdict['__palette__'][1:]]
+        width = design.dimensions[WIDTH]
+
+        for line in file:
+            try:
+                record = json.loads(line)
+
+            except ValueError:
+                # The last line may have been cut short by the crash.
+                break
+
+            lut += [design._resolve_type(entry['__catalog_number__']) for entry in record['__palette_add__']]
+            lut_array = numpy.array(lut, dtype=design.cells.dtype)
+            for row, runs in record['__rows__']:
+                design.cells[row] = lut_array[decode_rows([runs], width)[0]]
+
+    design._recount()
+    design.field.discard_lod()
+    design.field.update()
+    return design, checkpoint['__path__']
+
+
+
+class RecoveryJournal(object):
+    """The journal of one design. Writing happens on the BackgroundWriter's worker
+    thread, the GUI thread only copies the rows that changed."""
+    max_records = 200
+
+    def __init__(self, design, writer, directory, filepath=None):
+        self.design, self.filepath = design, filepath
+        self.path = os.path.join(directory, '{}.journal'.format(uuid.uuid4().hex))
+        self._writer = writer
+        self._lock = QLockFile(self.path + '.lock')
+        self._lock.tryLock(0)
+        self._palette_size, self._records = 0, 0
+        self._discarded = False
+
+        self.checkpoint()
+
+
+    def checkpoint(self):
+        """Starts the journal over with the whole design."""
+        info, palette, cells = self.design.snapshot()
+        self.design.dirty_rows.clear()
+        self._palette_size, self._records = len(palette), 0
+        self._writer.submit(self._write_checkpoint, self.filepath, info, palette, cells)
+
+
+    def autosave(self):
+        """Appends the rows changed since the last call, or checkpoints once the
+        journal has grown long."""
+        if self._discarded or not self.design.dirty_rows:
+            return
+
+        if self._records >= self.max_records:
+            self.checkpoint()
+            return
+
+        rows = sorted(self.design.dirty_rows)
+        self.design.dirty_rows.clear()
+        block = self.design.cells[rows]
+
+        palette = self.design.palette_entries()
+        added, self._palette_size = palette[self._palette_size:], len(palette)
+        self._records += 1
+        self._writer.submit(self._append, rows, block, added)
+
+
+    def discard(self):
+        """Removes the journal once everything queued before is written."""
+        if self._discarded:
+            return
+
+        self._discarded = True
+        self._writer.submit(remove_journal, self.path, self._lock)
+
+
+    def _write_checkpoint(self, filepath, info, palette, cells):
+        line = json.dumps({'__path__': filepath,
+                           '__design__': build_dict(info, palette, cells, compact=False)}, separators=(',', ':'))
+        write_atomic(self.path, line + '\n')
+
+
+    def _append(self, rows, block, added):
+        line = json.dumps({'__palette_add__': added,
+                           '__rows__': list(zip(rows, encode_rows(block)))}, separators=(',', ':'))
+        with open(self.path, 'a') as file:
+            file.write(line + '\n')
+            file.flush()
+            os.fsync(file.fileno())
@@ -0,0 +1,24 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from peyote_batch import BatchContext, _init_worker
+
+
+@pytest.fixture
+def context(tmp_path):
+    """A headless stand-in for the MainWindow with one collection of two bead types."""
+    path = str(tmp_path / 'test.peyc')
+    with open(path, 'w') as file:
+        json.dump({'__name__': 'test',
+                   '__bead_types__': [{'__name__': 'Red', '__catalog_number__': 'R-1', '__base_color__': '#cc2020',
+                                       '__highlight_color__': '#ff8080', '__texture__': 0},
+                                      {'__name__': 'Blue', '__catalog_number__': 'B-1', '__base_color__': '#2020cc',
+                                       '__highlight_color__': '#8080ff', '__texture__': 1}]}, file)
+
+    _init_worker([])
+    return BatchContext([path])
@@ -0,0 +1,59 @@
+import pytest
+
+from PyQt5.QtCore import Qt
+
+from catalog_store import CatalogStore
+from catalog_widget import Catalog, Collection
+
+
+@pytest.fixture
+def store(context, tmp_path):
+    """A store holding the test collection, context makes sure there's a QApplication."""
+    store = CatalogStore(str(tmp_path / 'catalog.sqlite'))
+    catalog = Catalog(store=store)
+    catalog.import_collection(str(tmp_path / 'test.peyc'))
+    yield store
+    store.close()
+
+
+def _restored(store):
+    catalog = Catalog(store=store)
+    catalog.restore_collections()
+    return catalog
+
+
+def test_edited_bead_type_is_stored(store):
+    catalog = _restored(store)
+    blue = catalog.find_type('B-1')
+    blue.setData(0, Qt.DisplayRole, 'Navy')
+    blue.setData(1, Qt.DisplayRole, 'N-1')
+
+    collection_id = catalog.topLevelItem(0).store_id
+    assert [bead_type['__name__'] for bead_type in store.bead_types(collection_id)] == ['Red', 'Navy']
+    assert store.find('__catalog_number__', 'N-1') == collection_id
+    assert store.find('__catalog_number__', 'B-1') is None
+
+    restored = _restored(store)
+    assert restored.find_type('N-1').data(0, Qt.DisplayRole) == 'Navy'
+    assert restored.find_type('B-1') is None
+
+
+def test_store_asked_once_per_value(store, monkeypatch):
+    catalog = _restored(store)
+    # A second collection that stays unloaded, so the store could always be asked.
+    catalog.add_collection(Collection('other', store_id=store.add_collection('other')))
+
+    asked = []
+    find = store.find
+    monkeypatch.setattr(store, 'find', lambda key, value: asked.append(value) or find(key, value))
+
+    for repeat in range(0, 3):
+        assert catalog.find_type('R-1').data(0, Qt.DisplayRole) == 'Red'
+        assert catalog.find_type('X-1') is None
+
+    assert asked == ['R-1', 'X-1']
+
+    # A newly restored collection may hold the missing type, so it's asked again.
+    catalog.add_collection(Collection('more', store_id=store.add_collection('more')))
+    catalog.find_type('X-1')
+    assert asked == ['R-1', 'X-1', 'X-1']
@@ -0,0 +1,117 @@
+import json
+
+import numpy
+import pytest
+
+from design_format import beads_to_cells, build_dict, compact_palette, decode_rows, encode_rows
+from design_io import load_design, read_design
+
+
+def test_rows_round_trip():
+    cells = numpy.array([[0, 0, 1, 1],
+                         [1, 2, 2, 2],
+                         [2, 2, 2, 2],
+                         [0, 1, 0, 1]], dtype=numpy.uint16)
+    rows = encode_rows(cells)
+
+    # A run that carries on into the next row is split at the row boundary.
+    assert rows == [[2, 0, 2, 1], [1, 1, 3, 2], [4, 2], [1, 0, 1, 1, 1, 0, 1, 1]]
+    assert (decode_rows(rows, 4) == cells).all()
+
+
+def test_rows_round_trip_one_column():
+    cells = numpy.array([[3], [3], [0], [3]], dtype=numpy.uint16)
+    rows = encode_rows(cells)
+
+    assert rows == [[1, 3], [1, 3], [1, 0], [1, 3]]
+    assert (decode_rows(rows, 1) == cells).all()
+
+
+def test_rows_round_trip_empty_design():
+    for shape in ((0, 5), (3, 0)):
+        rows = encode_rows(numpy.zeros(shape, dtype=numpy.uint16))
+        assert len(rows) == shape[0]
+        assert decode_rows(rows, shape[1]).shape == shape
+
+
+def test_rows_that_do_not_fill_the_design_are_rejected():
+    with pytest.raises(ValueError):
+        decode_rows([[3, 1], [5, 1]], 4)
+
+    with pytest.raises(ValueError):
+        decode_rows([[-1, 1, 5, 1]], 4)
+
+
+def test_v1_beads_convert_to_a_palette_and_cells():
+    beads = [{'__bead_type__': 'R-1', '__x__': 2, '__y__': 0},
+             {'__bead_type__': 'n/a', '__x__': 0, '__y__': 1},
+             {'__bead_type__': 'B-1', '__x__': 1, '__y__': 1},
+             {'__bead_type__': 'R-1', '__x__': 0, '__y__': 2}]
+    palette, cells = beads_to_cells(beads, 3, 3)
+
+    assert [entry['__catalog_number__'] for entry in palette] == ['n/a', 'R-1', 'B-1']
+    assert cells.tolist() == [[0, 0, 1], [0, 2, 0], [1, 0, 0]]
+
+
+def test_compact_palette_keeps_the_blank_bead_and_the_used_types():
+    cells = numpy.array([[4, 4], [2, 4]], dtype=numpy.uint16)
+    used, compacted = compact_palette(cells, 6)
+
+    assert used == [0, 2, 4]
+    assert compacted.tolist() == [[2, 2], [1, 2]]
+
+    palette = [{'__catalog_number__': str(index)} for index in range(0, 6)]
+    rdict = build_dict({'__name__': 'x'}, palette, cells)
+    assert [entry['__catalog_number__'] for entry in rdict['__palette__']] == ['0', '2', '4']
+    assert (decode_rows(rdict['__rows__'], 2) == compacted).all()
+
+
+def _baseline_v1(path):
+    """Writes a design the way the baseline to_dict did: every cell is listed,
+    the blank ones with the blank bead's catalog number."""
+    beads = [{'__bead_type__': 'n/a', '__x__': col, '__y__': row} for row in range(0, 3) for col in range(0, 4)]
+    beads[1]['__bead_type__'] = 'R-1'
+    beads[6]['__bead_type__'] = 'B-1'
+    with open(path, 'w') as file:
+        json.dump({'__info__': {'__name__': 'old', '__track_width__': 2, '__tracks__': 2, '__height__': 3},
+                   '__beads__': beads}, file)
+
+
+def test_baseline_v1_blank_beads_are_not_missing(context, tmp_path):
+    path = str(tmp_path / 'old.peyd')
+    _baseline_v1(path)
+
+    design = load_design(context, path)
+    assert design.missing_types == []
+    assert design.bead_type_at((1, 0)).data(1, 0) == 'R-1'
+    assert design.bead_type_at((2, 1)).data(1, 0) == 'B-1'
+    assert design.bead_counts()[0] == 10
+
+    rdict = read_design(path)
+    assert [entry['__catalog_number__'] for entry in rdict['__palette__']] == ['n/a', 'R-1', 'B-1']
+    assert numpy.count_nonzero(rdict['__cells__']) == 2
+
+
+def test_unknown_types_are_still_missing(context, tmp_path):
+    path = str(tmp_path / 'old.peyd')
+    _baseline_v1(path)
+    with open(path) as file:
+        rdict = json.load(file)
+
+    rdict['__beads__'][3]['__bead_type__'] = 'X-9'
+    with open(path, 'w') as file:
+        json.dump(rdict, file)
+
+    assert load_design(context, path).missing_types == ['X-9']
+
+
+def test_cells_past_the_palette_are_rejected(context, tmp_path):
+    path = str(tmp_path / 'corrupt.peyd')
+    with open(path, 'w') as file:
+        json.dump({'__version__': 2,
+                   '__info__': {'__name__': 'corrupt', '__track_width__': 2, '__tracks__': 1, '__height__': 1},
+                   '__palette__': [{'__catalog_number__': 'n/a'}],
+                   '__rows__': [[2, 5]]}, file)
+
+    with pytest.raises(ValueError):
+        load_design(context, path)
@@ -0,0 +1,83 @@
+import numpy
+
+from design_history import DesignHistory
+
+
+def _record(history, rows, cols, old, new):
+    history.record(numpy.array(rows), numpy.array(cols),
+                   numpy.array(old, dtype=numpy.uint16), numpy.array(new, dtype=numpy.uint16))
+
+
+def _cells(change):
+    rows, cols, values = change
+    return sorted(zip(rows.tolist(), cols.tolist(), values.tolist()))
+
+
+def test_undo_and_redo():
+    history = DesignHistory(10)
+    _record(history, [0, 2], [3, 9], [0, 1], [4, 4])
+    _record(history, [5], [5], [0], [2])
+
+    assert _cells(history.undo()) == [(5, 5, 0)]
+    assert _cells(history.undo()) == [(0, 3, 0), (2, 9, 1)]
+    assert history.undo() is None and history.can_redo()
+
+    assert _cells(history.redo()) == [(0, 3, 4), (2, 9, 4)]
+    assert _cells(history.redo()) == [(5, 5, 2)]
+    assert history.redo() is None
+
+
+def test_recording_drops_the_redo_stack():
+    history = DesignHistory(10)
+    _record(history, [0], [0], [0], [1])
+    history.undo()
+    _record(history, [1], [1], [0], [2])
+
+    assert not history.can_redo()
+    assert _cells(history.undo()) == [(1, 1, 0)]
+    assert not history.can_undo()
+
+
+def test_a_group_is_merged_into_one_entry():
+    history = DesignHistory(10)
+    history.begin_group()
+    _record(history, [0, 0], [0, 1], [0, 0], [1, 3])
+    # The same cells again: (0, 0) ends up 2, (0, 1) goes back to what it was.
+    _record(history, [0, 0], [0, 1], [1, 3], [2, 0])
+    _record(history, [4], [4], [0], [1])
+    history.end_group()
+
+    assert _cells(history.undo()) == [(0, 0, 0), (4, 4, 0)]
+    assert not history.can_undo()
+    assert _cells(history.redo()) == [(0, 0, 2), (4, 4, 1)]
+
+
+def test_a_group_without_changes_leaves_no_entry():
+    history = DesignHistory(10)
+    history.begin_group()
+    history.end_group()
+    history.begin_group()
+    _record(history, [3], [3], [0], [1])
+    _record(history, [3], [3], [1], [0])
+    history.end_group()
+
+    assert not history.can_undo()
+
+
+def test_the_oldest_entries_go_over_the_budget():
+    # A one cell entry is a 4 byte index and two 2 byte values.
+    history = DesignHistory(10, budget=3 * 8)
+    for col in range(0, 5):
+        _record(history, [0], [col], [0], [1])
+
+    assert [_cells(history.undo())[0][1] for entry in range(0, 3)] == [4, 3, 2]
+    assert not history.can_undo()
+
+
+def test_the_latest_entry_is_kept_even_over_the_budget():
+    history = DesignHistory(10, budget=8)
+    _record(history, [0], [0], [0], [1])
+    _record(history, [1] * 5, list(range(0, 5)), [0] * 5, [1] * 5)
+
+    assert len(_cells(history.undo())) == 5
+    assert not history.can_undo()
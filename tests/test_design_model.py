@@ -0,0 +1,179 @@
+import numpy
+import pytest
+
+from design_model import DesignScene, Symmetry
+
+
+def _types(context):
+    return context.catalog.find_type('R-1'), context.catalog.find_type('B-1')
+
+
+def _walled(context, open_cells):
+    """A design of red beads with blank holes at the (row, col) in open_cells.
+    Tracks are two beads wide, the odd ones are shifted down half a bead."""
+    red, blue = _types(context)
+    design = DesignScene(context, track_width=2, tracks=3, height=4)
+    rows, cols = numpy.nonzero(numpy.ones(design.cells.shape, dtype=bool))
+    design.set_cells(rows, cols, design.palette_index(red))
+    rows, cols = zip(*open_cells)
+    design.set_cells(rows, cols, 0)
+    return design
+
+
+def _filled(design):
+    return sorted(zip(*[axis.tolist() for axis in numpy.nonzero(design.cells == 2)]))
+
+
+def test_fill_from_a_straight_track_reaches_the_two_beads_it_sits_between(context):
+    # (1, 1) is on the straight track 0, it sits between (0, 2) and (1, 2) of the shifted track 1.
+    design = _walled(context, [(1, 1), (0, 2), (2, 2)])
+    design.flood_fill((1, 1), _types(context)[1])
+    assert _filled(design) == [(0, 2), (1, 1)]
+
+
+def test_fill_from_a_shifted_track_reaches_the_two_beads_it_sits_between(context):
+    # Row 1 of the shifted track 1 sits between (1, 1) and (2, 1) of track 0 and
+    # between (1, 4) and (2, 4) of track 2.
+    design = _walled(context, [(1, 2), (1, 3), (0, 1), (2, 1), (0, 4), (2, 4)])
+    design.flood_fill((1, 2), _types(context)[1])
+    assert _filled(design) == [(1, 2), (1, 3), (2, 1), (2, 4)]
+
+
+def test_fill_follows_a_track_and_undoes_as_one_step(context):
+    design = _walled(context, [(0, 0), (1, 0), (2, 0), (3, 0), (3, 1)])
+    before = design.cells.copy()
+    design.flood_fill((0, 0), _types(context)[1])
+    assert _filled(design) == [(0, 0), (1, 0), (2, 0), (3, 0), (3, 1)]
+    assert design.bead_counts()[2] == 5
+
+    design.undo()
+    assert (design.cells == before).all()
+    assert design.bead_counts()[2] == 0
+
+
+def test_fill_with_the_same_bead_does_nothing(context):
+    design = _walled(context, [(0, 0)])
+    before = design.cells.copy()
+    design.flood_fill((1, 1), _types(context)[0])
+    assert (design.cells == before).all()
+
+
+def _numbered(context, tracks=3, height=4):
+    """A design with a bead on every cell, red or blue in a pattern."""
+    red, blue = _types(context)
+    design = DesignScene(context, track_width=2, tracks=tracks, height=height)
+    rows, cols = numpy.nonzero(numpy.ones(design.cells.shape, dtype=bool))
+    design.set_cells(rows, cols, numpy.where((rows + cols) % 3, design.palette_index(red), design.palette_index(blue)))
+    return design
+
+
+def _counts_match(design):
+    counts = numpy.bincount(design.cells.ravel(), minlength=len(design.palette))
+    return (design.bead_counts() == counts).all()
+
+
+def test_adding_rows_keeps_the_beads_and_grows_in_place(context):
+    design = _numbered(context)
+    before = design.cells.copy()
+
+    design.resize(height=5)
+    buffer = design._row_buffer
+    assert design.dimensions == (6, 5)
+    assert (design.cells[:4] == before).all() and not design.cells[4].any()
+
+    # The buffer was made with room to spare, the next rows don't copy anything.
+    design.resize(height=6)
+    assert design._row_buffer is buffer and design.cells.base is buffer
+    assert (design.cells[:4] == before).all() and not design.cells[4:].any()
+    assert _counts_match(design)
+
+
+def test_rows_cut_off_and_added_back_come_back_blank(context):
+    design = _numbered(context)
+    before = design.cells.copy()
+
+    design.resize(height=2)
+    design.resize(height=4)
+    assert (design.cells[:2] == before[:2]).all() and not design.cells[2:].any()
+    assert _counts_match(design)
+
+
+def test_resizing_tracks_keeps_the_beads(context):
+    design = _numbered(context)
+    before = design.cells.copy()
+
+    design.resize(tracks=4)
+    assert design.dimensions == (8, 4) and design.tracks == 4
+    assert (design.cells[:, :6] == before).all() and not design.cells[:, 6:].any()
+
+    design.resize(tracks=2, height=3)
+    assert (design.cells == before[:3, :4]).all()
+    assert _counts_match(design)
+
+
+def test_crop_keeps_the_block_it_is_given(context):
+    design = _numbered(context, tracks=5, height=6)
+    before = design.cells.copy()
+
+    design.crop(2, 1, 2, 4)
+    assert design.dimensions == (4, 4)
+    assert (design.cells == before[1:5, 4:8]).all()
+    assert _counts_match(design)
+
+    # Past the old edges the design comes in blank.
+    design.crop(0, 2, 4, 4)
+    assert (design.cells[:2, :4] == before[3:5, 4:8]).all()
+    assert not design.cells[2:].any() and not design.cells[:, 4:].any()
+    assert _counts_match(design)
+
+
+def test_crop_refuses_to_start_on_a_shifted_track(context):
+    design = _numbered(context)
+    with pytest.raises(ValueError):
+        design.crop(1, 0, 2, 4)
+
+    with pytest.raises(ValueError):
+        design.resize(tracks=0)
+
+
+def _images(symmetry, design, rows, cols):
+    rows, cols, values = symmetry.expand(design, numpy.array(rows), numpy.array(cols), numpy.arange(0, len(rows)))
+    return sorted(zip(values.tolist(), rows.tolist(), cols.tolist()))
+
+
+@pytest.mark.parametrize('tracks', [3, 4])
+def test_symmetry_mirrors_and_rotations(context, tracks):
+    design = DesignScene(context, track_width=2, tracks=tracks, height=5)
+    width, height = design.dimensions
+    rows, cols = [0, 1, 4, 2], [0, 3, 2, width - 1]
+
+    # Left to right every bead keeps its row, even where a straight track lands on a shifted one.
+    expected = [(value, row, width - 1 - col) for value, (row, col) in enumerate(zip(rows, cols))]
+    assert _images(Symmetry(horizontal=True), design, rows, cols) == sorted(
+        expected + [(value, row, col) for value, (row, col) in enumerate(zip(rows, cols))])
+
+    for symmetry, image in ((Symmetry(vertical=True), lambda row, col: (height - 1 - row, col)),
+                            (Symmetry(folds=2), lambda row, col: (height - 1 - row, width - 1 - col))):
+        expected = [(value, row, col) for value, (row, col) in enumerate(zip(rows, cols))]
+        expected += [(value,) + image(row, col) for value, (row, col) in enumerate(zip(rows, cols))]
+        assert _images(symmetry, design, rows, cols) == sorted(expected)
+
+
+def test_symmetry_keeps_the_edit_last_and_drops_images_outside(context):
+    design = DesignScene(context, track_width=2, tracks=3, height=12)
+    rows, cols, values = Symmetry(folds=4).expand(design, numpy.array([0]), numpy.array([0]), numpy.array([7]))
+
+    # The design is much taller than it is wide, a quarter turn of a corner leaves it.
+    assert len(rows) < 4
+    assert (rows[-1], cols[-1], values[-1]) == (0, 0, 7)
+    assert ((rows >= 0) & (rows < 12) & (cols >= 0) & (cols < 6)).all()
+
+
+def test_symmetric_edits_undo_as_one_step(context):
+    red = _types(context)[0]
+    design = DesignScene(context, track_width=2, tracks=4, height=4)
+    design.set_cells([1], [1], design.palette_index(red), Symmetry(horizontal=True, vertical=True))
+
+    assert sorted(zip(*[axis.tolist() for axis in numpy.nonzero(design.cells)])) == [(1, 1), (1, 6), (2, 1), (2, 6)]
+    design.undo()
+    assert not design.cells.any() and not design.history.can_undo()
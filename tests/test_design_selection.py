@@ -0,0 +1,55 @@
+import numpy
+
+from design_model import DesignScene
+
+
+def _design(context, tracks):
+    design = DesignScene(context, track_width=3, tracks=tracks, height=4)
+    red = design.palette_index(context.catalog.find_type('R-1'))
+    blue = design.palette_index(context.catalog.find_type('B-1'))
+    rows, cols = numpy.nonzero(numpy.ones(design.cells.shape, dtype=bool))
+    design.set_cells(rows, cols, numpy.where((rows + cols) % 3 == 0, red, numpy.where(cols % 2, blue, 0)))
+    return design
+
+
+def test_mirror_keeps_unselected_neighbours(context):
+    design = _design(context, 3)
+    before = design.cells.copy()
+
+    design.select_rect(1, 0, 3, 1)
+    design.mirror_selection(True)
+
+    expected = before.copy()
+    expected[0, 1], expected[0, 2] = before[0, 2], before[0, 1]
+    assert (design.cells == expected).all()
+    assert design.selection.bounds() == (1, 0, 3, 1)
+
+
+def test_mirror_stays_in_the_selection_with_even_tracks(context):
+    design = _design(context, 4)
+    before = design.cells.copy()
+
+    for horizontal in (True, False):
+        design.select_rect(0, 1, 6, 3)
+        design.mirror_selection(horizontal)
+
+        outside = numpy.ones(before.shape, dtype=bool)
+        outside[1:3, 0:6] = False
+        assert (design.cells[outside] == before[outside]).all()
+        assert sorted(design.cells[1:3, 0:6].ravel().tolist()) == sorted(before[1:3, 0:6].ravel().tolist())
+
+        design.mirror_selection(horizontal)
+        assert (design.cells == before).all()
+
+
+def test_mirror_of_an_irregular_selection_moves_the_selection(context):
+    design = _design(context, 3)
+    before = design.cells.copy()
+
+    design.select([0, 0, 1], [0, 1, 0])
+    design.mirror_selection(True)
+
+    assert sorted(zip(*[axis.tolist() for axis in design.selection.cells()])) == [(0, 0), (0, 1), (1, 1)]
+    assert design.cells[0, 0] == before[0, 1] and design.cells[0, 1] == before[0, 0]
+    assert design.cells[1, 1] == before[1, 0] and design.cells[1, 0] == 0
+    assert (design.cells[:, 2:] == before[:, 2:]).all() and (design.cells[2:] == before[2:]).all()
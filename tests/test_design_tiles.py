@@ -0,0 +1,128 @@
+import numpy
+import pytest
+
+from design_tiles import TiledCells, write_tiles
+
+TILE = 4
+
+
+def _header(width=10, height=9, palette=1):
+    return {'__info__': {'__name__': 'tiled', '__track_width__': 2, '__tracks__': width // 2, '__height__': height},
+            '__palette__': [{'__catalog_number__': 'n/a'}] + [{'__catalog_number__': str(index)}
+                                                               for index in range(1, palette)]}
+
+
+@pytest.fixture
+def cells():
+    return numpy.random.default_rng(7).integers(0, 5, (9, 10)).astype(numpy.uint16)
+
+
+@pytest.fixture
+def path(tmp_path, cells):
+    path = str(tmp_path / 'design.peyt')
+    write_tiles(path, _header(), cells, tile=TILE)
+    return path
+
+
+def _file_tiles(path):
+    """The bytes of the file after the header."""
+    tiles = TiledCells(path)
+    offset = tiles._data_offset
+    tiles.close()
+    with open(path, 'rb') as file:
+        return file.read()[offset:]
+
+
+def test_reads_like_an_array(path, cells):
+    tiles = TiledCells(path)
+    assert tiles.shape == cells.shape
+    assert (numpy.asarray(tiles) == cells).all()
+    assert (tiles[2:7, 3:9] == cells[2:7, 3:9]).all()
+    assert (tiles[5, 1:10] == cells[5, 1:10]).all()
+    assert tiles[8, 9] == cells[8, 9]
+
+    rows, cols = numpy.array([0, 8, 4, 4]), numpy.array([9, 0, 4, 3])
+    assert (tiles[rows, cols] == cells[rows, cols]).all()
+    assert (tiles[rows[:, None], cols[None, :]] == cells[rows[:, None], cols[None, :]]).all()
+    tiles.close()
+
+
+def test_cache_stays_within_its_budget(path, cells):
+    tiles = TiledCells(path, budget=2 * TILE * TILE * 2)
+    for row in range(0, 9):
+        assert (tiles[row, 0:10] == cells[row]).all()
+        assert len(tiles._pages) <= 2
+
+    tiles.close()
+
+
+def test_edits_only_reach_the_file_when_flushed(path, cells):
+    before = _file_tiles(path)
+    tiles = TiledCells(path, budget=TILE * TILE * 2)
+    tiles[0:9, 0:10] = 3
+    tiles[[1, 6], [2, 8]] = 4
+
+    # Only one tile fits in memory, the others were spilled while edited.
+    assert len(tiles._spilled) >= 8
+    assert _file_tiles(path) == before
+
+    expected = numpy.full(cells.shape, 3, dtype=numpy.uint16)
+    expected[[1, 6], [2, 8]] = 4
+    assert (numpy.asarray(tiles) == expected).all()
+
+    tiles.flush()
+    tiles.close()
+    tiles = TiledCells(path)
+    assert (numpy.asarray(tiles) == expected).all()
+    tiles.close()
+
+
+def test_closing_without_flushing_drops_the_edits(path):
+    before = _file_tiles(path)
+    tiles = TiledCells(path, budget=TILE * TILE * 2)
+    tiles[0:9, 0:10] = 1
+    tiles.close()
+    assert _file_tiles(path) == before
+
+
+def test_flush_writes_spilled_and_resident_tiles(path, cells):
+    tiles = TiledCells(path, budget=2 * TILE * TILE * 2)
+    expected = cells.copy()
+
+    # (0, 0) and (0, 1) are edited and spilled, then (0, 0) is read back and edited
+    # again so its newest version is only in memory while (0, 1) is only spilled.
+    for value, (rows, cols) in ((1, (slice(0, 2), slice(0, 2))), (2, (slice(0, 2), slice(4, 6))),
+                                (3, (slice(8, 9), slice(8, 10))), (4, (slice(8, 9), slice(0, 2))),
+                                (5, (slice(1, 3), slice(1, 3)))):
+        tiles[rows, cols] = value
+        expected[rows, cols] = value
+
+    assert (0, 0) in tiles._spilled and (0, 0) in tiles._dirty
+    assert (0, 1) in tiles._spilled and (0, 1) not in tiles._pages
+
+    tiles.flush()
+    assert not tiles._spilled and not tiles._dirty
+    tiles.close()
+
+    tiles = TiledCells(path)
+    assert (numpy.asarray(tiles) == expected).all()
+    tiles.close()
+
+
+def test_a_growing_header_moves_the_tiles(path, cells):
+    tiles = TiledCells(path)
+    old_offset = tiles._data_offset
+    tiles[4, 4] = 2
+    expected = cells.copy()
+    expected[4, 4] = 2
+
+    header = _header(palette=8000)
+    tiles.flush(header)
+    assert tiles._data_offset > old_offset
+    assert (numpy.asarray(tiles) == expected).all()
+    tiles.close()
+
+    tiles = TiledCells(path)
+    assert len(tiles.header['__palette__']) == 8000
+    assert (numpy.asarray(tiles) == expected).all()
+    tiles.close()
@@ -0,0 +1,69 @@
+import io
+
+import numpy
+
+from design_model import DesignScene
+from word_chart import export_word_chart, word_chart, write_text
+
+
+def _design(context, tracks, cells, name='Chart'):
+    design = DesignScene(context, name=name, track_width=1, tracks=tracks, height=len(cells))
+    red = design.palette_index(context.catalog.find_type('R-1'))
+    blue = design.palette_index(context.catalog.find_type('B-1'))
+    values = numpy.array([[{'R': red, 'B': blue, '.': 0}[bead] for bead in row] for row in cells])
+    rows, cols = numpy.nonzero(numpy.ones(values.shape, dtype=bool))
+    design.set_cells(rows, cols, values[rows, cols])
+    return design
+
+
+def _rows(chart):
+    return [(row.label, 'R' if row.left_to_right else 'L', row.runs, row.turn) for row in chart]
+
+
+def test_rows_alternate_between_the_upper_and_lower_tracks(context):
+    design = _design(context, 4, ['RBRR', 'BB.R'])
+    assert _rows(word_chart(design, combine_first=False)) == [
+        ('Row 1', 'R', [(1, 2)], False),
+        ('Row 2', 'L', [(1, 1), (2, 1)], False),
+        ('Row 3', 'R', [(2, 1), (0, 1)], False),
+        ('Row 4', 'L', [(1, 1), (2, 1)], False)]
+
+
+def test_the_first_two_rows_can_be_combined(context):
+    design = _design(context, 4, ['RBRR', 'BB.R'])
+    assert _rows(word_chart(design, left_to_right=False)) == [
+        ('Rows 1 & 2', 'L', [(1, 2), (2, 1), (1, 1)], False),
+        ('Row 3', 'R', [(2, 1), (0, 1)], False),
+        ('Row 4', 'L', [(1, 1), (2, 1)], False)]
+
+
+def test_odd_count_turns_are_flagged(context):
+    design = _design(context, 3, ['RBR', 'BRB', 'RBR'])
+    chart = list(word_chart(design, combine_first=False))
+    assert [row.label for row in chart if row.turn] == ['Row 3', 'Row 5']
+
+    even = _design(context, 4, ['RBRB', 'BRBR', 'RBRB'])
+    assert not any(row.turn for row in word_chart(even, combine_first=False))
+
+
+def test_text_and_html_output(context, tmp_path):
+    design = _design(context, 4, ['RBRR', 'BB.R'], name='Stripes & dots')
+
+    stream = io.StringIO()
+    write_text(design, word_chart(design), stream)
+    assert stream.getvalue().splitlines() == [
+        'Stripes & dots',
+        '4 tracks, 2 beads tall, even count peyote',
+        '',
+        'Rows 1 & 2 (R): 1 x Red (R-1), 1 x Blue (B-1), 2 x Red (R-1)',
+        'Row 3 (L): 1 x blank (n/a), 1 x Blue (B-1)',
+        'Row 4 (R): 1 x Blue (B-1), 1 x Red (R-1)']
+
+    path = str(tmp_path / 'chart.html')
+    export_word_chart(design, path)
+    with open(path, encoding='utf-8') as file:
+        page = file.read()
+
+    assert '<title>Stripes &amp; dots</title>' in page
+    assert page.count('<tr>') == 3
+    assert '#cc2020' in page
@@ -7,12 +7,20 @@ from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 
+from collections import OrderedDict
+
+import math
+
+from profiling import instrumented
+
 bead_painter = QPainter()
 
 X = WIDTH  = COL = 0
 Y = HEIGHT = ROW = 1
 
 design_extension = '.peyd'
+tiled_design_extension = '.peyt'
+design_save_filter = 'Peyote Design (*{});;Tiled Peyote Design (*{})'.format(design_extension, tiled_design_extension)
 collection_extension = '.peyc'
 
 MATTE = 0
@@ -39,3 +47,69 @@ def brush_factory(base_color, highlight_color, texture):
         brush = QBrush(base_color)
 
     return brush
+
+
+
+class BeadPixmapCache(object):
+    """Process wide cache of rendered bead pixmaps. Pixmaps are keyed by their
+    appearance and the resolution they are drawn at, so identical beads share one
+    pixmap and zooming draws a pixmap rendered at the right size instead of
+    scaling the 28x40 one. The least recently used pixmaps are dropped once the
+    cache grows past budget bytes."""
+    dimension = (28, 40)
+    zoom_steps = 8
+
+    def __init__(self, budget=32 * 1024 * 1024):
+        self.budget = budget
+        self._pixmaps = OrderedDict()
+        self._bytes = 0
+
+    def zoom_bucket(self, zoom):
+        """Rounds zoom up to the next step so the pixmap is never scaled up much."""
+        return max(1, math.ceil(zoom * self.zoom_steps - 1e-6)) / self.zoom_steps
+
+    def pixmap(self, base_color, highlight_color, texture, zoom=1.0, device_scale=1.0):
+        """Returns the pixmap of a bead, its logical size is always 28x40."""
+        key = (QColor(base_color).rgba(), QColor(highlight_color).rgba(), texture, device_scale, self.zoom_bucket(zoom))
+
+        try:
+            self._pixmaps.move_to_end(key)
+            return self._pixmaps[key]
+
+        except KeyError:
+            pixmap = self._render(key)
+            self._pixmaps[key] = pixmap
+            self._bytes += pixmap.width() * pixmap.height() * 4
+
+            while self._bytes > self.budget and len(self._pixmaps) > 1:
+                (old_key, old) = self._pixmaps.popitem(last=False)
+                self._bytes -= old.width() * old.height() * 4
+
+            return pixmap
+
+    @instrumented('pixmap')
+    def _render(self, key):
+        global bead_painter
+        base_color, highlight_color, texture, device_scale, zoom = key
+        scale = device_scale * zoom
+
+        pixmap = QPixmap(math.ceil(self.dimension[WIDTH] * scale), math.ceil(self.dimension[HEIGHT] * scale))
+        pixmap.fill(QColor(0, 0, 0, 0))
+
+        # paint the bead...
+        bead_painter.begin(pixmap)
+        bead_painter.scale(scale, scale)
+
+        bead_painter.setPen(QColor(170, 170, 168))
+        bead_painter.setBrush(brush_factory(QColor.fromRgba(base_color), QColor.fromRgba(highlight_color), texture))
+        # TODO: shape this nicer.
+        bead_painter.drawRoundedRect(0, 0, 27, 39, 5, 5)
+
+        bead_painter.end()
+
+        # Makes the pixmap cover 28x40 units whatever resolution it was rendered at.
+        pixmap.setDevicePixelRatio(scale)
+        return pixmap
+
+
+bead_pixmaps = BeadPixmapCache()
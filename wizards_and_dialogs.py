@@ -11,6 +11,7 @@ from design_model import *
 from design_widget import *
 
 import catalog_widget
+import numpy
 
 
 
@@ -34,9 +35,7 @@ class NewWizard(QWizard):
 
         # Creating the new design and adding it to the main window
         new_design = DesignScene(self.mw, name=name, track_width=track_width, tracks=width, height=height)
-        new_area = PatternArea(design=new_design)
-        self.mw.mdi_widget.addSubWindow(new_area)
-        new_area.update()
+        self.mw.add_design(new_design)
 
         super(NewWizard, self).accept()
 
@@ -74,6 +73,196 @@ class DesignSpecsPage(QWizardPage):
 
 
 
+class ImportImageWizard(QWizard):
+    """This one creates new designs from pictures."""
+    def __init__(self, mw, parent=None):
+        super(ImportImageWizard, self).__init__(parent)
+        self.specs_page = ImageSpecsPage(mw.catalog)
+        self.addPage(self.specs_page)
+
+        self.setWindowTitle('Importing an Image')
+        self.mw = mw
+
+
+    def accept(self):
+        # Only loaded when somebody actually imports an image.
+        from image_import import image_to_cells
+
+        image = QImage(self.field('image_path'))
+        bead_types = self.specs_page.selected_bead_types()
+        if image.isNull() or not bead_types:
+            QMessageBox.warning(self, 'Import Image', 'Pick an image and at least one collection with beads in it.')
+            return
+
+        track_width = self.field('track_width')
+        tracks = self.field('width')
+        cells = image_to_cells(image, bead_types, tracks, track_width, dither=self.field('dither'))
+
+        new_design = DesignScene(self.mw, name=self.field('design_name'), track_width=track_width, tracks=tracks,
+                                 height=cells.shape[0])
+        lut = numpy.array([new_design.palette_index(bead_type) for bead_type in bead_types], dtype=new_design.cells.dtype)
+        new_design.cells[:] = lut[cells]
+        new_design._recount()
+        self.mw.add_design(new_design)
+
+        super(ImportImageWizard, self).accept()
+
+
+
+class ImageSpecsPage(QWizardPage):
+    def __init__(self, catalog, parent=None):
+        super(ImageSpecsPage, self).__init__(parent)
+        self.setTitle('Image and Bead Specifications')
+        self.catalog = catalog
+
+    def initializePage(self):
+        form = QFormLayout()
+
+        image_path = QLineEdit()
+        browse_button = QPushButton('Browse...')
+        browse_button.clicked.connect(lambda: self.browse(image_path))
+        path_box = QHBoxLayout()
+        path_box.addWidget(image_path)
+        path_box.addWidget(browse_button)
+        form.addRow('Image:', path_box)
+        self.registerField('image_path*', image_path)
+
+        design_name = QLineEdit()
+        form.addRow('Design name:', design_name)
+        self.registerField('design_name*', design_name)
+
+        track_width = QSpinBox()
+        track_width.setMaximum(4)
+        track_width.setMinimum(1)
+        form.addRow('Drop Width:', track_width)
+        self.registerField('track_width', track_width)
+
+        width = QSpinBox()
+        width.setMinimum(1)
+        width.setMaximum(10000)
+        width.setValue(40)
+        form.addRow('Number of Drops:', width)
+        self.registerField('width', width)
+
+        # Only the ticked collections are matched against.
+        self.collections = QListWidget()
+        for index in range(0, self.catalog.topLevelItemCount()):
+            collection = self.catalog.topLevelItem(index)
+            item = QListWidgetItem(collection.data(0, Qt.DisplayRole))
+            item.setData(Qt.UserRole, index)
+            item.setCheckState(Qt.Checked)
+            self.collections.addItem(item)
+
+        form.addRow('Collections:', self.collections)
+
+        dither = QCheckBox('Dither')
+        form.addRow('', dither)
+        self.registerField('dither', dither)
+
+        self.setLayout(form)
+
+    def browse(self, line_edit):
+        (path, flt) = QFileDialog.getOpenFileName(self, 'Import Image', '',
+                                                  'Images (*.png *.jpg *.jpeg *.bmp *.gif)')
+        if flt != '':
+            line_edit.setText(path)
+
+    def selected_bead_types(self):
+        bead_types = []
+        for row in range(0, self.collections.count()):
+            item = self.collections.item(row)
+            if item.checkState() == Qt.Checked:
+                bead_types += self.catalog.topLevelItem(item.data(Qt.UserRole)).bead_types
+
+        return bead_types
+
+
+
+class ResizeDialog(QDialog):
+    """Changes the dimensions of an open design, when cropping the first track
+    and row to keep can be picked as well."""
+    def __init__(self, design, crop=False, parent=None):
+        super(ResizeDialog, self).__init__(parent)
+        self.design = design
+        self.setWindowTitle('Crop Design' if crop else 'Resize Design')
+        form = QFormLayout()
+
+        self.first_track, self.first_row = QSpinBox(), QSpinBox()
+        self.first_track.setRange(0, design.tracks - 1)
+        # The shifted tracks have to stay shifted.
+        self.first_track.setSingleStep(2)
+        self.first_row.setRange(0, design.dimensions[HEIGHT] - 1)
+        if crop:
+            form.addRow('First drop:', self.first_track)
+            form.addRow('First row:', self.first_row)
+
+        self.tracks, self.height = QSpinBox(), QSpinBox()
+        self.tracks.setRange(1, design.tracks if crop else 10000)
+        self.tracks.setValue(design.tracks)
+        form.addRow('Number of Drops:', self.tracks)
+        self.height.setRange(1, design.dimensions[HEIGHT] if crop else 100000)
+        self.height.setValue(design.dimensions[HEIGHT])
+        form.addRow('Height:', self.height)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        form.addRow(buttons)
+        self.setLayout(form)
+
+
+    def accept(self):
+        try:
+            self.design.crop(self.first_track.value(), self.first_row.value(), self.tracks.value(), self.height.value())
+
+        except ValueError as error:
+            QMessageBox.warning(self, self.windowTitle(), str(error))
+            return
+
+        super(ResizeDialog, self).accept()
+
+
+
+class RepeatDialog(QDialog):
+    """Stamps the selected beads a number of times, each copy a number of drops
+    and rows on from the one before, for example to repeat a motif along a bracelet."""
+    def __init__(self, design, parent=None):
+        super(RepeatDialog, self).__init__(parent)
+        self.design = design
+        self.setWindowTitle('Repeat Selection')
+        col_from, row_from, col_to, row_to = design.selection.bounds()
+        form = QFormLayout()
+
+        self.count = QSpinBox()
+        self.count.setRange(1, 100000)
+        self.count.setValue(1)
+        form.addRow('Copies:', self.count)
+
+        self.track_step, self.row_step = QSpinBox(), QSpinBox()
+        self.track_step.setRange(-design.tracks, design.tracks)
+        self.row_step.setRange(-design.dimensions[HEIGHT], design.dimensions[HEIGHT])
+        # Straight after the selection, downwards.
+        self.row_step.setValue(row_to - row_from)
+        form.addRow('Drops between copies:', self.track_step)
+        form.addRow('Rows between copies:', self.row_step)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        form.addRow(buttons)
+        self.setLayout(form)
+
+
+    def accept(self):
+        col_from, row_from, col_to, row_to = self.design.selection.bounds()
+        steps = numpy.arange(1, self.count.value() + 1)
+        origins = numpy.stack([col_from + steps * self.track_step.value() * self.design.track_width,
+                               row_from + steps * self.row_step.value()], axis=1)
+        self.design.stamp(self.design.copy_selection(), origins)
+        super(RepeatDialog, self).accept()
+
+
+
 class CollectionWizard(QWizard):
     def __init__(self, catalog, parent=None):
         super(CollectionWizard, self).__init__(parent)
@@ -295,18 +484,10 @@ class DemoBead(QGraphicsView):
                                    self.highlight_button.selected_color,
                                    self.texture)
 
-        # Prepares the pixmap surface
-        pixmap = QPixmap(28, 40)
-        pixmap.fill(QColor(0, 0, 0, 0))
-
-        # Paint on the pixmap
-        bead_painter.begin(pixmap)
-
-        bead_painter.setPen(QColor(170, 170, 168))
-        bead_painter.setBrush(self.brush)
-        bead_painter.drawRoundedRect(0, 0, 27, 39, 5, 5)
-
-        bead_painter.end()
+        # Fetch the shared pixmap for these settings
+        pixmap = bead_pixmaps.pixmap(self.base_button.selected_color,
+                                     self.highlight_button.selected_color,
+                                     self.texture)
 
         # Update class members
         self.brush_changed.emit()
@@ -0,0 +1,155 @@
+"""
+This module turns designs into word charts, the row by row reading
+instructions beaders work from ("Row 3 (R): 3 x Red, 2 x Blue"). Every second
+track sits half a bead lower (see Bead.offset), so one row of the beadwork
+picks up a bead from every second track: the first row is the upper tracks of
+the first row of cells, the second row is the lower tracks, and so on. Rows
+are read in alternating directions like they are beaded.
+
+The rows are produced lazily by a generator and written out one at a time, so
+the chart of a design is never held in memory as a whole.
+"""
+from PyQt5.QtCore import *
+
+import html
+import os
+
+import numpy
+
+from util import *
+
+_BLOCK_ROWS = 256
+
+html_extensions = ('.html', '.htm')
+
+
+
+class ChartRow(object):
+    """One row of a word chart. runs is [(palette index, count)] in the order
+    the beads are picked up."""
+    __slots__ = ('numbers', 'left_to_right', 'runs', 'turn')
+
+    def __init__(self, numbers, left_to_right, runs, turn=False):
+        self.numbers, self.left_to_right, self.runs, self.turn = numbers, left_to_right, runs, turn
+
+    @property
+    def label(self):
+        if len(self.numbers) == 1:
+            return 'Row {}'.format(self.numbers[0])
+
+        return 'Rows {} & {}'.format(*self.numbers)
+
+    @property
+    def beads(self):
+        return sum(count for index, count in self.runs)
+
+    def __repr__(self):
+        return '<ChartRow {} {} {}>'.format(self.label, 'R' if self.left_to_right else 'L', self.runs)
+
+
+
+def _runs(values):
+    """Run length encodes a row of palette indices into [(index, count)]."""
+    starts = numpy.flatnonzero(values[1:] != values[:-1]) + 1
+    counts = numpy.diff(numpy.concatenate(([0], starts, [len(values)])))
+    return list(zip(values[numpy.concatenate(([0], starts))].tolist(), counts.tolist()))
+
+
+def word_chart(design, left_to_right=True, combine_first=True):
+    """Yields the ChartRows of design from the top down.
+
+    left_to_right is the direction of the first row, the rows after it alternate.
+    With combine_first the first two rows are given as one, the way they are strung
+    on to start the piece. Designs with an odd number of tracks are worked in
+    odd-count peyote, the rows that have to start with an edge bead on the side the
+    previous row finished on are flagged with turn."""
+    width, height = design.dimensions
+    if not width or not height:
+        return
+
+    tracks = numpy.arange(width) // design.track_width
+    upper, lower = numpy.flatnonzero(tracks % 2 == 0), numpy.flatnonzero(tracks % 2 == 1)
+    odd_count = design.tracks % 2 == 1
+    last_track = design.tracks - 1
+
+    number, direction = 1, left_to_right
+    previous_end = None
+    for block_start in range(0, height, _BLOCK_ROWS):
+        # Tiled designs are only ever read a block of rows at a time.
+        block = numpy.asarray(design.cells[block_start:block_start + _BLOCK_ROWS, 0:width])
+
+        for offset in range(block.shape[0]):
+            cells = block[offset]
+
+            if combine_first and block_start + offset == 0:
+                row = cells if direction else cells[::-1]
+                yield ChartRow((1, 2), direction, _runs(row))
+                number, direction, previous_end = 3, not direction, None
+                continue
+
+            for columns in (upper, lower):
+                if not len(columns):
+                    continue
+
+                if not direction:
+                    columns = columns[::-1]
+
+                first, last = tracks[columns[0]], tracks[columns[-1]]
+                # The previous row stopped a track short of the edge this row starts on.
+                turn = bool(odd_count and previous_end is not None and first in (0, last_track)
+                            and abs(previous_end - first) == 1)
+                yield ChartRow((number,), direction, _runs(cells[columns]), turn)
+                number, direction, previous_end = number + 1, not direction, last
+
+
+def _bead_name(bead_type):
+    return '{} ({})'.format(bead_type.data(0, Qt.DisplayRole), bead_type.data(1, Qt.DisplayRole))
+
+
+def write_text(design, rows, stream):
+    """Writes the rows as plain text, one line per row."""
+    names = [_bead_name(bead_type) for bead_type in design.palette]
+    stream.write('{}\n{} tracks, {} beads tall, {} count peyote\n\n'.format(
+        design.name, design.tracks, design.dimensions[HEIGHT], 'odd' if design.tracks % 2 else 'even'))
+
+    for row in rows:
+        stream.write('{} ({}): {}{}\n'.format(row.label, 'R' if row.left_to_right else 'L',
+                                              ', '.join('{} x {}'.format(count, names[index]) for index, count in row.runs),
+                                              ' - odd-count turn' if row.turn else ''))
+
+
+def write_html(design, rows, stream):
+    """Writes the rows as an HTML page with a colour swatch for every run."""
+    names = [html.escape(_bead_name(bead_type)) for bead_type in design.palette]
+    title = html.escape(design.name)
+    stream.write('<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n<title>{}</title>\n'
+                 '<style>\n'
+                 'body {{ font-family: sans-serif; }}\n'
+                 '.s {{ display: inline-block; width: 0.7em; height: 1em; border: 1px solid #666; '
+                 'vertical-align: middle; margin-right: 0.2em; }}\n'
+                 'td {{ padding: 0.1em 0.5em; vertical-align: top; }}\n'
+                 '</style>\n</head>\n<body>\n<h1>{}</h1>\n<p>{} tracks, {} beads tall, {} count peyote</p>\n'
+                 '<table>\n'.format(title, title, design.tracks, design.dimensions[HEIGHT],
+                                    'odd' if design.tracks % 2 else 'even'))
+
+    swatches = ['<span class="s" style="background: {}"></span>'.format(html.escape(bead_type.base_color))
+                for bead_type in design.palette]
+    for row in rows:
+        stream.write('<tr><td>{}</td><td>{}</td><td>{}{}</td></tr>\n'.format(
+            html.escape(row.label), 'R' if row.left_to_right else 'L',
+            ', '.join('{}{} x {}'.format(swatches[index], count, names[index]) for index, count in row.runs),
+            ' <em>odd-count turn</em>' if row.turn else ''))
+
+    stream.write('</table>\n</body>\n</html>\n')
+
+
+def export_word_chart(design, path, left_to_right=True, combine_first=True):
+    """Writes the word chart of design to path, as HTML if path ends in .html
+    and as plain text otherwise."""
+    rows = word_chart(design, left_to_right, combine_first)
+    with open(path, 'w', encoding='utf-8') as stream:
+        if os.path.splitext(path)[1].lower() in html_extensions:
+            write_html(design, rows, stream)
+
+        else:
+            write_text(design, rows, stream)